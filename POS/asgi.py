@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'POS.settings')
+# Each ASGI request runs its queries in its own thread; persistent connections would pile up per thread
+os.environ.setdefault('POS_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,15 +42,118 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'pos_app.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'pos_app.replicas.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-view query/latency instrumentation (see pos_app/instrumentation.py).
+# Inspect the collected statistics with: python manage.py dump_instrumentation
+POS_INSTRUMENTATION = {
+    'ENABLED': DEBUG,
+    'SERVER_TIMING': True,
+    'N_PLUS_ONE_THRESHOLD': 5,
+    'WINDOW': 500,
+    'DUMP_DIR': BASE_DIR / 'var' / 'instrumentation',
+    'FLUSH_INTERVAL': 30,
+}
+
+# Process-local product catalog cache (see pos_app/catalog.py)
+POS_CATALOG_CACHE = {
+    'MAX_ITEMS': 50000,
+    'VERSION_CHECK_INTERVAL': 5,
+}
+
+# Till carts are kept outside the session (see pos_app/cart.py). The in-process backend only works
+# when each till's requests reach the same process; with several worker processes use Redis:
+#   'BACKEND': 'pos_app.cart.RedisCartBackend', 'OPTIONS': {'URL': 'redis://localhost:6379/0'}
+POS_CART = {
+    'BACKEND': 'pos_app.cart.LocMemCartBackend',
+    'TTL': 8 * 60 * 60,
+    'OPTIONS': {},
+}
+
+# Live stock and price events for the tills (see pos_app/events.py), streamed from /sale/events/ under ASGI.
+# The local fan-out only reaches tills connected to the same process; with several workers use Redis:
+#   'BACKEND': 'pos_app.events.RedisFanout', 'OPTIONS': {'URL': 'redis://localhost:6379/0'}
+POS_EVENTS = {
+    'BACKEND': 'pos_app.events.LocalFanout',
+    'OPTIONS': {},
+    'QUEUE_SIZE': 1000,
+    'HISTORY': 1000,
+    'HEARTBEAT': 15,
+}
+
+# Background jobs for reports, exports, imports and rollup maintenance (see pos_app/jobs.py).
+# 'worker' leaves them to `python manage.py run_jobs`; 'thread' runs them in a thread of each web
+# process (single-process setups such as runserver); 'eager' runs them inside the request.
+POS_JOBS = {
+    'MODE': os.environ.get('POS_JOBS_MODE', 'worker'),
+    'RESULT_DIR': BASE_DIR / 'var' / 'jobs',
+    'POLL_INTERVAL': 1.0,
+    'HEARTBEAT_TIMEOUT': 120,
+    'MAX_ATTEMPTS': 3,
+    'KEEP_DAYS': 7,
+}
+
+# Shared cache for page data and template fragments (see pos_app/pagecache.py); choose the backend with
+# POS_CACHE_BACKEND: 'locmem' (one process), 'file' (shared by the processes of one host) or 'redis'
+POS_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pos',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'var' / 'cache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('POS_REDIS_URL', 'redis://localhost:6379/1'),
+    },
+}
+CACHES = {
+    'default': {
+        **POS_CACHE_BACKENDS[os.environ.get('POS_CACHE_BACKEND', 'locmem')],
+        'TIMEOUT': 600,
+    },
+}
+
+# Sessions are read through the cache, so a repeat page load does not query the session table
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Versioned page and fragment caching; a product, category, sale or stock change bumps the
+# versions it affects, so cached pages are never served stale
+POS_PAGE_CACHE = {
+    'ALIAS': 'default',
+    'TIMEOUT': 600,
+}
+
+# Columnar analytics store behind the profit section of the sales report (see pos_app/analytics.py;
+# requires NumPy). New sale lines are appended by `python manage.py refresh_analytics` or a background job.
+POS_ANALYTICS = {
+    'DIRECTORY': BASE_DIR / 'var' / 'analytics',
+    'BATCH_SIZE': 50000,
+    'SETTLE_SECONDS': 60,
+}
+
+# Demand forecasts and reorder points (see pos_app/forecasting.py; requires NumPy), recomputed daily by
+# `python manage.py forecast_demand`
+POS_FORECAST = {
+    'HISTORY_DAYS': 56,
+    'LEAD_TIME_DAYS': 7,
+    'REVIEW_DAYS': 7,
+    'SERVICE_FACTOR': 1.65,
+}
+
 ROOT_URLCONF = 'POS.urls'
 
 TEMPLATES = [
@@ -83,6 +187,79 @@ DATABASES = {
     }
 }
 
+# SQLite connection profiles; choose one with POS_SQLITE_PROFILE (default: performance).
+# 'performance' is meant for several tills sharing one database file:
+#   - journal_mode=WAL lets readers run while a checkout writes (WAL persists in the file once set)
+#   - synchronous=NORMAL only fsyncs at WAL checkpoints; a power cut can lose the last commits, never corrupt
+#   - busy_timeout waits for the write lock instead of failing with "database is locked"
+#   - cache_size (negative = KiB) and mmap_size keep the hot pages in memory
+#   - transaction_mode IMMEDIATE makes atomic() blocks (the checkout) take the write lock at BEGIN, so two
+#     checkouts queue on busy_timeout instead of deadlocking when both try to upgrade a read lock
+#   - CONN_MAX_AGE keeps each worker's connection (and its pragmas and page cache) between requests;
+#     POS/asgi.py sets POS_CONN_MAX_AGE=0 because ASGI runs each request's queries in a short-lived thread
+# 'default' is Django's stock configuration.
+POS_SQLITE_PROFILES = {
+    'default': {},
+    'performance': {
+        'CONN_MAX_AGE': int(os.environ.get('POS_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA temp_store=MEMORY'
+            ),
+            'transaction_mode': 'IMMEDIATE',
+        },
+    },
+}
+DATABASES['default'].update(POS_SQLITE_PROFILES[os.environ.get('POS_SQLITE_PROFILE', 'performance')])
+
+# Set POS_DB_ENGINE=postgresql to run against a local PostgreSQL server instead
+# (used to compare the checkout benchmark between SQLite and PostgreSQL)
+if os.environ.get('POS_DB_ENGINE') == 'postgresql':
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POS_DB_NAME', 'pos'),
+        'USER': os.environ.get('POS_DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('POS_DB_PASSWORD', ''),
+        'HOST': os.environ.get('POS_DB_HOST', 'localhost'),
+        'PORT': os.environ.get('POS_DB_PORT', '5432'),
+    }
+
+# Read replica for reports, exports and admin lists (see pos_app/replicas.py). With SQLite it is a copy of
+# the primary refreshed with the backup API (`python manage.py refresh_replica`); with PostgreSQL point
+# POS_REPLICA_HOST at a streaming replica. Tests read it through the default test database.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['reporting'] = {
+        **DATABASES['default'],
+        'NAME': BASE_DIR / 'var' / 'reporting.sqlite3',
+        # The copy is only read: no write lock at BEGIN, and query_only turns a stray write into an error
+        'OPTIONS': {
+            'init_command': ';'.join(filter(None, [
+                DATABASES['default'].get('OPTIONS', {}).get('init_command'), 'PRAGMA query_only=ON',
+            ])),
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+else:
+    DATABASES['reporting'] = {
+        **DATABASES['default'],
+        'HOST': os.environ.get('POS_REPLICA_HOST', DATABASES['default']['HOST']),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['pos_app.replicas.ReplicaRouter']
+
+# Reporting reads fall back to the primary while the replica trails it by more than MAX_LAG seconds
+POS_REPLICA = {
+    'ALIAS': 'reporting',
+    'MAX_LAG': 300,
+    'CHECK_INTERVAL': 15,
+    'PIN_SECONDS': 300,
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -1,90 +1,258 @@
 # Import Django admin module and all models from the current app
+from django import forms
 from django.contrib import admin
-from django.db.models import Sum, Count
+from django.core.exceptions import PermissionDenied
+from django.db.models import Sum, Count, F, DecimalField, OuterRef, Subquery
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
 from django.utils.html import format_html
-from django.urls import reverse
-from .models import Category, Product, Sale, SaleItem, Inventory
+from django.urls import path, reverse
+from .models import Category, Product, Sale, SaleItem, Inventory, StockMovement, StockForecast, Job
+from .pagination import EstimatedCountPaginator
+from . import forecasting, imports, jobs, replicas, stock
 
-# Inline admin for SaleItem to show items within Sale admin
+# Colours of the stock statuses in the changelists
+STATUS_COLORS = {
+    StockForecast.OUT: 'red',
+    StockForecast.REORDER: 'orange',
+    StockForecast.OK: 'green',
+    StockForecast.OVERSTOCK: 'blue',
+    StockForecast.IDLE: 'gray',
+}
+
+# Stock status of a product as a coloured label: against its stored forecast, or fixed thresholds without one
+def stock_status_html(quantity, product):
+    status = forecasting.stock_status(quantity, getattr(product, 'forecast', None))
+    label = dict(StockForecast.STATUS_CHOICES)[status]
+    if status == StockForecast.OUT:
+        return format_html('<span style="color: {};">{}</span>', STATUS_COLORS[status], label)
+    return format_html('<span style="color: {};">{} ({})</span>', STATUS_COLORS[status], label, quantity)
+
+# Changelists (GET) read from the reporting replica while it is current enough; actions and list edits (POST)
+# run on the primary, and the changelist a save redirects to reads the primary (replicas.ReplicaPinMiddleware)
+class ReplicaChangeListMixin:
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with replicas.reporting():
+            response = super().changelist_view(request, extra_context)
+            # A TemplateResponse runs the list queries when rendered, so render it inside the block
+            if hasattr(response, 'render'):
+                response.render()
+        return response
+
+# Inline admin for SaleItem to show items within Sale admin (read-only, see SaleAdmin)
 class SaleItemInline(admin.TabularInline):
     model = SaleItem
     extra = 0
-    readonly_fields = ('total_price',)
+    readonly_fields = ('product', 'quantity', 'unit_price', 'total_price')
     fields = ('product', 'quantity', 'unit_price', 'total_price')
 
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 # Admin configuration for Category model - manages product categories
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     # Fields to display in the admin list view
     list_display = ('name', 'description', 'product_count', 'total_value')
     # Fields that can be searched in admin
     search_fields = ('name', 'description')
 
+    def get_queryset(self, request):
+        # Compute product counts and stock value (price times exact stock) for every row in the changelist query
+        money = DecimalField(max_digits=16, decimal_places=2)
+        value = (
+            Product.objects.filter(category=OuterRef('pk'))
+            .annotate(_current_stock=stock.current_stock_expression())
+            .order_by().values('category')
+            .annotate(total=Sum(F('price') * F('_current_stock'), output_field=money))
+            .values('total')
+        )
+        return super().get_queryset(request).annotate(
+            _product_count=Count('product'),
+            _total_value=Subquery(value, output_field=money),
+        )
+
     def product_count(self, obj):
-        return obj.product_set.count()
+        return obj._product_count
     product_count.short_description = 'Products'
+    product_count.admin_order_field = '_product_count'
 
     def total_value(self, obj):
-        total = obj.product_set.aggregate(
-            total=Sum('price') * Sum('stock_quantity')
-        )['total'] or 0
+        total = obj._total_value or 0
         return f"₱{total:.2f}"
     total_value.short_description = 'Total Value'
+    total_value.admin_order_field = '_total_value'
+
+# Upload form for the product import page
+class ProductImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV or JSON Lines with the columns ' + ', '.join(imports.PRODUCT_COLUMNS))
+    format = forms.ChoiceField(choices=[('', 'From the file name')] + [(f, f.upper()) for f in imports.IMPORT_FORMATS],
+                               required=False)
+    dry_run = forms.BooleanField(required=False, help_text='Validate the file without changing any products')
+
+# Changelist filter on exact stock from the ledger (stock_quantity is only the last compacted level)
+class CurrentStockFilter(admin.SimpleListFilter):
+    title = 'stock'
+    parameter_name = 'stock'
+
+    def lookups(self, request, model_admin):
+        return [('out', 'Out of stock'), ('low', f'Below {forecasting.LOW_STOCK}'), ('in', 'In stock')]
+
+    def queryset(self, request, queryset):
+        # Filters the _current_stock annotation of ProductAdmin.get_queryset
+        if self.value() == 'out':
+            return queryset.filter(_current_stock__lte=0)
+        if self.value() == 'low':
+            return queryset.filter(_current_stock__gt=0, _current_stock__lt=forecasting.LOW_STOCK)
+        if self.value() == 'in':
+            return queryset.filter(_current_stock__gt=0)
+        return queryset
 
 # Admin configuration for Product model - manages product inventory
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     # Fields to display in the admin list view
-    list_display = ('name', 'category', 'price', 'stock_quantity', 'stock_status', 'barcode', 'updated_at')
+    list_display = ('name', 'category', 'price', 'current_stock', 'stock_status', 'reorder_point', 'barcode',
+                    'updated_at')
     # Filters available in admin sidebar
-    list_filter = ('category', 'stock_quantity', 'updated_at')
+    list_filter = ('category', 'forecast__status', CurrentStockFilter, 'updated_at')
     # Fields that can be searched in admin
     search_fields = ('name', 'barcode', 'category__name')
     # Fields that are read-only in admin forms
     readonly_fields = ('created_at', 'updated_at')
     # Ordering
     ordering = ('-updated_at',)
+    # Load the category and the stored forecast with each row
+    list_select_related = ('category', 'forecast')
     # Actions
-    actions = ['mark_out_of_stock', 'update_stock']
+    actions = ['mark_out_of_stock', 'export_products_csv', 'export_products_jsonl']
+
+    def get_queryset(self, request):
+        # Exact stock of every row from the ledger (stock_quantity is the last compacted level)
+        return super().get_queryset(request).annotate(_current_stock=stock.current_stock_expression())
+
+    def get_readonly_fields(self, request, obj=None):
+        # Stock is opening stock on create; later changes go through stock movements
+        if obj is not None:
+            return self.readonly_fields + ('stock_quantity',)
+        return self.readonly_fields
+
+    def current_stock(self, obj):
+        return obj._current_stock
+    current_stock.short_description = 'Stock'
+    current_stock.admin_order_field = '_current_stock'
 
     def stock_status(self, obj):
-        if obj.stock_quantity == 0:
-            return format_html('<span style="color: red;">Out of Stock</span>')
-        elif obj.stock_quantity < 10:
-            return format_html('<span style="color: orange;">Low Stock ({})</span>', obj.stock_quantity)
-        else:
-            return format_html('<span style="color: green;">In Stock ({})</span>', obj.stock_quantity)
+        return stock_status_html(obj._current_stock, obj)
     stock_status.short_description = 'Stock Status'
+    stock_status.admin_order_field = '_current_stock'
+
+    def reorder_point(self, obj):
+        forecast = getattr(obj, 'forecast', None)
+        return forecast.reorder_point if forecast is not None else '-'
+    reorder_point.short_description = 'Reorder Point'
+    reorder_point.admin_order_field = 'forecast__reorder_point'
 
     def mark_out_of_stock(self, request, queryset):
-        queryset.update(stock_quantity=0)
-        self.message_user(request, f"Marked {queryset.count()} products as out of stock.")
+        # Adjustment movements to zero, so the change is in the audit trail; run by a job for large selections
+        job = jobs.enqueue('set_stock_levels', {
+            'levels': {pk: 0 for pk in queryset.values_list('pk', flat=True)}, 'note': 'Marked out of stock',
+        }, user=request.user)
+        return redirect('pos_app:job_status', pk=job.pk)
     mark_out_of_stock.short_description = "Mark selected products as out of stock"
 
-    def update_stock(self, request, queryset):
-        # This would typically open a form, but for simplicity we'll just show a message
-        self.message_user(request, "Use the change form to update stock quantities individually.")
-    update_stock.short_description = "Update stock (use change form)"
+    def export_products_csv(self, request, queryset):
+        # Write the selected products in the import file format from a job; its page offers the download
+        job = jobs.enqueue('export_products', {
+            'format': 'csv', 'product_ids': list(queryset.values_list('pk', flat=True)),
+        }, user=request.user)
+        return redirect('pos_app:job_status', pk=job.pk)
+    export_products_csv.short_description = "Export selected products (CSV)"
+
+    def export_products_jsonl(self, request, queryset):
+        job = jobs.enqueue('export_products', {
+            'format': 'jsonl', 'product_ids': list(queryset.values_list('pk', flat=True)),
+        }, user=request.user)
+        return redirect('pos_app:job_status', pk=job.pk)
+    export_products_jsonl.short_description = "Export selected products (JSON Lines)"
+
+    def get_urls(self):
+        # Import page, linked from the changelist's object tools
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='pos_app_product_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            # The file is imported by a job; its page shows the progress and the rejected rows
+            job = jobs.enqueue('import_products', {
+                'path': jobs.save_upload(upload),
+                'format': imports.guess_format(upload.name, form.cleaned_data['format']),
+                'dry_run': form.cleaned_data['dry_run'],
+            }, user=request.user)
+            return redirect('pos_app:job_status', pk=job.pk)
+        return TemplateResponse(request, 'admin/pos_app/product/import.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Import products',
+            'opts': self.model._meta,
+            'form': form,
+        })
 
 # Admin configuration for Sale model - manages sales transactions
 @admin.register(Sale)
-class SaleAdmin(admin.ModelAdmin):
+class SaleAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     # Fields to display in the admin list view
     list_display = ('id', 'user', 'total_amount', 'payment_method', 'item_count', 'created_at', 'view_details')
     # Filters available in admin sidebar
     list_filter = ('payment_method', 'created_at', 'user')
-    # Fields that can be searched in admin
-    search_fields = ('id', 'user__username')
+    # Fields that can be searched in admin (an offline till's idempotency key exactly)
+    search_fields = ('id', 'user__username', '=client_key')
     # Fields that are read-only in admin forms
-    readonly_fields = ('created_at', 'total_amount')
+    readonly_fields = ('created_at', 'total_amount', 'client_key')
     # Inlines
     inlines = [SaleItemInline]
     # Actions
     actions = ['export_sales_data']
+    # Load the cashier with each row
+    list_select_related = ('user',)
+    # Avoid COUNT(*) over the whole sales table on every page load
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # Count the items of every row in the changelist query (without grouping by the receipt snapshot)
+        return super().get_queryset(request).defer('receipt').annotate(_item_count=Count('items'))
+
+    # Committed sales are immutable: they are recorded by checkout, which also writes the stock ledger, the
+    # rollups and the receipt snapshot. A sale can only be deleted whole (its rollups are reverted on delete).
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_deleted_objects(self, objs, request):
+        deleted_objects, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        # The items go with their sale; they just cannot be deleted on their own
+        perms_needed.discard(SaleItem._meta.verbose_name)
+        return deleted_objects, model_count, perms_needed, protected
 
     def item_count(self, obj):
-        return obj.items.count()
+        return obj._item_count
     item_count.short_description = 'Items'
+    item_count.admin_order_field = '_item_count'
 
     def view_details(self, obj):
         return format_html('<a href="{}" class="button">View Details</a>',
@@ -92,13 +260,16 @@ class SaleAdmin(admin.ModelAdmin):
     view_details.short_description = 'Details'
 
     def export_sales_data(self, request, queryset):
-        # This would typically export to CSV/Excel, but for now just show message
-        self.message_user(request, f"Exported {queryset.count()} sales records.")
-    export_sales_data.short_description = "Export selected sales data"
+        # Write the line items of the selected sales as CSV from a job; its page offers the download
+        job = jobs.enqueue('export_sales', {
+            'format': 'csv', 'sale_ids': list(queryset.values_list('pk', flat=True)), 'filename': 'sales-selected.csv',
+        }, user=request.user)
+        return redirect('pos_app:job_status', pk=job.pk)
+    export_sales_data.short_description = "Export selected sales data (CSV)"
 
 # Admin configuration for SaleItem model - manages individual sale items
 @admin.register(SaleItem)
-class SaleItemAdmin(admin.ModelAdmin):
+class SaleItemAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     # Fields to display in the admin list view
     list_display = ('sale_link', 'product', 'quantity', 'unit_price', 'total_price', 'sale_date')
     # Filters available in admin sidebar
@@ -107,40 +278,160 @@ class SaleItemAdmin(admin.ModelAdmin):
     search_fields = ('product__name', 'sale__id')
     # Fields that are read-only in admin forms
     readonly_fields = ('total_price',)
+    # Load the sale and product with each row
+    list_select_related = ('sale', 'product')
+    # Avoid COUNT(*) over the whole sale items table on every page load
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def sale_link(self, obj):
         return format_html('<a href="{}">Sale #{}</a>',
-                          reverse('admin:pos_app_sale_change', args=(obj.sale.pk,)),
-                          obj.sale.id)
+                          reverse('admin:pos_app_sale_change', args=(obj.sale_id,)),
+                          obj.sale_id)
     sale_link.short_description = 'Sale'
+    sale_link.admin_order_field = 'sale'
 
     def sale_date(self, obj):
         return obj.sale.created_at
     sale_date.short_description = 'Sale Date'
     sale_date.admin_order_field = 'sale__created_at'
 
-# Admin configuration for Inventory model - manages inventory tracking
+    # Items belong to an immutable sale (see SaleAdmin)
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+# Admin configuration for Inventory model - shows the compacted stock snapshots (written by compaction only)
 @admin.register(Inventory)
-class InventoryAdmin(admin.ModelAdmin):
+class InventoryAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     # Fields to display in the admin list view
-    list_display = ('product', 'quantity', 'stock_level', 'last_updated')
+    list_display = ('product', 'quantity', 'stock_level', 'movement_id', 'last_updated')
     # Filters available in admin sidebar
     list_filter = ('last_updated',)
     # Fields that can be searched in admin
     search_fields = ('product__name',)
     # Fields that are read-only in admin forms
     readonly_fields = ('last_updated',)
+    # Load the product and its stored forecast with each row
+    list_select_related = ('product', 'product__forecast')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        # Exact stock of every row: the snapshot (quantity) plus the movements after it
+        return super().get_queryset(request).annotate(_current_stock=stock.inventory_stock_expression())
 
     def stock_level(self, obj):
-        if obj.quantity == 0:
-            return format_html('<span style="color: red;">Critical</span>')
-        elif obj.quantity < 5:
-            return format_html('<span style="color: orange;">Low</span>')
-        elif obj.quantity < 20:
-            return format_html('<span style="color: blue;">Medium</span>')
-        else:
-            return format_html('<span style="color: green;">High</span>')
+        return stock_status_html(obj._current_stock, obj.product)
     stock_level.short_description = 'Stock Level'
+    stock_level.admin_order_field = '_current_stock'
+
+# Admin configuration for StockForecast model - the stored forecasts (written by forecast_demand only)
+@admin.register(StockForecast)
+class StockForecastAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
+    # Fields to display in the admin list view
+    list_display = ('product', 'status', 'stock', 'forecast', 'moving_average', 'velocity', 'days_of_cover',
+                    'safety_stock', 'reorder_point', 'reorder_quantity', 'computed_at')
+    # Filters available in admin sidebar
+    list_filter = ('status',)
+    # Fields that can be searched in admin
+    search_fields = ('product__name', 'product__barcode')
+    # Least days of cover first; products without demand last
+    ordering = (F('days_of_cover').asc(nulls_last=True), 'product')
+    # Load the product with each row
+    list_select_related = ('product',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+# Form for recording a stock movement by hand (sales are recorded by checkout)
+class StockMovementForm(forms.ModelForm):
+    kind = forms.ChoiceField(choices=[choice for choice in StockMovement.KIND_CHOICES if choice[0] != StockMovement.SALE])
+
+    class Meta:
+        model = StockMovement
+        fields = ('product', 'kind', 'quantity', 'note')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        product, quantity = cleaned_data.get('product'), cleaned_data.get('quantity')
+        if product is not None and quantity is not None:
+            if quantity == 0:
+                raise forms.ValidationError('A movement must change the stock.')
+            level = stock.current_stock([product.pk])[product.pk]
+            if level + quantity < 0:
+                raise forms.ValidationError(f'{product.name} has only {level} in stock.')
+        return cleaned_data
+
+# Admin configuration for StockMovement model - the append-only stock ledger
+@admin.register(StockMovement)
+class StockMovementAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
+    form = StockMovementForm
+    # Fields to display in the admin list view
+    list_display = ('created_at', 'product', 'kind', 'quantity', 'sale', 'user', 'note')
+    # Filters available in admin sidebar
+    list_filter = ('kind', 'created_at')
+    # Fields that can be searched in admin
+    search_fields = ('product__name', 'product__barcode', 'note')
+    # Pick products by id instead of rendering the whole catalog in a dropdown
+    raw_id_fields = ('product',)
+    # Load the product and user with each row
+    list_select_related = ('product', 'user')
+    # Newest movements first
+    ordering = ('-id',)
+    # Avoid COUNT(*) over the whole ledger on every page load
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        # Movements are appended through the ledger so the stock check and notifications apply
+        obj.pk = stock.record(obj.kind, {obj.product_id: obj.quantity}, user=request.user, note=obj.note)[0].pk
+
+    # The ledger is append-only
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+# Admin configuration for Job model - background jobs, queued by the pages and actions that need them
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    # Fields to display in the admin list view
+    list_display = ('id', 'task', 'status', 'priority', 'progress', 'message', 'user', 'attempts', 'created_at',
+                    'finished_at', 'status_page')
+    # Filters available in admin sidebar
+    list_filter = ('status', 'task', 'created_at')
+    # Load the user with each row
+    list_select_related = ('user',)
+    # Newest jobs first
+    ordering = ('-id',)
+    # Avoid COUNT(*) over the whole job table on every page load
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # Jobs are queued by the app and changed by workers only
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def status_page(self, obj):
+        return format_html('<a href="{}">Open</a>', reverse('pos_app:job_status', args=(obj.pk,)))
+    status_page.short_description = 'Status Page'
 
 # Custom admin site configuration
 class POSAdminSite(admin.AdminSite):
@@ -153,7 +444,7 @@ class POSAdminSite(admin.AdminSite):
         # Add custom ordering and grouping
         for app in app_list:
             if app['app_label'] == 'pos_app':
-                app['models'].sort(key=lambda x: ['Category', 'Product', 'Inventory', 'Sale', 'SaleItem'].index(x['object_name']))
+                app['models'].sort(key=lambda x: ['Category', 'Product', 'Inventory', 'StockMovement', 'StockForecast', 'Sale', 'SaleItem', 'Job'].index(x['object_name']))
         return app_list
 
 # Register the custom admin site
@@ -163,3 +454,6 @@ admin_site.register(Product, ProductAdmin)
 admin_site.register(Sale, SaleAdmin)
 admin_site.register(SaleItem, SaleItemAdmin)
 admin_site.register(Inventory, InventoryAdmin)
+admin_site.register(StockMovement, StockMovementAdmin)
+admin_site.register(StockForecast, StockForecastAdmin)
+admin_site.register(Job, JobAdmin)
@@ -0,0 +1,417 @@
+# Import standard library modules for the column files, their metadata and time buckets
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+# NumPy is optional: without it the store is not built and the sales report has no profit section
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Import Django modules for settings and for reading the sale lines to export
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+from .models import Category, Product, Sale, SaleItem
+
+# Defaults for settings.POS_ANALYTICS
+DEFAULTS = {
+    # Directory of the column files (default: BASE_DIR / 'var' / 'analytics')
+    'DIRECTORY': None,
+    # Sale lines read from the database and appended per batch
+    'BATCH_SIZE': 50000,
+    # Seconds a newest sale id must have been seen before it is exported up to: a checkout still committing
+    # may hold a lower id than a committed one, and the watermark would skip it
+    'SETTLE_SECONDS': 60,
+}
+
+# Dedupe key of the refresh_analytics jobs: refreshes and rebuilds share one job while it is queued or
+# running, so only one writes the store at a time
+JOB_KEY = 'store'
+
+# Layout of the store; a store written with another layout is rebuilt
+LAYOUT_VERSION = 1
+
+# One file of fixed-width values per column, one row per sale line. Times are UTC epoch seconds, prices are
+# centavos, payment_method is the index of the code in PAYMENT_METHODS, unit_cost is the product's cost
+# price when the line was exported (sale lines do not record it).
+COLUMNS = {
+    'created_at': 'int64',
+    'sale_id': 'int64',
+    'product_id': 'int64',
+    'category_id': 'int64',
+    'user_id': 'int64',
+    'payment_method': 'int8',
+    'quantity': 'int32',
+    'unit_price': 'int64',
+    'unit_cost': 'int64',
+}
+
+# Payment method codes in the order they are numbered in the payment_method column
+PAYMENT_METHODS = [code for code, label in Sale._meta.get_field('payment_method').choices]
+
+# Sale line fields exported into COLUMNS, in the same order
+LINE_FIELDS = ('sale__created_at', 'sale_id', 'product_id', 'product__category_id', 'sale__user_id',
+                'sale__payment_method', 'quantity', 'unit_price', 'product__cost_price')
+
+# Revenue, cost and margin of a set of sale lines (amounts in pesos)
+Totals = namedtuple('Totals', 'lines quantity revenue cost margin margin_percent')
+
+
+# Merged analytics settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_ANALYTICS', {}))
+    if config['DIRECTORY'] is None:
+        config['DIRECTORY'] = os.path.join(settings.BASE_DIR, 'var', 'analytics')
+    return config
+
+
+# Whether NumPy is installed
+def available():
+    return np is not None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImproperlyConfigured('The analytics store requires NumPy (pip install numpy)')
+
+
+def _meta_path(directory):
+    return os.path.join(directory, 'meta.json')
+
+
+def _column_path(directory, name):
+    return os.path.join(directory, f'{name}.bin')
+
+
+# Rows, watermark (id of the last exported sale) and refresh time of a store; an empty store if it is missing
+def _read_meta(directory):
+    try:
+        with open(_meta_path(directory)) as meta_file:
+            meta = json.load(meta_file)
+    except FileNotFoundError:
+        meta = None
+    if meta is None or meta.get('layout') != LAYOUT_VERSION:
+        return {'layout': LAYOUT_VERSION, 'rows': 0, 'watermark': 0, 'refreshed_at': None, 'pending': None}
+    return meta
+
+
+# Replace the metadata in one rename, so readers see the old or the new row count, never a partial file
+def _write_meta(directory, meta):
+    path = _meta_path(directory)
+    with open(f'{path}.tmp', 'w') as meta_file:
+        json.dump(meta, meta_file)
+        meta_file.flush()
+        os.fsync(meta_file.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+# Read-only view of the store: column arrays are memory-mapped on first use and hold the rows the metadata
+# counted when the store was opened, so appends by a refresh running meanwhile are not seen
+class Store:
+    def __init__(self, directory=None):
+        _require_numpy()
+        self.directory = directory or get_config()['DIRECTORY']
+        meta = _read_meta(self.directory)
+        self.rows = meta['rows']
+        self.watermark = meta['watermark']
+        self.refreshed_at = meta['refreshed_at']
+        self._columns = {}
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            if self.rows:
+                self._columns[name] = np.memmap(_column_path(self.directory, name), dtype=COLUMNS[name],
+                                                mode='r', shape=(self.rows,))
+            else:
+                self._columns[name] = np.zeros(0, dtype=COLUMNS[name])
+        return self._columns[name]
+
+
+# Id of the newest sale safe to export, from ids alone: created_at cannot tell, since sales ingested from an
+# offline till carry their (earlier) time of sale. The newest id is noted in meta['pending'] with the time it
+# was seen, and exported up to once SETTLE_SECONDS have passed, when every lower id has committed or rolled
+# back. Updates meta['pending'] and returns the id (the watermark when nothing has settled).
+def _settled_sale_id(meta, settle_seconds):
+    now = time.time()
+    newest = Sale.objects.order_by('-pk').values_list('pk', flat=True).first()
+    upto = meta['watermark']
+    if meta.get('pending') is None and newest is not None and newest > upto:
+        meta['pending'] = [newest, now]
+    if meta.get('pending') is not None and now - meta['pending'][1] >= settle_seconds:
+        upto = max(upto, meta['pending'][0])
+        # Start settling the sales made since
+        meta['pending'] = [newest, now] if newest is not None and newest > upto else None
+    return upto
+
+
+def _centavos(amount):
+    return int(amount * 100)
+
+
+# Column arrays of a batch of exported rows
+def _arrays(rows):
+    values = {name: [] for name in COLUMNS}
+    payment_codes = {code: index for index, code in enumerate(PAYMENT_METHODS)}
+    for created_at, sale_id, product_id, category_id, user_id, method, quantity, price, cost in rows:
+        values['created_at'].append(int(created_at.timestamp()))
+        values['sale_id'].append(sale_id)
+        values['product_id'].append(product_id)
+        values['category_id'].append(category_id)
+        values['user_id'].append(user_id)
+        values['payment_method'].append(payment_codes.get(method, -1))
+        values['quantity'].append(quantity)
+        values['unit_price'].append(_centavos(price))
+        values['unit_cost'].append(_centavos(cost))
+    return {name: np.array(values[name], dtype=dtype) for name, dtype in COLUMNS.items()}
+
+
+# Append the lines of sales after the watermark, up to the newest settled sale, in batches of whole sales.
+# The metadata is rewritten after every batch, so an interrupted refresh resumes where it stopped.
+# progress(rows appended so far) is called after every batch. Returns the number of lines appended.
+def refresh(directory=None, progress=None):
+    _require_numpy()
+    config = get_config()
+    directory = directory or config['DIRECTORY']
+    os.makedirs(directory, exist_ok=True)
+    meta = _read_meta(directory)
+    # Cut off anything written after the last recorded row (an interrupted batch)
+    for name, dtype in COLUMNS.items():
+        with open(_column_path(directory, name), 'ab') as column_file:
+            column_file.truncate(meta['rows'] * np.dtype(dtype).itemsize)
+
+    upto = _settled_sale_id(meta, config['SETTLE_SECONDS'])
+    if upto <= meta['watermark']:
+        # Nothing to export; record the check, so the report does not queue another one at once
+        meta.update(refreshed_at=timezone.now().isoformat())
+        _write_meta(directory, meta)
+        return 0
+    lines = (
+        SaleItem.objects.filter(sale_id__gt=meta['watermark'], sale_id__lte=upto)
+        .order_by('sale_id', 'pk')
+        .values_list(*LINE_FIELDS)
+    )
+
+    appended = 0
+
+    def flush(batch, watermark):
+        nonlocal appended
+        for name, array in _arrays(batch).items():
+            with open(_column_path(directory, name), 'ab') as column_file:
+                array.tofile(column_file)
+                column_file.flush()
+                os.fsync(column_file.fileno())
+        appended += len(batch)
+        meta.update(rows=meta['rows'] + len(batch), watermark=watermark, refreshed_at=timezone.now().isoformat())
+        _write_meta(directory, meta)
+        if progress is not None:
+            progress(appended)
+
+    batch = []
+    for row in lines.iterator(chunk_size=config['BATCH_SIZE']):
+        # Flush only between sales, so the watermark never splits one
+        if len(batch) >= config['BATCH_SIZE'] and row[1] != batch[-1][1]:
+            flush(batch, batch[-1][1])
+            batch = []
+        batch.append(row)
+    if batch:
+        flush(batch, batch[-1][1])
+    # Sales without lines up to upto need no rows, but move the watermark past them
+    if meta['watermark'] < upto:
+        meta.update(watermark=upto, refreshed_at=timezone.now().isoformat())
+        _write_meta(directory, meta)
+    return appended
+
+
+# Export every sale line again into a new store, then swap it in (after sales were deleted or edited)
+def rebuild(directory=None, progress=None):
+    directory = directory or get_config()['DIRECTORY']
+    building = f'{directory}.new'
+    shutil.rmtree(building, ignore_errors=True)
+    # Sales up to the current store's watermark have settled already; the new store exports them at once
+    settled = _read_meta(directory)['watermark']
+    if settled:
+        os.makedirs(building)
+        _write_meta(building, {**_read_meta(building), 'pending': [settled, 0]})
+    appended = refresh(building, progress)
+    shutil.rmtree(f'{directory}.old', ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, f'{directory}.old')
+    os.replace(building, directory)
+    shutil.rmtree(f'{directory}.old', ignore_errors=True)
+    return appended
+
+
+# UTC epoch seconds of a local calendar date's midnight
+def _epoch(day):
+    return int(timezone.make_aware(datetime.combine(day, dt_time.min)).timestamp())
+
+
+# Rows matching the sales report filters, as a boolean array
+def select(store, filters):
+    mask = np.ones(store.rows, dtype=bool)
+    if filters.get('start_date'):
+        mask &= store['created_at'] >= _epoch(filters['start_date'])
+    if filters.get('end_date'):
+        mask &= store['created_at'] < _epoch(filters['end_date'] + timedelta(days=1))
+    if filters.get('payment_method'):
+        mask &= store['payment_method'] == PAYMENT_METHODS.index(filters['payment_method'])
+    if filters.get('user'):
+        user_id = User.objects.filter(username=filters['user']).values_list('pk', flat=True).first()
+        mask &= store['user_id'] == (user_id if user_id is not None else -1)
+    return mask
+
+
+def _pesos(centavos):
+    return (Decimal(int(centavos)) / 100).quantize(Decimal('0.01'))
+
+
+def _percent(margin, revenue):
+    if not revenue:
+        return Decimal('0.0')
+    return (Decimal(int(margin)) * 100 / Decimal(int(revenue))).quantize(Decimal('0.1'))
+
+
+# Revenue and cost in centavos of each selected row
+def _amounts(store, mask):
+    quantity = store['quantity'][mask].astype(np.int64)
+    return quantity, quantity * store['unit_price'][mask], quantity * store['unit_cost'][mask]
+
+
+# Totals of the selected rows
+def totals(store, mask):
+    quantity, revenue, cost = _amounts(store, mask)
+    revenue_sum, cost_sum = int(revenue.sum()), int(cost.sum())
+    return Totals(int(mask.sum()), int(quantity.sum()), _pesos(revenue_sum), _pesos(cost_sum),
+                  _pesos(revenue_sum - cost_sum), _percent(revenue_sum - cost_sum, revenue_sum))
+
+
+# The limit groups (by 'product_id', 'category_id' or 'user_id') with the largest revenue, margin or quantity:
+# [{'id', 'quantity', 'revenue', 'cost', 'margin', 'margin_percent'}]
+def top(store, mask, by='product_id', order='margin', limit=5):
+    keys = store[by][mask]
+    if not len(keys):
+        return []
+    groups, inverse = np.unique(keys, return_inverse=True)
+    quantity, revenue, cost = _amounts(store, mask)
+    # Sums of centavos stay exact in float64 up to 2**53
+    sums = {
+        'quantity': np.bincount(inverse, weights=quantity, minlength=len(groups)),
+        'revenue': np.bincount(inverse, weights=revenue, minlength=len(groups)),
+        'cost': np.bincount(inverse, weights=cost, minlength=len(groups)),
+    }
+    sums['margin'] = sums['revenue'] - sums['cost']
+    ranking = sums[order]
+    if len(groups) > limit:
+        # Only the limit best groups are sorted
+        best = np.argpartition(-ranking, limit - 1)[:limit]
+    else:
+        best = np.arange(len(groups))
+    best = best[np.argsort(-ranking[best], kind='stable')]
+    return [
+        {
+            'id': int(groups[index]),
+            'quantity': int(round(sums['quantity'][index])),
+            'revenue': _pesos(round(sums['revenue'][index])),
+            'cost': _pesos(round(sums['cost'][index])),
+            'margin': _pesos(round(sums['margin'][index])),
+            'margin_percent': _percent(round(sums['margin'][index]), round(sums['revenue'][index])),
+        }
+        for index in best
+    ]
+
+
+# Local bucket starts (aware datetimes) covering the days first..last for a period
+def _bucket_starts(first, last, period):
+    if period == 'month':
+        day = first.replace(day=1)
+    elif period == 'week':
+        day = first - timedelta(days=first.weekday())
+    else:
+        day = first
+    starts = []
+    while day <= last:
+        midnight = timezone.make_aware(datetime.combine(day, dt_time.min))
+        if period == 'hour':
+            starts.extend(midnight + timedelta(hours=hour) for hour in range(24))
+        else:
+            starts.append(midnight)
+        if period == 'month':
+            day = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        elif period == 'week':
+            day += timedelta(days=7)
+        else:
+            day += timedelta(days=1)
+    return starts
+
+
+# Period for a time series over the days first..last: hours of one day, days of two months, weeks of a year
+def pick_period(first, last):
+    span = (last - first).days
+    if span < 1:
+        return 'hour'
+    if span <= 62:
+        return 'day'
+    if span <= 366:
+        return 'week'
+    return 'month'
+
+
+# Revenue and margin of the selected rows per local hour, day, week or month:
+# [{'start', 'quantity', 'revenue', 'margin'}]; the period is picked from the time span when not given
+def series(store, mask, period=None):
+    times = store['created_at'][mask]
+    if not len(times):
+        return []
+    first = timezone.localtime(datetime.fromtimestamp(int(times.min()), tz=dt_timezone.utc)).date()
+    last = timezone.localtime(datetime.fromtimestamp(int(times.max()), tz=dt_timezone.utc)).date()
+    starts = _bucket_starts(first, last, period or pick_period(first, last))
+    edges = np.array([int(start.timestamp()) for start in starts], dtype=np.int64)
+    buckets = np.searchsorted(edges, times, side='right') - 1
+    quantity, revenue, cost = _amounts(store, mask)
+    quantities = np.bincount(buckets, weights=quantity, minlength=len(edges))
+    revenues = np.bincount(buckets, weights=revenue, minlength=len(edges))
+    costs = np.bincount(buckets, weights=cost, minlength=len(edges))
+    return [
+        {
+            'start': start,
+            'quantity': int(round(quantities[index])),
+            'revenue': _pesos(round(revenues[index])),
+            'margin': _pesos(round(revenues[index] - costs[index])),
+        }
+        for index, start in enumerate(starts)
+    ]
+
+
+# Profit section of the sales report for the report filters, or None without NumPy or an empty store
+def profit_summary(filters, limit=5):
+    if not available():
+        return None
+    started = time.perf_counter()
+    store = Store()
+    if not store.rows:
+        return None
+    mask = select(store, filters)
+    summary = {
+        'totals': totals(store, mask),
+        'top_products': top(store, mask, 'product_id', 'margin', limit),
+        'top_categories': top(store, mask, 'category_id', 'margin', limit),
+        'series': series(store, mask),
+        'watermark': store.watermark,
+        'refreshed_at': store.refreshed_at and datetime.fromisoformat(store.refreshed_at),
+    }
+    summary['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    # Names of the listed products and categories (deleted ones keep their id)
+    for key, model in (('top_products', Product), ('top_categories', Category)):
+        names = dict(model.objects.filter(pk__in=[row['id'] for row in summary[key]]).values_list('pk', 'name'))
+        for row in summary[key]:
+            row['name'] = names.get(row['id'], f"#{row['id']}")
+    return summary
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PosAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pos_app'
+
+    def ready(self):
+        # Connect signal handlers (rollup maintenance, catalog cache invalidation)
+        from . import signals  # noqa: F401
+        # Register the background job tasks
+        from . import tasks  # noqa: F401
@@ -0,0 +1,399 @@
+# Import standard library modules for timing, concurrency and statistics
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+import multiprocessing
+
+# Import Django modules for driving the real URLs and inspecting the database
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Sum
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from .models import Category, Product, Sale, SaleItem
+from .stock import current_stock, open_inventory
+
+# Prefix for the seeded rows so they are easy to recognise
+SEED_PREFIX = 'bench'
+
+
+# Run a benchmark against a freshly created test database instead of the live one
+@contextmanager
+def throwaway_database():
+    connection = connections['default']
+    temp_dir = None
+    if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+        # A file (not the in-memory test database) so locking behaves like production
+        temp_dir = tempfile.mkdtemp(prefix='pos-bench-')
+        connection.settings_dict['TEST']['NAME'] = os.path.join(temp_dir, 'bench.sqlite3')
+    old_name = connection.settings_dict['NAME']
+    # Same environment as the test runner (allows the test client's host name)
+    setup_test_environment(debug=settings.DEBUG)
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if temp_dir:
+            # Also removes WAL files left by connections of threads that have already exited
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# Create the products and cashier accounts used by a benchmark run
+def seed(product_count, cashier_count, stock):
+    category = Category.objects.create(name=f'{SEED_PREFIX}-category-{time.time_ns()}')
+    products = Product.objects.bulk_create([
+        Product(name=f'{SEED_PREFIX} product {n}', category=category, price=Decimal('9.99'),
+                cost_price=Decimal('6.00'), stock_quantity=stock, barcode=f'{SEED_PREFIX}-{category.pk}-{n}')
+        for n in range(product_count)
+    ])
+    cashiers = User.objects.bulk_create([
+        User(username=f'{SEED_PREFIX}-{category.pk}-cashier-{n}') for n in range(cashier_count)
+    ])
+    # Re-read so primary keys are available on every backend
+    product_ids = list(Product.objects.filter(category=category).values_list('pk', flat=True))
+    # bulk_create skips the signal that opens each product's stock ledger
+    open_inventory(Product.objects.filter(pk__in=product_ids))
+    cashier_ids = list(User.objects.filter(username__in=[c.username for c in cashiers]).values_list('pk', flat=True))
+    return {'category_id': category.pk, 'product_ids': product_ids, 'cashier_ids': cashier_ids,
+            'initial_stock': {pk: stock for pk in product_ids}}
+
+
+# Nearest-rank percentile of a list of numbers
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+# One cashier's session: scan items into the cart, confirm the sale and sometimes open the report
+def _cashier_session(cashier_id, product_ids, baskets, items_per_basket, report_every, alias, rng_seed):
+    rng = random.Random(rng_seed)
+    client = Client()
+    client.force_login(User.objects.get(pk=cashier_id))
+    samples = []
+    confirmed = []
+    try:
+        for basket in range(baskets):
+            for product_id in rng.sample(product_ids, min(items_per_basket, len(product_ids))):
+                samples.append(_timed(client, alias, 'add_to_cart', 'get',
+                                      reverse('pos_app:add_to_cart', args=[product_id])))
+            sample = _timed(client, alias, 'sale_confirm', 'post', reverse('pos_app:sale_confirm'),
+                            {'payment_method': rng.choice(['cash', 'card'])})
+            samples.append(sample)
+            if sample['sale_id']:
+                confirmed.append(sample['sale_id'])
+            else:
+                # A rejected sale leaves the cart behind; start the next basket empty
+                samples.append(_timed(client, alias, 'clear_cart', 'get', reverse('pos_app:clear_cart')))
+            if report_every and (basket + 1) % report_every == 0:
+                samples.append(_timed(client, alias, 'sales_report', 'get', reverse('pos_app:sales_report')))
+    finally:
+        # Each worker thread/process owns its connection
+        connections.close_all()
+    return {'samples': samples, 'confirmed': confirmed}
+
+
+# Issue one request and record its latency, query count and outcome
+def _timed(client, alias, name, method, url, data=None):
+    error = None
+    sale_id = None
+    with CaptureQueriesContext(connections[alias]) as queries:
+        started = time.perf_counter()
+        try:
+            response = getattr(client, method)(url, data or {})
+            status = response.status_code
+            location = response.get('Location', '')
+            # A successful checkout redirects to /sale/<pk>/
+            if name == 'sale_confirm' and status == 302:
+                tail = location.rstrip('/').rsplit('/', 1)[-1]
+                if tail.isdigit():
+                    sale_id = int(tail)
+        except Exception as exc:  # noqa: BLE001 - errors such as "database is locked" are measured, not fatal
+            status = 500
+            error = f'{type(exc).__name__}: {exc}'
+        elapsed = time.perf_counter() - started
+    return {
+        'name': name,
+        'seconds': elapsed,
+        'queries': len(queries),
+        'sql_seconds': sum(float(q['time']) for q in queries.captured_queries),
+        'status': status,
+        'error': error,
+        'sale_id': sale_id,
+    }
+
+
+# Compare the database with what the cashiers were told, per product and per sale
+def find_anomalies(seeded, confirmed_ids):
+    product_ids = seeded['product_ids']
+    sold = dict(
+        SaleItem.objects.filter(product_id__in=product_ids)
+        .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+    )
+    stock = current_stock(product_ids)
+    oversold = []
+    lost_updates = []
+    for product_id in product_ids:
+        initial = seeded['initial_stock'][product_id]
+        units = sold.get(product_id, 0)
+        if units > initial:
+            oversold.append({'product_id': product_id, 'initial': initial, 'sold': units})
+        if initial - units != stock[product_id]:
+            lost_updates.append({'product_id': product_id, 'expected': initial - units, 'actual': stock[product_id]})
+    stored = set(Sale.objects.filter(user_id__in=seeded['cashier_ids']).values_list('pk', flat=True))
+    reported = set(confirmed_ids)
+    return {
+        'oversold': oversold,
+        'lost_updates': lost_updates,
+        'missing_sales': sorted(reported - stored),
+        'unreported_sales': sorted(stored - reported),
+    }
+
+
+# Summarise the samples of one endpoint
+def _endpoint_stats(samples, wall_seconds):
+    latencies = [s['seconds'] * 1000 for s in samples]
+    queries = [s['queries'] for s in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for s in samples if s['error'] or s['status'] >= 400),
+        'throughput_rps': round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_queries': round(sum(queries) / len(queries), 2) if queries else 0.0,
+        'max_queries': max(queries) if queries else 0,
+        'sql_ms': round(sum(s['sql_seconds'] for s in samples) * 1000, 2),
+    }
+
+
+# Seed the database, drive the URLs from concurrent cashiers and return a JSON-serialisable report
+def run(products=50, cashiers=4, baskets=10, items_per_basket=4, stock=1000, report_every=5,
+        mode='thread', alias='default', rng_seed=1):
+    seeded = seed(products, cashiers, stock)
+    # Connections must not be shared with the workers (and cannot survive a fork)
+    connections.close_all()
+
+    if mode == 'process':
+        executor = ProcessPoolExecutor(max_workers=cashiers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        executor = ThreadPoolExecutor(max_workers=cashiers)
+    started = time.perf_counter()
+    with executor:
+        futures = [
+            executor.submit(_cashier_session, cashier_id, seeded['product_ids'], baskets, items_per_basket,
+                            report_every, alias, rng_seed + n)
+            for n, cashier_id in enumerate(seeded['cashier_ids'])
+        ]
+        sessions = [future.result() for future in futures]
+    wall_seconds = time.perf_counter() - started
+
+    by_endpoint = defaultdict(list)
+    confirmed = []
+    errors = []
+    for session in sessions:
+        confirmed.extend(session['confirmed'])
+        for sample in session['samples']:
+            by_endpoint[sample['name']].append(sample)
+            if sample['error']:
+                errors.append(sample['error'])
+            elif sample['status'] >= 400:
+                errors.append(f"{sample['name']} returned HTTP {sample['status']}")
+
+    return {
+        'config': {'products': products, 'cashiers': cashiers, 'baskets': baskets,
+                   'items_per_basket': items_per_basket, 'stock': stock, 'mode': mode,
+                   'vendor': connections[alias].vendor},
+        'wall_seconds': round(wall_seconds, 3),
+        'checkouts_per_second': round(len(confirmed) / wall_seconds, 2) if wall_seconds else 0.0,
+        'confirmed_sales': len(confirmed),
+        'rejected_sales': len(by_endpoint['sale_confirm']) - len(confirmed),
+        'endpoints': {name: _endpoint_stats(samples, wall_seconds) for name, samples in by_endpoint.items()},
+        'anomalies': find_anomalies(seeded, confirmed),
+        'error_samples': sorted(set(errors))[:10],
+    }
+
+
+# Check a report against a saved baseline; returns a list of human-readable regressions
+def regressions(report, baseline, max_latency_ratio=1.25, max_throughput_drop=0.2):
+    problems = []
+    for kind, rows in report['anomalies'].items():
+        if rows:
+            problems.append(f'{len(rows)} {kind.replace("_", " ")}')
+    for name, stats in report['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(name)
+        if not base:
+            continue
+        if base['p95_ms'] and stats['p95_ms'] > base['p95_ms'] * max_latency_ratio:
+            problems.append(f'{name} p95 {stats["p95_ms"]}ms vs baseline {base["p95_ms"]}ms')
+        if stats['max_queries'] > base['max_queries']:
+            problems.append(f'{name} max queries {stats["max_queries"]} vs baseline {base["max_queries"]}')
+        if stats['errors'] > base['errors']:
+            problems.append(f'{name} errors {stats["errors"]} vs baseline {base["errors"]}')
+    base_rate = baseline.get('checkouts_per_second')
+    if base_rate and report['checkouts_per_second'] < base_rate * (1 - max_throughput_drop):
+        problems.append(f'checkout throughput {report["checkouts_per_second"]}/s vs baseline {base_rate}/s')
+    return problems
+
+
+# Load a baseline report written with --output
+def load_report(path):
+    with open(path) as handle:
+        return json.load(handle)
+
+
+# Resident memory of this process in KiB (Linux only; None elsewhere)
+def _rss_kib():
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError):
+        return None
+
+
+# Highest resident memory seen while the block runs, sampled every few milliseconds
+@contextmanager
+def _peak_rss(result):
+    stop = threading.Event()
+    result['before_kib'] = result['peak_kib'] = _rss_kib()
+
+    def sample():
+        while not stop.wait(0.005):
+            rss = _rss_kib()
+            if rss is not None and rss > result['peak_kib']:
+                result['peak_kib'] = rss
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield result
+    finally:
+        stop.set()
+        sampler.join()
+
+
+# Logged-in test clients, one per till connection (sessions are created before timing starts)
+def _logged_in_clients(count, user):
+    clients = []
+    for _ in range(count):
+        client = Client()
+        client.force_login(user)
+        clients.append(client)
+    return clients
+
+
+# Summarise one server path of the ASGI/WSGI comparison
+def _server_stats(latencies, errors, wall_seconds, memory, tills):
+    stats = {
+        'requests': len(latencies),
+        'errors': errors,
+        'requests_per_second': round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'peak_rss_kib': memory['peak_kib'],
+        'kib_per_connection': None,
+    }
+    if memory['peak_kib'] is not None:
+        stats['kib_per_connection'] = round((memory['peak_kib'] - memory['before_kib']) / tills, 1)
+    return stats
+
+
+# Every till connection as a thread blocking in the WSGI handler (thread-per-connection servers)
+def _drive_wsgi(clients, urls, pauses):
+    latencies = []
+    errors = []
+
+    def till(client, till_pauses):
+        try:
+            for url, pause in zip(urls, till_pauses):
+                time.sleep(pause)
+                started = time.perf_counter()
+                response = client.get(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=till, args=(client, till_pauses)) for client, till_pauses in zip(clients, pauses)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors)
+
+
+# Every till connection as a coroutine on one event loop, served by the ASGI handler
+async def _drive_asgi(cookie_jars, urls, pauses):
+    latencies = []
+    errors = []
+
+    async def till(cookies, till_pauses):
+        client = AsyncClient()
+        client.cookies = cookies
+        for url, pause in zip(urls, till_pauses):
+            await asyncio.sleep(pause)
+            started = time.perf_counter()
+            response = await client.get(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+            latencies.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+    await asyncio.gather(*(till(cookies, till_pauses) for cookies, till_pauses in zip(cookie_jars, pauses)))
+    return latencies, len(errors)
+
+
+# Compare the async cart endpoint served by the ASGI handler with the same endpoint behind the WSGI handler,
+# for many mostly idle till connections; returns a JSON-serialisable report
+def compare_servers(tills=200, requests_per_till=5, think_ms=1000, products=50):
+    seeded = seed(products, 1, stock=1000)
+    user = User.objects.get(pk=seeded['cashier_ids'][0])
+    rng = random.Random(1)
+    urls = [reverse('pos_app:add_to_cart', args=[rng.choice(seeded['product_ids'])])
+            for _ in range(requests_per_till)]
+    # Idle time before each request, spread +/-50% so the tills do not fire in lockstep
+    pauses = [[think_ms / 1000 * rng.uniform(0.5, 1.5) for _ in urls] for _ in range(tills)]
+    report = {'config': {'tills': tills, 'requests_per_till': requests_per_till, 'think_ms': think_ms,
+                         'vendor': connections['default'].vendor}}
+
+    clients = _logged_in_clients(tills, user)
+    connections.close_all()
+    with _peak_rss({}) as memory:
+        started = time.perf_counter()
+        latencies, errors = _drive_wsgi(clients, urls, pauses)
+        wall_seconds = time.perf_counter() - started
+    report['wsgi'] = _server_stats(latencies, errors, wall_seconds, memory, tills)
+
+    cookie_jars = [client.cookies for client in _logged_in_clients(tills, user)]
+    connections.close_all()
+    # ASGI runs each request's ORM calls in a short-lived thread, so connections must not be kept open
+    settings_dict = connections['default'].settings_dict
+    conn_max_age = settings_dict['CONN_MAX_AGE']
+    settings_dict['CONN_MAX_AGE'] = 0
+    try:
+        with _peak_rss({}) as memory:
+            started = time.perf_counter()
+            latencies, errors = asyncio.run(_drive_asgi(cookie_jars, urls, pauses))
+            wall_seconds = time.perf_counter() - started
+    finally:
+        settings_dict['CONN_MAX_AGE'] = conn_max_age
+    report['asgi'] = _server_stats(latencies, errors, wall_seconds, memory, tills)
+    return report
@@ -0,0 +1,242 @@
+# Import standard library modules for the in-process store
+import threading
+import time
+
+# Import Django modules for settings and loading the configured backend
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Defaults for settings.POS_CART
+DEFAULTS = {
+    # Dotted path of the cart backend class
+    'BACKEND': 'pos_app.cart.LocMemCartBackend',
+    # Seconds a cart is kept after its last change
+    'TTL': 8 * 60 * 60,
+    # Keyword arguments for the backend (e.g. {'URL': 'redis://localhost:6379/0'})
+    'OPTIONS': {},
+}
+
+
+# Merged cart settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_CART', {}))
+    return config
+
+
+# Carts held in this process: {cart id: (expires at, {product id: quantity})}.
+# Only suitable when every request of a till reaches the same process (runserver, one worker, threads).
+class LocMemCartBackend:
+    # Expired carts are swept after this many writes
+    SWEEP_EVERY = 1000
+
+    def __init__(self, ttl, **options):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._carts = {}
+        self._writes = 0
+
+    # Live items of a cart, or None if the cart is missing or expired (caller holds the lock)
+    def _items_locked(self, cart_id, now):
+        entry = self._carts.get(cart_id)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self._carts[cart_id]
+            return None
+        return entry[1]
+
+    # Items of a cart for writing, refreshing its expiry (caller holds the lock)
+    def _touch_locked(self, cart_id):
+        now = time.monotonic()
+        items = self._items_locked(cart_id, now)
+        if items is None:
+            items = {}
+        self._carts[cart_id] = (now + self.ttl, items)
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            for key in [key for key, (expires_at, _) in self._carts.items() if expires_at <= now]:
+                del self._carts[key]
+        return items
+
+    def items(self, cart_id):
+        with self._lock:
+            return dict(self._items_locked(cart_id, time.monotonic()) or {})
+
+    def add(self, cart_id, product_id, delta):
+        with self._lock:
+            items = self._touch_locked(cart_id)
+            quantity = items.get(product_id, 0) + delta
+            if quantity > 0:
+                items[product_id] = quantity
+            else:
+                items.pop(product_id, None)
+            return max(quantity, 0)
+
+    def set(self, cart_id, product_id, quantity):
+        with self._lock:
+            items = self._touch_locked(cart_id)
+            if quantity > 0:
+                items[product_id] = quantity
+            else:
+                items.pop(product_id, None)
+
+    def clear(self, cart_id):
+        with self._lock:
+            self._carts.pop(cart_id, None)
+
+    # Async variants for ASGI views; nothing here blocks, so they run inline on the event loop
+    async def aitems(self, cart_id):
+        return self.items(cart_id)
+
+    async def aadd(self, cart_id, product_id, delta):
+        return self.add(cart_id, product_id, delta)
+
+    async def aset(self, cart_id, product_id, quantity):
+        self.set(cart_id, product_id, quantity)
+
+    async def aclear(self, cart_id):
+        self.clear(cart_id)
+
+
+# Carts in Redis (or any server speaking the Redis protocol) as one hash per till, shared by all workers.
+# Requires the redis package.
+class RedisCartBackend:
+    # Increment a hash field and drop it once it reaches zero, in one round trip
+    _ADD_SCRIPT = """
+local quantity = redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if quantity <= 0 then redis.call('HDEL', KEYS[1], ARGV[1]) end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return quantity
+"""
+
+    def __init__(self, ttl, URL='redis://localhost:6379/0', KEY_PREFIX='pos:cart:', client=None):
+        self.ttl = ttl
+        self.prefix = KEY_PREFIX
+        if client is None:
+            try:
+                import redis
+            except ImportError as exc:
+                raise ImproperlyConfigured('RedisCartBackend requires the redis package (pip install redis)') from exc
+            client = redis.Redis.from_url(URL)
+        self.client = client
+        self._add = self.client.register_script(self._ADD_SCRIPT)
+
+    def _key(self, cart_id):
+        return f'{self.prefix}{cart_id}'
+
+    def items(self, cart_id):
+        return {int(product_id): int(quantity) for product_id, quantity in self.client.hgetall(self._key(cart_id)).items()}
+
+    def add(self, cart_id, product_id, delta):
+        return max(int(self._add(keys=[self._key(cart_id)], args=[product_id, delta, self.ttl])), 0)
+
+    def set(self, cart_id, product_id, quantity):
+        key = self._key(cart_id)
+        pipeline = self.client.pipeline()
+        if quantity > 0:
+            pipeline.hset(key, product_id, quantity)
+        else:
+            pipeline.hdel(key, product_id)
+        pipeline.expire(key, self.ttl)
+        pipeline.execute()
+
+    def clear(self, cart_id):
+        self.client.delete(self._key(cart_id))
+
+    # Async variants for ASGI views; the client blocks on the network, so run it off the event loop
+    async def aitems(self, cart_id):
+        return await sync_to_async(self.items, thread_sensitive=False)(cart_id)
+
+    async def aadd(self, cart_id, product_id, delta):
+        return await sync_to_async(self.add, thread_sensitive=False)(cart_id, product_id, delta)
+
+    async def aset(self, cart_id, product_id, quantity):
+        await sync_to_async(self.set, thread_sensitive=False)(cart_id, product_id, quantity)
+
+    async def aclear(self, cart_id):
+        await sync_to_async(self.clear, thread_sensitive=False)(cart_id)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# The configured backend, created on first use
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = get_config()
+                _backend = import_string(config['BACKEND'])(config['TTL'], **config['OPTIONS'])
+    return _backend
+
+
+# Forget the configured backend (after settings change in tests)
+def reset_backend():
+    global _backend
+    _backend = None
+
+
+# Cart id of the till making a request: its session key, so scans only read the session
+def cart_id(request):
+    if not request.session.session_key:
+        # Anonymous sessions get a key on first use; logged-in tills always have one
+        request.session.save()
+    return request.session.session_key
+
+
+# Async variant for ASGI views
+async def acart_id(request):
+    if not request.session.session_key:
+        await request.session.asave()
+    return request.session.session_key
+
+
+# One till's cart, stored outside the session
+class Cart:
+    # Async views pass the id from acart_id() so the session is never saved synchronously
+    def __init__(self, request, id=None):
+        self.id = id if id is not None else cart_id(request)
+        self.backend = get_backend()
+
+    # Cart for a request in an async view
+    @classmethod
+    async def afor_request(cls, request):
+        return cls(request, await acart_id(request))
+
+    # {product id: quantity}
+    def items(self):
+        return self.backend.items(self.id)
+
+    # Add (or with a negative delta, take away) units of a product; returns the new quantity
+    def add(self, product_id, delta=1):
+        return self.backend.add(self.id, int(product_id), delta)
+
+    # Set the quantity of a product (0 removes it)
+    def set(self, product_id, quantity):
+        self.backend.set(self.id, int(product_id), quantity)
+
+    def remove(self, product_id):
+        self.backend.set(self.id, int(product_id), 0)
+
+    def clear(self):
+        self.backend.clear(self.id)
+
+    async def aitems(self):
+        return await self.backend.aitems(self.id)
+
+    async def aadd(self, product_id, delta=1):
+        return await self.backend.aadd(self.id, int(product_id), delta)
+
+    async def aset(self, product_id, quantity):
+        await self.backend.aset(self.id, int(product_id), quantity)
+
+    async def aremove(self, product_id):
+        await self.backend.aset(self.id, int(product_id), 0)
+
+    async def aclear(self):
+        await self.backend.aclear(self.id)
@@ -0,0 +1,228 @@
+# Import standard library modules for the bounded in-process cache
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# Import Django modules for settings and the version counter update
+from django.conf import settings
+from django.db.models import F
+
+from .models import CatalogVersion, Category, Product
+from .stock import current_stock_expression
+
+# Defaults for settings.POS_CATALOG_CACHE
+DEFAULTS = {
+    # Maximum number of products kept in memory (least recently used are evicted first)
+    'MAX_ITEMS': 50000,
+    # Seconds between checks of the shared version counter in the database
+    'VERSION_CHECK_INTERVAL': 5,
+}
+
+# Columns loaded for each cached product (current_stock is the exact level from the stock ledger)
+_PRODUCT_FIELDS = ('id', 'name', 'barcode', 'price', 'category_id', 'category__name', 'current_stock', 'updated_at')
+
+
+# Compact, immutable snapshot of the product fields the till needs
+class ProductSnapshot(namedtuple('ProductSnapshot', 'id name barcode price category_id category_name '
+                                                    'stock_quantity updated_at')):
+    __slots__ = ()
+
+    # Templates and URL reversing use pk like a model instance
+    @property
+    def pk(self):
+        return self.id
+
+
+# Compact snapshot of a category for dropdowns
+class CategorySnapshot(namedtuple('CategorySnapshot', 'id name')):
+    __slots__ = ()
+
+    @property
+    def pk(self):
+        return self.id
+
+
+# Current value of the shared catalog version counter
+def current_version():
+    return CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+# Async variant for ASGI views
+async def acurrent_version():
+    return await CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).afirst() or 0
+
+
+# Increment the shared version counter (called from Product/Category signals, inside their transaction)
+def bump_version():
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+# Rows of _PRODUCT_FIELDS for the products matching a filter
+def _rows(lookup):
+    return (Product.objects.filter(**lookup).annotate(current_stock=current_stock_expression())
+            .values_list(*_PRODUCT_FIELDS))
+
+
+# Process-local product catalog keyed by id and barcode, with LRU eviction
+class CatalogCache:
+    def __init__(self, max_items=None, check_interval=None):
+        config = dict(DEFAULTS)
+        config.update(getattr(settings, 'POS_CATALOG_CACHE', {}))
+        self.max_items = max_items if max_items is not None else config['MAX_ITEMS']
+        self.check_interval = check_interval if check_interval is not None else config['VERSION_CHECK_INTERVAL']
+        self._lock = threading.RLock()
+        self._products = OrderedDict()
+        self._barcodes = {}
+        self._categories = None
+        self._version = None
+        self._checked_at = 0.0
+
+    # Whether the shared version counter is due for another check
+    def _check_due(self):
+        return self._version is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    # Drop everything if another process (or this one) changed the catalog since the last check
+    def _sync(self):
+        if self._check_due():
+            self._apply_version(current_version())
+
+    async def _async_sync(self):
+        if self._check_due():
+            self._apply_version(await acurrent_version())
+
+    def _apply_version(self, version):
+        now = time.monotonic()
+        with self._lock:
+            if version != self._version:
+                self._clear_locked()
+                self._version = version
+            self._checked_at = now
+
+    def _clear_locked(self):
+        self._products.clear()
+        self._barcodes.clear()
+        self._categories = None
+
+    def _store_locked(self, snapshot):
+        old = self._products.pop(snapshot.id, None)
+        if old is not None and old.barcode:
+            self._barcodes.pop(old.barcode, None)
+        self._products[snapshot.id] = snapshot
+        if snapshot.barcode:
+            self._barcodes[snapshot.barcode] = snapshot.id
+        while len(self._products) > self.max_items:
+            _, evicted = self._products.popitem(last=False)
+            if evicted.barcode:
+                self._barcodes.pop(evicted.barcode, None)
+
+    # Load products matching a filter from the database into the cache
+    def _load(self, **lookup):
+        return self._store_rows(_rows(lookup))
+
+    async def _aload(self, **lookup):
+        return self._store_rows([row async for row in _rows(lookup)])
+
+    def _store_rows(self, rows):
+        snapshots = [ProductSnapshot(*row) for row in rows]
+        with self._lock:
+            for snapshot in snapshots:
+                self._store_locked(snapshot)
+        return snapshots
+
+    # Snapshot for one product id, or None if it does not exist
+    def get(self, product_id):
+        return self.get_many([product_id]).get(int(product_id))
+
+    # Snapshots for many product ids in one query for the misses; missing products are left out
+    def get_many(self, product_ids):
+        self._sync()
+        found, misses = self._cached(product_ids)
+        if misses:
+            for snapshot in self._load(pk__in=misses):
+                found[snapshot.id] = snapshot
+        return found
+
+    # Async variants for ASGI views
+    async def aget(self, product_id):
+        return (await self.aget_many([product_id])).get(int(product_id))
+
+    async def aget_many(self, product_ids):
+        await self._async_sync()
+        found, misses = self._cached(product_ids)
+        if misses:
+            for snapshot in await self._aload(pk__in=misses):
+                found[snapshot.id] = snapshot
+        return found
+
+    # Cached snapshots by id, and the ids that have to be loaded
+    def _cached(self, product_ids):
+        ids = [int(product_id) for product_id in product_ids]
+        found = {}
+        with self._lock:
+            for product_id in ids:
+                snapshot = self._products.get(product_id)
+                if snapshot is not None:
+                    self._products.move_to_end(product_id)
+                    found[product_id] = snapshot
+        return found, [product_id for product_id in ids if product_id not in found]
+
+    # Snapshot for an exact barcode, or None
+    def get_by_barcode(self, barcode):
+        return self.get_many_by_barcode([barcode]).get(barcode)
+
+    # Snapshots keyed by barcode; the misses are fetched with one query on the unique barcode index
+    def get_many_by_barcode(self, barcodes):
+        self._sync()
+        found = {}
+        with self._lock:
+            for barcode in barcodes:
+                product_id = self._barcodes.get(barcode)
+                if product_id is not None:
+                    self._products.move_to_end(product_id)
+                    found[barcode] = self._products[product_id]
+        # Blank barcodes never identify a product
+        misses = {barcode for barcode in barcodes if barcode and barcode not in found}
+        if misses:
+            for snapshot in self._load(barcode__in=misses):
+                found[snapshot.barcode] = snapshot
+        return found
+
+    # All categories ordered by name
+    def categories(self):
+        self._sync()
+        with self._lock:
+            if self._categories is not None:
+                return self._categories
+        categories = [CategorySnapshot(*row) for row in Category.objects.order_by('name').values_list('id', 'name')]
+        with self._lock:
+            self._categories = categories
+        return categories
+
+    # Replace the stock level of cached products after a sale or stock movement committed in this process
+    def update_stock(self, stock_levels):
+        with self._lock:
+            for product_id, stock in stock_levels.items():
+                snapshot = self._products.get(product_id)
+                if snapshot is not None:
+                    self._products[product_id] = snapshot._replace(stock_quantity=stock)
+
+    # Forget one product in this process
+    def invalidate_product(self, product_id):
+        with self._lock:
+            snapshot = self._products.pop(product_id, None)
+            if snapshot is not None and snapshot.barcode:
+                self._barcodes.pop(snapshot.barcode, None)
+
+    # Forget everything in this process and re-read the version counter on next use
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+            self._version = None
+
+    def __len__(self):
+        return len(self._products)
+
+
+# Shared instance used by the views
+catalog = CatalogCache()
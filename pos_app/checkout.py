@@ -0,0 +1,226 @@
+# Import Django modules for the transactional checkout commit and offline sale ingestion
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import receipts, rollups, stock
+from .models import Product, Sale, SaleItem, StockMovement
+from .signals import sale_committed, sales_ingested
+
+# Payment method codes accepted by Sale.payment_method
+PAYMENT_METHODS = {code for code, label in Sale._meta.get_field('payment_method').choices}
+
+# Longest idempotency key accepted from a till
+CLIENT_KEY_LENGTH = Sale._meta.get_field('client_key').max_length
+
+# Outcomes of one sale in an ingested batch
+CREATED, DUPLICATE, REJECTED = 'created', 'duplicate', 'rejected'
+
+# Result of one sale in an ingested batch: the sale created for it (CREATED), the sale recorded earlier under
+# the same key (DUPLICATE), or None and the reason nothing was written for it (REJECTED)
+IngestResult = namedtuple('IngestResult', 'key status sale message')
+
+
+# Base class for checkout failures; the message is safe to show to the cashier
+class CheckoutError(Exception):
+    pass
+
+
+# Raised when the cart has nothing to sell
+class EmptyCartError(CheckoutError):
+    pass
+
+
+# Raised when a product in the cart has been deleted since it was added
+class ProductUnavailableError(CheckoutError):
+    pass
+
+
+# Raised when there is not enough stock left for a cart line
+class InsufficientStockError(CheckoutError):
+    def __init__(self, product):
+        self.product = product
+        super().__init__(f'Insufficient stock for {product.name}')
+
+
+# Normalise a session cart ({'<product id>': quantity}) to {int id: int quantity}
+def _quantities(cart):
+    quantities = {}
+    for product_id, quantity in cart.items():
+        quantity = int(quantity)
+        if quantity > 0:
+            quantities[int(product_id)] = quantity
+    return quantities
+
+
+# Check stock and price each line of a sale: returns [(product, quantity, total price)] and the sale total
+def _price(products, levels, quantities):
+    total_amount = Decimal('0.00')
+    lines = []
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        if product is None:
+            raise ProductUnavailableError('A product in the sale is no longer available')
+        if levels[product_id] < quantity:
+            raise InsufficientStockError(product)
+        total_price = product.price * quantity
+        total_amount += total_price
+        lines.append((product, quantity, total_price))
+    return lines, total_amount
+
+
+# Commit a cart as a Sale with a constant number of queries, whatever the basket size:
+# one locking read of all products (with their categories, for the receipt), one read of their stock from the ledger, one INSERT for the sale,
+# one bulk INSERT for the items and one bulk INSERT of their stock movements
+def checkout(user, cart, payment_method='cash'):
+    quantities = _quantities(cart)
+    if not quantities:
+        raise EmptyCartError('Cart is empty')
+    if payment_method not in PAYMENT_METHODS:
+        raise CheckoutError('Invalid payment method')
+
+    with transaction.atomic():
+        # Lock every cart product for the rest of the transaction, so two sales of the same product
+        # cannot both pass the stock check. The rows are never written (stock lives in the ledger), and
+        # the no-key lock still lets other transactions insert rows that reference them.
+        products = (Product.objects.select_related('category').select_for_update(of=('self',), no_key=True)
+                    .in_bulk(list(quantities)))
+        if len(products) != len(quantities):
+            raise ProductUnavailableError('A product in the cart is no longer available')
+        # Read stock in a new statement, after the locks are held, so it includes every committed movement
+        levels = stock.current_stock(quantities)
+
+        # Check stock and price each line
+        lines, total_amount = _price(products, levels, quantities)
+
+        # Create sale record, with the receipt as printed now
+        sale = Sale.objects.create(user=user, total_amount=total_amount, payment_method=payment_method,
+                                   receipt=receipts.snapshot(lines))
+        # Create all sale items in one INSERT
+        items = SaleItem.objects.bulk_create([
+            SaleItem(sale=sale, product=product, quantity=quantity,
+                     unit_price=product.price, total_price=total_price)
+            for product, quantity, total_price in lines
+        ])
+        # Take the items out of stock with one INSERT into the ledger
+        StockMovement.objects.bulk_create(stock.sale_movements(sale, items))
+
+        # Add the sale to the reporting rollups in the same transaction
+        rollups.apply_sale(sale, items)
+
+        # Tell caches and listeners about the sale once it is durable
+        stock_levels = {pid: levels[pid] - qty for pid, qty in quantities.items()}
+        transaction.on_commit(lambda: sale_committed.send(
+            sender=Sale, sale=sale, items=items, stock_levels=stock_levels,
+        ))
+    return sale
+
+
+# Validate one sale of an ingested batch, {"key": "...", "items": {"<product id>": quantity},
+# "payment_method": "cash", "sold_at": "<ISO 8601>"} (payment_method and sold_at are optional).
+# Returns (key, quantities, payment_method, sold_at); raises CheckoutError.
+def _offline_sale(entry, now):
+    if not isinstance(entry, dict):
+        raise CheckoutError('A sale must be a JSON object')
+    key = entry.get('key')
+    if not isinstance(key, str) or not 0 < len(key) <= CLIENT_KEY_LENGTH:
+        raise CheckoutError(f'key must be a string of 1 to {CLIENT_KEY_LENGTH} characters')
+    items = entry.get('items')
+    try:
+        quantities = _quantities(items)
+    except (AttributeError, TypeError, ValueError):
+        raise CheckoutError('items must map product ids to quantities')
+    if not quantities:
+        raise EmptyCartError('Sale has no items')
+    payment_method = entry.get('payment_method', 'cash')
+    if not isinstance(payment_method, str) or payment_method not in PAYMENT_METHODS:
+        raise CheckoutError('Invalid payment method')
+
+    sold_at = entry.get('sold_at')
+    if sold_at is None:
+        return key, quantities, payment_method, now
+    try:
+        sold_at = parse_datetime(sold_at)
+    except (TypeError, ValueError):
+        sold_at = None
+    if sold_at is None:
+        raise CheckoutError('sold_at must be an ISO 8601 date and time')
+    if timezone.is_naive(sold_at):
+        sold_at = timezone.make_aware(sold_at)
+    # A till whose clock runs ahead cannot record sales in the future
+    return key, quantities, payment_method, min(sold_at, now)
+
+
+# Record a batch of sales made by a till while it was offline, in one transaction and with a constant number
+# of queries whatever the batch size: one locking read of all the products, one read of the keys already
+# recorded, one read of their stock, one bulk INSERT each for the sales, their items and their stock
+# movements (split only by the database's limit on query parameters), and the rollups combined per row.
+# Sales stand alone: an invalid sale, or one without enough stock left after the sales before it, is rejected
+# without failing the batch, and a sale whose key is already recorded (a retried batch) is not recorded again.
+# Returns an IngestResult per sale, in order.
+def ingest(user, entries):
+    now = timezone.now()
+    results = [None] * len(entries)
+    valid = []
+    for index, entry in enumerate(entries):
+        try:
+            valid.append((index, *_offline_sale(entry, now)))
+        except CheckoutError as error:
+            key = entry.get('key') if isinstance(entry, dict) else None
+            results[index] = IngestResult(key, REJECTED, None, str(error))
+    if not valid:
+        return results
+
+    product_ids = sorted({product_id for _, _, quantities, _, _ in valid for product_id in quantities})
+    with transaction.atomic():
+        # Lock the products as checkout does. A concurrent retry of the same batch waits here and then finds
+        # the keys recorded by the first one.
+        products = (Product.objects.select_related('category').select_for_update(of=('self',), no_key=True)
+                    .in_bulk(product_ids))
+        recorded = Sale.objects.defer('receipt').in_bulk([key for _, key, _, _, _ in valid], field_name='client_key')
+        levels = stock.current_stock(products)
+
+        # Take each sale's lines out of the running stock levels, in the order the till made them
+        new_sales = []
+        for index, key, quantities, payment_method, sold_at in valid:
+            if key in recorded:
+                results[index] = IngestResult(key, DUPLICATE, recorded[key], '')
+                continue
+            try:
+                lines, total_amount = _price(products, levels, quantities)
+            except CheckoutError as error:
+                results[index] = IngestResult(key, REJECTED, None, str(error))
+                continue
+            for product, quantity, total_price in lines:
+                levels[product.pk] -= quantity
+            sale = Sale(user=user, total_amount=total_amount, payment_method=payment_method, created_at=sold_at,
+                        client_key=key, receipt=receipts.snapshot(lines))
+            # A key repeated later in the same batch is a duplicate of this sale
+            recorded[key] = sale
+            results[index] = IngestResult(key, CREATED, sale, '')
+            new_sales.append((sale, lines))
+        if not new_sales:
+            return results
+
+        # Create all sales in one INSERT (which sets their ids), then all their items in another
+        Sale.objects.bulk_create([sale for sale, lines in new_sales])
+        sales = [
+            (sale, [SaleItem(sale=sale, product=product, quantity=quantity, unit_price=product.price,
+                             total_price=total_price) for product, quantity, total_price in lines])
+            for sale, lines in new_sales
+        ]
+        SaleItem.objects.bulk_create([item for sale, items in sales for item in items])
+        # Take every item out of stock with one INSERT into the ledger
+        StockMovement.objects.bulk_create([
+            movement for sale, items in sales for movement in stock.sale_movements(sale, items)
+        ])
+        rollups.apply_sales(sales)
+
+        # Tell caches and listeners about the batch once it is durable
+        stock_levels = {product.pk: levels[product.pk] for sale, lines in new_sales for product, _, _ in lines}
+        created = [sale for sale, lines in new_sales]
+        transaction.on_commit(lambda: sales_ingested.send(sender=Sale, sales=created, stock_levels=stock_levels))
+    return results
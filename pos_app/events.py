@@ -0,0 +1,214 @@
+# Import standard library modules for the in-process broker and the event wire format
+import asyncio
+import json
+import threading
+from collections import deque, namedtuple
+from functools import cached_property
+
+# Import Django modules for settings and loading the configured fan-out backend
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# Defaults for settings.POS_EVENTS
+DEFAULTS = {
+    # Dotted path of the fan-out backend that carries events between processes
+    'BACKEND': 'pos_app.events.LocalFanout',
+    # Keyword arguments for the backend (e.g. {'URL': 'redis://localhost:6379/0'})
+    'OPTIONS': {},
+    # Events buffered per connected till before it is told to resynchronise
+    'QUEUE_SIZE': 1000,
+    # Recent events kept so a reconnecting till can resume from its Last-Event-ID
+    'HISTORY': 1000,
+    # Seconds between keep-alive comments on an idle stream
+    'HEARTBEAT': 15,
+}
+
+
+# Merged event settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_EVENTS', {}))
+    return config
+
+
+# One broadcast event: id is assigned by the receiving process, kind is the SSE event name
+class Event(namedtuple('Event', 'id kind data')):
+    # Server-Sent Events wire format, encoded once however many tills receive the event
+    @cached_property
+    def encoded(self):
+        return f'id: {self.id}\nevent: {self.kind}\ndata: {json.dumps(self.data, separators=(",", ":"))}\n\n'
+
+
+# Fan-out within this process only (runserver, or a single ASGI worker)
+class LocalFanout:
+    def __init__(self, **options):
+        self.dispatch = None
+
+    def start(self, dispatch):
+        self.dispatch = dispatch
+
+    def publish(self, kind, data):
+        self.dispatch(kind, data)
+
+
+# Fan-out through Redis pub/sub (or any server speaking the Redis protocol), so a sale committed by one
+# worker reaches the tills connected to every other worker. Requires the redis package.
+class RedisFanout:
+    def __init__(self, URL='redis://localhost:6379/0', CHANNEL='pos:events', client=None):
+        self.channel = CHANNEL
+        if client is None:
+            try:
+                import redis
+            except ImportError as exc:
+                raise ImproperlyConfigured('RedisFanout requires the redis package (pip install redis)') from exc
+            client = redis.Redis.from_url(URL)
+        self.client = client
+
+    # Listen on the channel in a daemon thread and hand every message to the local broker
+    def start(self, dispatch):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: lambda message: dispatch(*json.loads(message['data']))})
+        pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def publish(self, kind, data):
+        self.client.publish(self.channel, json.dumps([kind, data]))
+
+
+# A connected till's queue of events; only touched from its event loop
+class Subscription:
+    def __init__(self, loop, size):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=size)
+
+    # A till that falls too far behind is told to reload instead
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(Event(event.id, 'reset', {}))
+
+    async def get(self, timeout):
+        async with asyncio.timeout(timeout):
+            return await self.queue.get()
+
+
+# In-process broker: numbers events, keeps a short history and fans them out to the connected tills
+class Broker:
+    def __init__(self, backend=None, queue_size=None, history=None):
+        config = get_config()
+        self.queue_size = queue_size if queue_size is not None else config['QUEUE_SIZE']
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._history = deque(maxlen=history if history is not None else config['HISTORY'])
+        # {event loop: set of subscriptions}, so one dispatch wakes each loop once
+        self._subscribers = {}
+        if backend is None:
+            backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+        self.backend = backend
+        self.backend.start(self.dispatch)
+
+    # Send an event to the tills of every process
+    def publish(self, kind, data):
+        self.backend.publish(kind, data)
+
+    # Deliver an event that reached this process to its subscribers
+    def dispatch(self, kind, data):
+        with self._lock:
+            self._last_id += 1
+            event = Event(self._last_id, kind, data)
+            self._history.append(event)
+            loops = [(loop, list(subscriptions)) for loop, subscriptions in self._subscribers.items()]
+        for loop, subscriptions in loops:
+            loop.call_soon_threadsafe(_put_all, subscriptions, event)
+
+    # Register a till on the running event loop; returns the subscription and the events it missed
+    # since last_event_id (or a reset event if they are no longer in the history)
+    def subscribe(self, last_event_id=None):
+        subscription = Subscription(asyncio.get_running_loop(), self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(subscription.loop, set()).add(subscription)
+            if last_event_id is None:
+                missed = []
+            elif last_event_id > self._last_id or (self._history and last_event_id < self._history[0].id - 1):
+                # From another process or before a restart, or too old for the history
+                missed = [Event(self._last_id, 'reset', {})]
+            else:
+                missed = [event for event in self._history if event.id > last_event_id]
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.loop, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscribers.pop(subscription.loop, None)
+
+    def __len__(self):
+        return sum(len(subscriptions) for subscriptions in self._subscribers.values())
+
+
+# Queue an event for every till of one event loop (runs on that loop)
+def _put_all(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.put(event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+# The process-wide broker, created on first use
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = Broker()
+    return _broker
+
+
+# Forget the broker (after settings change in tests)
+def reset_broker():
+    global _broker
+    _broker = None
+
+
+# Publish an event to the tills
+def publish(kind, data):
+    get_broker().publish(kind, data)
+
+
+# Compact product state sent when a product is saved (prices as strings, like the JSON views)
+def product_payload(product):
+    return {
+        'id': product.pk,
+        'name': product.name,
+        'barcode': product.barcode,
+        'price': str(product.price),
+        'stock': product.stock_quantity,
+    }
+
+
+# Server-Sent Events for one till: missed events first, then live ones, with keep-alive comments
+async def stream(last_event_id=None, heartbeat=None):
+    heartbeat = heartbeat if heartbeat is not None else get_config()['HEARTBEAT']
+    broker = get_broker()
+    subscription, missed = broker.subscribe(last_event_id)
+    try:
+        # Ask the browser to reconnect quickly after a dropped connection
+        yield 'retry: 3000\n\n'
+        # Queued events are all newer than the missed ones, which were read under the same lock
+        for event in missed:
+            yield event.encoded
+        while True:
+            try:
+                event = await subscription.get(heartbeat)
+            except TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield event.encoded
+    finally:
+        broker.unsubscribe(subscription)
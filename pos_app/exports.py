@@ -0,0 +1,388 @@
+# Import standard library modules for the CSV writer, the XLSX zip container and XML escaping
+import csv
+import json
+import re
+import zipfile
+from datetime import date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+# Import Django modules for streaming responses and the report data
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import reports
+from .models import DailySalesRollup, SaleItem
+from .stock import current_stock_expression
+
+# Rows fetched per round trip from the database cursor (server-side on PostgreSQL)
+EXPORT_CHUNK_SIZE = 2000
+
+# CSV lines sent to the client per chunk
+CSV_LINES_PER_CHUNK = 500
+
+# Export formats offered by the sales report
+EXPORT_FORMATS = ('csv', 'xlsx', 'pdf')
+
+# Columns of the line-item exports
+LINE_ITEM_HEADER = [
+    'Sale ID', 'Date', 'Cashier', 'Payment Method', 'Product', 'Barcode', 'Category',
+    'Quantity', 'Unit Price', 'Line Total', 'Sale Total',
+]
+_LINE_ITEM_FIELDS = (
+    'sale_id', 'sale__created_at', 'sale__user__username', 'sale__payment_method', 'product__name',
+    'product__barcode', 'product__category__name', 'quantity', 'unit_price', 'total_price', 'sale__total_amount',
+)
+
+# Columns of the product catalog export, which imports.import_products reads back
+PRODUCT_HEADER = ['barcode', 'name', 'category', 'price', 'cost_price', 'stock_quantity', 'description']
+_PRODUCT_FIELDS = ('barcode', 'name', 'category__name', 'price', 'cost_price', 'current_stock', 'description')
+
+# Characters spreadsheets treat as the start of a formula
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+# Control characters that are not allowed in XML 1.0
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+# Line items of the given sales with their sale, cashier, product and category, streamed in chunks
+def line_item_rows(sales):
+    rows = (
+        SaleItem.objects.filter(sale__in=sales.order_by().values('pk'))
+        .order_by('sale_id', 'pk')
+        .values_list(*_LINE_ITEM_FIELDS)
+    )
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = list(row)
+        row[1] = timezone.localtime(row[1]).strftime('%Y-%m-%d %H:%M:%S')
+        yield row
+
+
+# File name for an export, e.g. sales-2025-01-01-to-2025-01-31.csv
+def export_filename(filters, extension):
+    start = filters.get('start_date')
+    end = filters.get('end_date')
+    if start or end:
+        period = f"{start.isoformat() if start else 'start'}-to-{end.isoformat() if end else date.today().isoformat()}"
+    else:
+        period = 'all'
+    return f'sales-{period}.{extension}'
+
+
+def _attachment(chunks, content_type, filename):
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# (chunks, content type, file name) for one of EXPORT_FORMATS (line items for CSV/XLSX, a rollup summary
+# for PDF); streamed by export_response or written to a file by the export_sales job
+def export_file(export_format, sales, filters, filename=None):
+    if export_format == 'csv':
+        return (csv_chunks(line_item_rows(sales)), 'text/csv; charset=utf-8',
+                filename or export_filename(filters, 'csv'))
+    if export_format == 'xlsx':
+        return (xlsx_chunks(line_item_rows(sales)),
+                'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                filename or export_filename(filters, 'xlsx'))
+    if export_format == 'pdf':
+        return pdf_chunks(summary_lines(filters)), 'application/pdf', filename or export_filename(filters, 'pdf')
+    raise ValueError(f'Unknown export format: {export_format}')
+
+
+# Streaming response for one of EXPORT_FORMATS
+def export_response(export_format, sales, filters, filename=None):
+    return _attachment(*export_file(export_format, sales, filters, filename))
+
+
+# File-like object whose write() hands the data back instead of storing it
+class _Echo:
+    def write(self, value):
+        return value
+
+
+# Keep user-entered text from being evaluated as a formula when the CSV is opened in a spreadsheet
+def _csv_safe(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+# CSV text for the header and rows, streamed in batches of lines
+def csv_chunks(rows, header=LINE_ITEM_HEADER, escape_formulas=True):
+    writer = csv.writer(_Echo())
+    # Byte order mark so spreadsheet programs detect UTF-8 (peso signs, accented names)
+    yield '\ufeff' + writer.writerow(header)
+    # Send lines in batches; one tiny chunk per row costs more in the server than the rows themselves
+    batch = []
+    for row in rows:
+        batch.append(writer.writerow([_csv_safe(value) for value in row] if escape_formulas else row))
+        if len(batch) >= CSV_LINES_PER_CHUNK:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+# Catalog rows (PRODUCT_HEADER order) of the given products with their exact stock, streamed in chunks
+def product_rows(products):
+    rows = (
+        products.order_by('pk').annotate(current_stock=current_stock_expression())
+        .values_list(*_PRODUCT_FIELDS)
+    )
+    return rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+# CSV of the product catalog. Values are written as they are (no formula escaping), so the file
+# imports back unchanged.
+def product_csv_chunks(products):
+    return csv_chunks(product_rows(products), header=PRODUCT_HEADER, escape_formulas=False)
+
+
+# JSON Lines of the product catalog, one object per product, streamed in batches of lines
+def product_jsonl_chunks(products):
+    batch = []
+    for row in product_rows(products):
+        record = dict(zip(PRODUCT_HEADER, row))
+        record['price'] = str(record['price'])
+        record['cost_price'] = str(record['cost_price'])
+        batch.append(json.dumps(record, ensure_ascii=False) + '\n')
+        if len(batch) >= CSV_LINES_PER_CHUNK:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+# (chunks, content type, file name) for products as 'csv' or 'jsonl'
+def product_export_file(export_format, products, filename=None):
+    if export_format == 'csv':
+        return product_csv_chunks(products), 'text/csv; charset=utf-8', filename or 'products.csv'
+    if export_format == 'jsonl':
+        return product_jsonl_chunks(products), 'application/x-ndjson; charset=utf-8', filename or 'products.jsonl'
+    raise ValueError(f'Unknown export format: {export_format}')
+
+
+# Streaming download of products as 'csv' or 'jsonl'
+def product_export_response(export_format, products, filename=None):
+    return _attachment(*product_export_file(export_format, products, filename))
+
+
+# Write-only sink that the zip writer appends to and the generator drains after every chunk
+class _ChunkSink:
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# Static parts of a one-sheet workbook
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sales" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+# One <row> of inline cells: numbers as values, everything else as inline strings
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if isinstance(value, (int, Decimal)) and not isinstance(value, bool):
+            cells.append(f'<c><v>{value}</v></c>')
+        elif value is None or value == '':
+            cells.append('<c/>')
+        else:
+            text = escape(_XML_INVALID.sub('', str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+# XLSX workbook bytes, produced incrementally: the sheet is deflated and sent as rows arrive
+def xlsx_chunks(rows):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        yield sink.drain()
+        # force_zip64 because the sheet size is unknown when its entry is opened
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(LINE_ITEM_HEADER).encode())
+            buffered = []
+            for row in rows:
+                buffered.append(_xlsx_row(row))
+                if len(buffered) >= EXPORT_CHUNK_SIZE:
+                    sheet.write(''.join(buffered).encode())
+                    buffered = []
+                    yield sink.drain()
+            sheet.write(''.join(buffered).encode())
+            sheet.write(b'</sheetData></worksheet>')
+        yield sink.drain()
+    # Closing the archive writes the central directory
+    yield sink.drain()
+
+
+# Text lines of the PDF summary: totals, breakdowns and one line per day, all read from the rollups
+def summary_lines(filters):
+    summary = reports.rollup_summary(filters)
+    start = filters.get('start_date')
+    end = filters.get('end_date')
+    lines = [
+        ('title', 'Sales Summary'),
+        ('text', f"Period: {start.isoformat() if start else 'beginning'} to {end.isoformat() if end else 'today'}"),
+    ]
+    if filters.get('payment_method'):
+        lines.append(('text', f"Payment method: {filters['payment_method']}"))
+    if filters.get('user'):
+        lines.append(('text', f"Cashier: {filters['user']}"))
+    lines += [
+        ('text', f"Sales: {summary['count']}    Total: {summary['total']}    Average: {summary['average']}"),
+        ('blank', ''),
+        ('heading', 'By payment method'),
+    ]
+    lines += [('row', f"{row['key']:<20}{row['count']:>10}{row['total']:>16}") for row in summary['by_payment_method']]
+    lines += [('blank', ''), ('heading', 'By cashier')]
+    lines += [('row', f"{row['key']:<20}{row['count']:>10}{row['total']:>16}") for row in summary['by_cashier']]
+    lines += [('blank', ''), ('heading', f"{'Day':<20}{'Sales':>10}{'Total':>16}")]
+    days = (
+        reports.filter_daily_rollup(DailySalesRollup.objects.all(), filters)
+        .order_by()
+        .values('day')
+        .annotate(count=Sum('sale_count'), total=Sum('total_amount'))
+        .filter(count__gt=0)
+        .order_by('day')
+    )
+    for row in days.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        lines.append(('row', f"{row['day'].isoformat():<20}{row['count']:>10}{row['total']:>16}"))
+    return lines
+
+
+# Page geometry (points) and fonts for the PDF summary
+_PDF_PAGE_WIDTH = 595
+_PDF_PAGE_HEIGHT = 842
+_PDF_MARGIN = 50
+_PDF_LINE_HEIGHT = 14
+_PDF_LINES_PER_PAGE = (_PDF_PAGE_HEIGHT - 2 * _PDF_MARGIN) // _PDF_LINE_HEIGHT
+_PDF_FONTS = {'title': ('F2', 16), 'heading': ('F2', 11), 'text': ('F1', 10), 'row': ('F3', 10), 'blank': ('F1', 10)}
+
+
+def _pdf_text(value):
+    # Standard fonts use WinAnsi; characters outside Latin-1 are replaced
+    value = value.encode('latin-1', 'replace').decode('latin-1')
+    return value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+# Minimal PDF (standard fonts, one content stream per page) written page by page
+def pdf_chunks(lines):
+    offsets = {}
+    position = 0
+
+    def emit(number, body):
+        nonlocal position
+        data = f'{number} 0 obj\n'.encode('latin-1') + body + b'\nendobj\n'
+        offsets[number] = position
+        position += len(data)
+        return data
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = len(header)
+    # Objects 1-5: catalog, page tree (written last, once the page count is known), fonts
+    chunk = header
+    chunk += emit(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    chunk += emit(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>')
+    chunk += emit(4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>')
+    chunk += emit(5, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>')
+    yield chunk
+
+    pages = []
+    next_number = 6
+    page_lines = []
+
+    def page_objects(number, content_lines, page_index):
+        commands = ['BT']
+        y = _PDF_PAGE_HEIGHT - _PDF_MARGIN
+        for kind, text in content_lines:
+            font, size = _PDF_FONTS[kind]
+            commands.append(f'/{font} {size} Tf 1 0 0 1 {_PDF_MARGIN} {y} Tm ({_pdf_text(text)}) Tj')
+            y -= _PDF_LINE_HEIGHT
+        commands.append(f'/F1 8 Tf 1 0 0 1 {_PDF_MARGIN} {_PDF_MARGIN // 2} Tm (Page {page_index}) Tj')
+        commands.append('ET')
+        stream = '\n'.join(commands).encode('latin-1')
+        content = emit(number + 1, f'<< /Length {len(stream)} >>\nstream\n'.encode('latin-1') + stream
+                       + b'\nendstream')
+        page = emit(number, (
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {_PDF_PAGE_WIDTH} {_PDF_PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R /F2 4 0 R /F3 5 0 R >> >> /Contents {number + 1} 0 R >>'
+        ).encode('latin-1'))
+        return content + page
+
+    for line in lines:
+        page_lines.append(line)
+        if len(page_lines) == _PDF_LINES_PER_PAGE:
+            pages.append(next_number)
+            yield page_objects(next_number, page_lines, len(pages))
+            next_number += 2
+            page_lines = []
+    if page_lines or not pages:
+        pages.append(next_number)
+        yield page_objects(next_number, page_lines, len(pages))
+        next_number += 2
+
+    kids = ' '.join(f'{number} 0 R' for number in pages)
+    tail = emit(2, f'<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>'.encode('latin-1'))
+    xref_position = position
+    xref = [f'xref\n0 {next_number}\n', '0000000000 65535 f \n']
+    xref += [f'{offsets[number]:010d} 00000 n \n' for number in range(1, next_number)]
+    tail += ''.join(xref).encode('latin-1')
+    tail += f'trailer\n<< /Size {next_number} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n'.encode('latin-1')
+    yield tail
@@ -0,0 +1,171 @@
+# Import standard library modules for the history window
+from datetime import timedelta
+
+# NumPy is optional: without it forecasts are not computed and stock is judged by fixed thresholds
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Import Django modules for settings and the history, stock and forecast tables
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from . import stock
+from .models import Product, ProductDailyRollup, StockForecast
+
+# Defaults for settings.POS_FORECAST
+DEFAULTS = {
+    # Days of sales history the forecast is computed from
+    'HISTORY_DAYS': 56,
+    # Days in the short moving average
+    'MOVING_AVERAGE_DAYS': 7,
+    # Weight of the newest day in the exponentially smoothed demand (0-1; higher follows changes faster)
+    'SMOOTHING': 0.3,
+    # Days between ordering and receiving stock
+    'LEAD_TIME_DAYS': 7,
+    # Days between orders; a reorder covers the lead time plus this
+    'REVIEW_DAYS': 7,
+    # Standard deviations of daily demand held as safety stock (1.65 covers about 95% of lead times)
+    'SERVICE_FACTOR': 1.65,
+    # Days of cover above which a product is overstocked
+    'OVERSTOCK_DAYS': 90,
+    # Forecast rows written per INSERT
+    'BATCH_SIZE': 2000,
+}
+
+# Fixed thresholds for products without a forecast (new products, or no NumPy)
+LOW_STOCK = 10
+
+# Columns rewritten on every run
+_FORECAST_FIELDS = ['velocity', 'moving_average', 'forecast', 'safety_stock', 'reorder_point', 'reorder_quantity',
+                    'stock', 'days_of_cover', 'status', 'computed_at']
+
+
+# Merged forecast settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_FORECAST', {}))
+    return config
+
+
+# Whether NumPy is installed
+def available():
+    return np is not None
+
+
+# Daily units sold as a matrix (one row per product id, one column per day from start), filled from the
+# per-product daily rollup in one query
+def demand_matrix(product_ids, start, days):
+    demand = np.zeros((len(product_ids), days))
+    rows = (ProductDailyRollup.objects.filter(day__gte=start, day__lt=start + timedelta(days=days), quantity__gt=0)
+            .values_list('product_id', 'day', 'quantity'))
+    rows = list(rows.iterator(chunk_size=10000))
+    if rows:
+        products, dates, quantities = zip(*rows)
+        products = np.array(products, dtype=np.int64)
+        index = np.searchsorted(product_ids, products)
+        found = (index < len(product_ids)) & (product_ids[np.minimum(index, len(product_ids) - 1)] == products)
+        columns = np.array([(day - start).days for day in dates])
+        np.add.at(demand, (index[found], columns[found]), np.array(quantities, dtype=float)[found])
+    return demand
+
+
+# Forecast figures for every product from its daily demand (rows of the matrix) and current stock, as arrays
+def forecast(demand, levels, config=None):
+    config = config or get_config()
+    days = demand.shape[1]
+    velocity = demand.sum(axis=1) / days
+    moving_average = demand[:, -min(config['MOVING_AVERAGE_DAYS'], days):].mean(axis=1)
+
+    # Exponential smoothing of all products at once, one day at a time, starting from the window average
+    smoothing = config['SMOOTHING']
+    level = velocity.copy()
+    for day in range(days):
+        level = smoothing * demand[:, day] + (1 - smoothing) * level
+
+    lead_time = config['LEAD_TIME_DAYS']
+    safety_stock = np.ceil(config['SERVICE_FACTOR'] * demand.std(axis=1) * np.sqrt(lead_time))
+    reorder_point = np.ceil(level * lead_time + safety_stock)
+    target = np.ceil(level * (lead_time + config['REVIEW_DAYS']) + safety_stock)
+    reorder_quantity = np.maximum(target - levels, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cover = np.where(levels <= 0, 0.0, levels / level)
+
+    status = np.select(
+        [levels <= 0, level <= 0, levels <= reorder_point, cover > config['OVERSTOCK_DAYS']],
+        [StockForecast.OUT, StockForecast.IDLE, StockForecast.REORDER, StockForecast.OVERSTOCK],
+        StockForecast.OK,
+    )
+    return {
+        'velocity': velocity,
+        'moving_average': moving_average,
+        'forecast': level,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'reorder_quantity': reorder_quantity,
+        'days_of_cover': np.where(np.isfinite(cover), cover, np.nan),
+        'status': status,
+    }
+
+
+# Recompute the forecasts of the whole catalog: one read of product stock levels, one of the daily sales
+# history, one NumPy pass, then batched upserts. Returns the number of products forecast.
+def run(today=None):
+    if np is None:
+        raise ImproperlyConfigured('Demand forecasting requires NumPy (pip install numpy)')
+    config = get_config()
+    today = today or timezone.localdate()
+    days = config['HISTORY_DAYS']
+    # The window ends with yesterday, the last complete day
+    start = today - timedelta(days=days)
+
+    products = (Product.objects.annotate(current_stock=stock.current_stock_expression())
+                .order_by('pk').values_list('pk', 'current_stock'))
+    rows = list(products.iterator(chunk_size=10000))
+    if not rows:
+        return 0
+    product_ids = np.array([pk for pk, level in rows], dtype=np.int64)
+    levels = np.array([level for pk, level in rows], dtype=float)
+    figures = forecast(demand_matrix(product_ids, start, days), levels, config)
+
+    now = timezone.now()
+    cover = figures['days_of_cover']
+    forecasts = [
+        StockForecast(
+            product_id=int(product_id),
+            velocity=round(float(figures['velocity'][index]), 3),
+            moving_average=round(float(figures['moving_average'][index]), 3),
+            forecast=round(float(figures['forecast'][index]), 3),
+            safety_stock=int(figures['safety_stock'][index]),
+            reorder_point=int(figures['reorder_point'][index]),
+            reorder_quantity=int(figures['reorder_quantity'][index]),
+            stock=int(levels[index]),
+            days_of_cover=None if np.isnan(cover[index]) else round(float(cover[index]), 1),
+            status=str(figures['status'][index]),
+            computed_at=now,
+        )
+        for index, product_id in enumerate(product_ids)
+    ]
+    with transaction.atomic():
+        StockForecast.objects.bulk_create(forecasts, batch_size=config['BATCH_SIZE'], update_conflicts=True,
+                                          unique_fields=['product'], update_fields=_FORECAST_FIELDS)
+    return len(forecasts)
+
+
+# Stock status of a product for display: from its StockForecast's reorder point when there is one, else from
+# LOW_STOCK. quantity is the current stock; returns a StockForecast status.
+def stock_status(quantity, product_forecast=None):
+    if quantity <= 0:
+        return StockForecast.OUT
+    if product_forecast is None:
+        return StockForecast.REORDER if quantity < LOW_STOCK else StockForecast.OK
+    if product_forecast.forecast <= 0:
+        return StockForecast.IDLE
+    if quantity <= product_forecast.reorder_point:
+        return StockForecast.REORDER
+    if quantity / product_forecast.forecast > get_config()['OVERSTOCK_DAYS']:
+        return StockForecast.OVERSTOCK
+    return StockForecast.OK
@@ -0,0 +1,281 @@
+# Import standard library modules for reading CSV and JSON Lines files as streams
+import csv
+import io
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+# Import Django modules for the batched upserts
+from django.db import connections, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from . import events, pagecache, search, stock
+from .catalog import bump_version, catalog
+from .models import Category, Product
+
+# Rows validated and written per transaction
+IMPORT_CHUNK_SIZE = 2000
+
+# File formats read by import_products (and written by exports.product_export_response)
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# Columns of a product file; barcode identifies the product, blank cells leave a value unchanged
+PRODUCT_COLUMNS = ('barcode', 'name', 'category', 'price', 'cost_price', 'stock_quantity', 'description')
+# Columns a row needs to create a product that does not exist yet
+REQUIRED_FOR_NEW = ('name', 'category', 'price')
+
+# Errors kept for the report (all of them are counted)
+MAX_REPORTED_ERRORS = 100
+
+# Largest price Product.price and Product.cost_price can hold (10 digits, 2 decimal places)
+_MAX_PRICE = Decimal('99999999.99')
+_CENT = Decimal('0.01')
+
+
+# Raised for a row that cannot be imported; the message is shown with the row's line number
+class RowError(Exception):
+    pass
+
+
+# Running totals of an import, passed to the progress callback after every chunk
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.stock_adjusted = 0
+        self.error_count = 0
+        # (line number, message) for the first MAX_REPORTED_ERRORS errors
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+# File format from a file name, unless one is given
+def guess_format(name, file_format=None):
+    if file_format:
+        return file_format
+    extension = os.path.splitext(name or '')[1].lower().lstrip('.')
+    return 'jsonl' if extension in ('jsonl', 'ndjson', 'json') else 'csv'
+
+
+# (line number, {column: value}) for every row of a binary or text stream, read one line at a time;
+# malformed JSON lines come through as (line number, None)
+def read_rows(stream, file_format):
+    if not isinstance(stream, io.TextIOBase):
+        # utf-8-sig drops the byte order mark written by the CSV export and by spreadsheet programs
+        wrapper = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        try:
+            yield from read_rows(wrapper, file_format)
+        finally:
+            # Hand the binary stream back open; a discarded wrapper would close it
+            wrapper.detach()
+        return
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f'Unknown import format: {file_format}')
+
+
+def _text(value, column, max_length):
+    value = str(value).strip()
+    if len(value) > max_length:
+        raise RowError(f'{column} is longer than {max_length} characters')
+    return value
+
+
+def _price(value, column):
+    try:
+        # JSON numbers arrive as floats; go through their shortest text form
+        price = Decimal(repr(value) if isinstance(value, float) else str(value).strip())
+    except InvalidOperation:
+        raise RowError(f'{column} is not a number: {value!r}') from None
+    if not price.is_finite() or price < 0 or price > _MAX_PRICE or price != price.quantize(_CENT):
+        raise RowError(f'{column} must be between 0 and {_MAX_PRICE} with at most 2 decimal places')
+    return price.quantize(_CENT)
+
+
+def _quantity(value):
+    try:
+        quantity = int(str(value).strip())
+    except ValueError:
+        raise RowError(f'stock_quantity is not a whole number: {value!r}') from None
+    if quantity < 0:
+        raise RowError('stock_quantity cannot be negative')
+    return quantity
+
+
+# Parsers of the product columns
+_PARSERS = {
+    'barcode': lambda value: _text(value, 'barcode', 100),
+    'name': lambda value: _text(value, 'name', 200),
+    'category': lambda value: _text(value, 'category', 100),
+    'price': lambda value: _price(value, 'price'),
+    'cost_price': lambda value: _price(value, 'cost_price'),
+    'stock_quantity': _quantity,
+    'description': str,
+}
+
+
+# The product columns given in a row, parsed; unknown columns are ignored
+def clean_row(row):
+    values = {}
+    for column, parse in _PARSERS.items():
+        value = row.get(column)
+        if value is None or value == '':
+            continue
+        values[column] = parse(value)
+    if not values.get('barcode'):
+        raise RowError('barcode is required')
+    return values
+
+
+# Columns written by the upsert, in INSERT order
+_UPSERT_COLUMNS = ('barcode', 'name', 'category_id', 'price', 'cost_price', 'stock_quantity', 'description',
+                   'created_at', 'updated_at')
+# Columns of existing products an import can change (stock goes through the ledger instead)
+_UPDATABLE_COLUMNS = ('name', 'category_id', 'price', 'cost_price', 'description')
+# Columns copied into the search index
+_INDEXED_COLUMNS = {'name', 'category_id', 'description'}
+
+
+# Insert or update products on barcode: the INSERT ... ON CONFLICT (barcode) DO UPDATE statement that
+# bulk_create(update_conflicts=True, unique_fields=['barcode']) generates, executed once per chunk with
+# plain value tuples. bulk_create builds a model instance and prepares every value through its field,
+# which costs more than the database work for a large price file.
+def _upsert(rows, update_columns, using='default'):
+    connection = connections[using]
+    ops = connection.ops
+    fields = [Product._meta.get_field(column) for column in _UPSERT_COLUMNS]
+    suffix = ops.on_conflict_suffix_sql(fields, OnConflict.UPDATE, list(update_columns), ['barcode'])
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {ops.quote_name(Product._meta.db_table)} "
+            f"({', '.join(ops.quote_name(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))}) {suffix}",
+            rows,
+        )
+
+
+# Validate and upsert one chunk of rows ({barcode: (line number, values)}) and update the report
+def _import_chunk(rows, categories, report, user, dry_run):
+    existing = {
+        row['barcode']: row for row in Product.objects.filter(barcode__in=list(rows)).values(
+            'pk', 'barcode', 'name', 'category_id', 'price', 'cost_price', 'description',
+        )
+    }
+
+    # Every category of the chunk, created in one INSERT if new
+    wanted = {values['category'] for line, values in rows.values() if 'category' in values}
+    missing = wanted - categories.keys()
+    if missing and not dry_run:
+        Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+        categories.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+
+    now = connections['default'].ops.adapt_datetimefield_value(timezone.now())
+    upserts = []
+    columns = set()
+    created = {}
+    levels = {}
+    for barcode, (line, values) in rows.items():
+        current = existing.get(barcode)
+        if current is None:
+            absent = [column for column in REQUIRED_FOR_NEW if column not in values]
+            if absent:
+                report.error(line, f"new product {barcode} needs {', '.join(absent)}")
+                continue
+            created[barcode] = values.get('stock_quantity', 0)
+        elif 'stock_quantity' in values:
+            levels[current['pk']] = values['stock_quantity']
+        if 'category' in values:
+            values = {**values, 'category_id': categories.get(values['category'])}
+        columns.update(values)
+        # Columns missing from the row keep the product's current values
+        product = {**(current or {'cost_price': Decimal('0.00'), 'description': ''}), **values}
+        upserts.append((
+            barcode, product['name'], product['category_id'], product['price'], product['cost_price'],
+            created.get(barcode, 0), product['description'], now, now,
+        ))
+
+    report.created += len(created)
+    report.updated += len(upserts) - len(created)
+    if dry_run or not upserts:
+        return
+
+    with transaction.atomic():
+        _upsert(upserts, [column for column in _UPDATABLE_COLUMNS if column in columns] + ['updated_at'])
+        ids = dict(Product.objects.filter(barcode__in=list(created)).values_list('barcode', 'pk'))
+        # New products get their stock ledger opened, like a saved product does
+        stock.open_inventory([Product(pk=ids[barcode], stock_quantity=quantity)
+                              for barcode, quantity in created.items()])
+        if levels:
+            before = stock.current_stock(levels)
+            stock.set_levels(levels, user=user, note='Product import')
+            report.stock_adjusted += sum(1 for pk, quantity in levels.items() if before.get(pk) != quantity)
+        # New products are indexed for search; existing ones only if an indexed column changed
+        indexed = list(ids.values())
+        if columns & _INDEXED_COLUMNS:
+            indexed += [existing[barcode]['pk'] for barcode in rows if barcode in existing]
+        search.index_products(indexed)
+
+
+# Import products from a CSV or JSON Lines stream, chunk by chunk, without reading the whole file.
+# Rows are matched on barcode: existing products are updated (only the given columns), new ones created.
+# Invalid rows are reported and skipped; each chunk is committed on its own. progress(report) is called
+# after every chunk.
+def import_products(stream, file_format='csv', user=None, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False,
+                    progress=None):
+    report = ImportReport()
+    categories = dict(Category.objects.values_list('name', 'pk'))
+    chunk = {}
+
+    def flush():
+        _import_chunk(chunk, categories, report, user, dry_run)
+        chunk.clear()
+        if progress is not None:
+            progress(report)
+
+    for line, row in read_rows(stream, file_format):
+        report.rows += 1
+        if row is None:
+            report.error(line, 'not a JSON object')
+            continue
+        try:
+            values = clean_row(row)
+        except RowError as exc:
+            report.error(line, str(exc))
+            continue
+        barcode = values['barcode']
+        if barcode in chunk:
+            # A later row for the same barcode wins; one upsert cannot touch a row twice
+            values = {**chunk.pop(barcode)[1], **values}
+        chunk[barcode] = (line, values)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    if not dry_run and report.created + report.updated:
+        # Cached products are stale in every process; tills reload their product grid
+        catalog.clear()
+        bump_version()
+        # The upserts bypass the model signals that bump the page cache versions
+        pagecache.bump('catalog', 'categories', 'stock')
+        events.publish('reset', {})
+    return report
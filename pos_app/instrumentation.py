@@ -0,0 +1,289 @@
+# Import standard library modules for timing, stack inspection and the rolling statistics
+import atexit
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+from pathlib import Path
+
+# Import Django settings and database connections
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('pos_app.instrumentation')
+
+# Defaults for settings.POS_INSTRUMENTATION
+DEFAULTS = {
+    # Record queries and timings for every request
+    'ENABLED': False,
+    # Add a Server-Timing header to every response
+    'SERVER_TIMING': True,
+    # Log a warning when the same query shape runs this many times in one request (0 disables)
+    'N_PLUS_ONE_THRESHOLD': 5,
+    # Number of recent requests kept per view for percentiles and histograms
+    'WINDOW': 500,
+    # Directory where each process writes its statistics for the dump_instrumentation command
+    'DUMP_DIR': None,
+    # Seconds between writes of the statistics file
+    'FLUSH_INTERVAL': 30,
+}
+
+# Upper bounds (milliseconds) of the latency histogram buckets
+HISTOGRAM_BOUNDS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+# Regexes that turn SQL into a fingerprint shared by queries that differ only in values
+_IN_LIST = re.compile(r'\bIN \(\?(?:,\s*\?)*\)', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SAVEPOINT = re.compile(r'("s\d+_x\d+")')
+# Transaction control statements: every atomic() block issues them, so they repeat without being N+1 queries
+_TRANSACTION_CONTROL = re.compile(r'^\s*(?:SAVEPOINT|RELEASE|ROLLBACK|BEGIN|COMMIT|START TRANSACTION)\b',
+                                  re.IGNORECASE)
+
+# Directory of this project's code; frames outside it (Django, site-packages) are skipped
+_PROJECT_DIR = str(Path(__file__).resolve().parent.parent)
+_THIS_FILE = str(Path(__file__).resolve())
+
+
+# Merged instrumentation settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_INSTRUMENTATION', {}))
+    return config
+
+
+# Normalise a SQL statement so repeated shapes (N+1 queries) compare equal
+def fingerprint(sql):
+    sql = _SAVEPOINT.sub('"sp"', sql)
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql).replace('%s', '?')
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return ' '.join(sql.split())
+
+
+# Closest project frame (file:line in function) that issued the current query
+def _stack_site():
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_PROJECT_DIR) and filename != _THIS_FILE and 'site-packages' not in filename:
+            return f'{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '<django>'
+
+
+# Execute wrapper that records every query run while a request is being handled
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((fingerprint(sql), time.perf_counter() - started, _stack_site()))
+
+    # Total time spent in the database, in seconds
+    @property
+    def sql_seconds(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+    # Fingerprints that ran more than once, with their count and the code sites that issued them
+    # (transaction control statements aside)
+    def duplicates(self):
+        counts = Counter(shape for shape, _, _ in self.queries if not _TRANSACTION_CONTROL.match(shape))
+        sites = defaultdict(set)
+        for shape, _, site in self.queries:
+            if counts[shape] > 1:
+                sites[shape].add(site)
+        return {shape: (count, sorted(sites[shape])) for shape, count in counts.items() if count > 1}
+
+
+# Rolling per-view statistics for this process
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = time.monotonic()
+
+    def record(self, view_name, latency_ms, query_count, sql_ms, duplicates, window):
+        with self.lock:
+            view = self.views.get(view_name)
+            if view is None or view['samples'].maxlen != window:
+                view = self.views[view_name] = {
+                    'samples': deque(maxlen=window),
+                    'duplicates': Counter(),
+                    'requests': 0,
+                }
+            view['samples'].append((round(latency_ms, 3), query_count, round(sql_ms, 3)))
+            view['requests'] += 1
+            for shape, (count, _) in duplicates.items():
+                view['duplicates'][shape] += count
+
+    # JSON-serialisable copy of the statistics
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'written_at': time.time(),
+                'views': {
+                    name: {
+                        'requests': view['requests'],
+                        'samples': list(view['samples']),
+                        'duplicates': dict(view['duplicates'].most_common(10)),
+                    }
+                    for name, view in self.views.items()
+                },
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    # Write this process's statistics so the management command can read them
+    def flush(self, dump_dir):
+        if not dump_dir:
+            return
+        os.makedirs(dump_dir, exist_ok=True)
+        path = os.path.join(dump_dir, f'instrumentation-{os.getpid()}.json')
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(temp_path, path)
+        self.last_flush = time.monotonic()
+
+    def maybe_flush(self, dump_dir, interval):
+        if dump_dir and time.monotonic() - self.last_flush >= interval:
+            self.flush(dump_dir)
+
+
+registry = Registry()
+
+
+# Write the final statistics when the process exits
+@atexit.register
+def _flush_at_exit():
+    try:
+        config = get_config()
+    except Exception:  # noqa: BLE001 - settings may be unavailable while the interpreter shuts down
+        return
+    if config['ENABLED'] and registry.views:
+        registry.flush(config['DUMP_DIR'])
+
+
+# Summary statistics (percentiles, histogram) for a list of (latency, queries, sql) samples
+def summarize(samples):
+    latencies = sorted(sample[0] for sample in samples)
+    queries = [sample[1] for sample in samples]
+
+    def pct(value):
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(round(value / 100 * (len(latencies) - 1))))]
+
+    histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for latency in latencies:
+        bucket = next((i for i, bound in enumerate(HISTOGRAM_BOUNDS_MS) if latency <= bound), len(HISTOGRAM_BOUNDS_MS))
+        histogram[bucket] += 1
+    return {
+        'count': len(samples),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'mean_queries': round(sum(queries) / len(queries), 2) if queries else 0.0,
+        'max_queries': max(queries) if queries else 0,
+        'mean_sql_ms': round(sum(sample[2] for sample in samples) / len(samples), 3) if samples else 0.0,
+        'histogram': histogram,
+    }
+
+
+# Merge the statistics files written by every process
+def load_dumps(dump_dir):
+    merged = defaultdict(lambda: {'requests': 0, 'samples': [], 'duplicates': Counter()})
+    files = sorted(Path(dump_dir).glob('instrumentation-*.json')) if dump_dir else []
+    for path in files:
+        with open(path) as handle:
+            data = json.load(handle)
+        for name, view in data['views'].items():
+            merged[name]['requests'] += view['requests']
+            merged[name]['samples'].extend(tuple(sample) for sample in view['samples'])
+            merged[name]['duplicates'].update(view['duplicates'])
+    return merged, files
+
+
+# Middleware that measures latency, query count, SQL time and duplicate queries for each view.
+# Works in both sync and async chains so async views are not pushed into a thread under ASGI.
+class QueryInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = get_config()
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with self._recording(recorder):
+            response = self.get_response(request)
+        return self._finish(request, response, config, recorder, started)
+
+    async def __acall__(self, request):
+        config = get_config()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with self._recording(recorder):
+            response = await self.get_response(request)
+        return self._finish(request, response, config, recorder, started)
+
+    # Record the queries of every database connection
+    def _recording(self, recorder):
+        stack = ExitStack()
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        return stack
+
+    # Store the request's statistics, log N+1 patterns and add the Server-Timing header
+    def _finish(self, request, response, config, recorder, started):
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else '<unresolved>'
+        sql_ms = recorder.sql_seconds * 1000
+        duplicates = recorder.duplicates()
+        registry.record(view_name, latency_ms, len(recorder.queries), sql_ms, duplicates, config['WINDOW'])
+
+        # Log query shapes that repeat often enough to be an N+1 pattern, with the code that issued them
+        threshold = config['N_PLUS_ONE_THRESHOLD']
+        if threshold:
+            for shape, (count, sites) in duplicates.items():
+                if count >= threshold:
+                    logger.warning('Possible N+1 in %s: %d x %s\n  issued from: %s',
+                                   view_name, count, shape, '; '.join(sites))
+
+        if config['SERVER_TIMING']:
+            duplicate_count = sum(count - 1 for count, _ in duplicates.values())
+            response['Server-Timing'] = (
+                f'app;dur={latency_ms:.1f}, '
+                f'db;dur={sql_ms:.1f};desc="{len(recorder.queries)} queries", '
+                f'dup;desc="{duplicate_count} duplicate queries"'
+            )
+        registry.maybe_flush(config['DUMP_DIR'], config['FLUSH_INTERVAL'])
+        return response
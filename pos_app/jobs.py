@@ -0,0 +1,329 @@
+# Import standard library modules for job keys, worker threads and result files
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+
+# Import Django modules for settings, transactions and the job table
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Defaults for settings.POS_JOBS
+DEFAULTS = {
+    # 'worker': jobs wait for `manage.py run_jobs`; 'thread': a worker thread inside each web process
+    # (the stand-in when no worker runs, e.g. runserver); 'eager': jobs run inside enqueue() (tests)
+    'MODE': 'worker',
+    # Directory for result files such as exports (default: BASE_DIR / 'var' / 'jobs')
+    'RESULT_DIR': None,
+    # Seconds an idle worker waits before looking for queued jobs again
+    'POLL_INTERVAL': 1.0,
+    # Seconds without a heartbeat after which a running job is considered lost with its worker
+    'HEARTBEAT_TIMEOUT': 120,
+    # Starts of a lost job before it is marked failed
+    'MAX_ATTEMPTS': 3,
+    # Days finished jobs and their result files are kept
+    'KEEP_DAYS': 7,
+}
+
+# Priorities: a waiting manager's report goes before exports, and both before maintenance
+HIGH = 10
+NORMAL = 0
+LOW = -10
+
+# Seconds between progress writes of one job (heartbeats of a job that reports no progress)
+PROGRESS_INTERVAL = 1.0
+
+# Seconds between sweeps for lost and expired jobs by each worker
+MAINTENANCE_INTERVAL = 60
+
+# Job states that hold a key: another request for the same work waits for this job
+ACTIVE = (Job.QUEUED, Job.RUNNING)
+
+
+# Merged job settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_JOBS', {}))
+    if config['RESULT_DIR'] is None:
+        config['RESULT_DIR'] = os.path.join(settings.BASE_DIR, 'var', 'jobs')
+    return config
+
+
+# A registered task: func(job, **params) returns a JSON-serialisable result. ttl is how long (in seconds)
+# the result of a finished job is handed to identical requests; 0 dedupes only while queued or running.
+Task = namedtuple('Task', 'name func priority ttl')
+
+# {task name: Task}
+registry = {}
+
+
+# Register a function as a task (see pos_app/tasks.py)
+def task(name=None, priority=NORMAL, ttl=0):
+    def register(func):
+        registry[name or func.__name__] = Task(name or func.__name__, func, priority, ttl)
+        return func
+    return register
+
+
+# Key shared by jobs doing the same work: the task, its parameters and the version of the data it reads
+def job_key(name, params, version=None):
+    payload = json.dumps([name, params, version], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# Queue a task, or return the job already doing (or, within its ttl, already done) the same work.
+# version is mixed into the key only, so results computed from older data are not reused. Jobs given the
+# same dedupe_key share one job whatever their parameters (for tasks that must never run two at a time).
+# A private job is only shared with the same user, for results that only its user may open (see views.job_status).
+def enqueue(name, params=None, user=None, priority=None, version=None, dedupe_key=None, private=False):
+    spec = registry.get(name)
+    if spec is None:
+        raise ValueError(f'Unknown task: {name}')
+    # Store parameters in their JSON form, so the task sees exactly what a worker would
+    params = json.loads(json.dumps(params or {}, cls=DjangoJSONEncoder))
+    priority = spec.priority if priority is None else priority
+    if dedupe_key is not None:
+        key = job_key(name, dedupe_key)
+    else:
+        key = job_key(name, params, [version, user.pk if user else None] if private else version)
+    job = (
+        Job.objects.filter(key=key)
+        .filter(Q(status__in=ACTIVE) | Q(status=Job.DONE, expires_at__gt=timezone.now()))
+        .order_by('-id').first()
+    )
+    if job is not None:
+        # A more urgent request for queued work moves it up the queue
+        if job.status == Job.QUEUED and priority > job.priority:
+            Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(priority=priority)
+        return job
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(task=name, params=params, key=key, priority=priority, user=user)
+    except IntegrityError:
+        # Another request queued the same work between the lookup and the insert
+        job = Job.objects.filter(key=key, status__in=ACTIVE).order_by('-id').first()
+        if job is not None:
+            return job
+        return enqueue(name, params, user, priority, version, dedupe_key, private)
+
+    mode = get_config()['MODE']
+    if mode == 'eager':
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, started_at=timezone.now(),
+                                             attempts=F('attempts') + 1)
+        job.refresh_from_db()
+        run(job)
+    elif mode == 'thread':
+        start_thread_worker()
+    return job
+
+
+# The newest finished job of a task with these parameters, however long ago it expired (shown while a
+# fresh one is computed); None if there is none
+def latest_done(name, params=None, version=None):
+    params = json.loads(json.dumps(params or {}, cls=DjangoJSONEncoder))
+    return Job.objects.filter(key=job_key(name, params, version), status=Job.DONE).order_by('-id').first()
+
+
+# Take the next queued job (highest priority, then oldest) and mark it running; None if there is none
+def claim():
+    while True:
+        with transaction.atomic():
+            queued = Job.objects.filter(status=Job.QUEUED).order_by('-priority', 'id')
+            if connection.features.has_select_for_update_skip_locked:
+                # Workers skip each other's rows instead of queueing on the same job
+                queued = queued.select_for_update(skip_locked=True)
+            job = queued.first()
+            if job is None:
+                return None
+            now = timezone.now()
+            # The conditional update makes one worker win where rows cannot be locked (SQLite)
+            claimed = Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+# Run a claimed job and record its result or error
+def run(job):
+    spec = registry.get(job.task)
+    try:
+        if spec is None:
+            raise LookupError(f'Unknown task: {job.task}')
+        # Keep the result in its stored JSON form, however the job was run
+        result = json.loads(json.dumps(spec.func(job, **job.params), cls=DjangoJSONEncoder))
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.pk, job.task)
+        now = timezone.now()
+        job.status, job.error, job.finished_at, job.expires_at = Job.FAILED, traceback.format_exc(), now, now
+        job.save(update_fields=['status', 'error', 'finished_at', 'expires_at'])
+        return job
+    now = timezone.now()
+    job.status, job.result, job.progress = Job.DONE, result, 100
+    job.finished_at, job.expires_at = now, now + timedelta(seconds=spec.ttl)
+    # A task may finish with a line for the status page
+    if isinstance(result, dict) and result.get('message'):
+        job.message = result['message'][:200]
+    job.save(update_fields=['status', 'result', 'progress', 'message', 'finished_at', 'expires_at'])
+    return job
+
+
+# Report progress from inside a task: done of total units (total None keeps the percentage) and a short
+# message. Writes at most once per PROGRESS_INTERVAL, and doubles as the job's heartbeat.
+def progress(job, done=None, total=None, message=''):
+    now = time.monotonic()
+    if now - getattr(job, '_progress_at', 0) < PROGRESS_INTERVAL:
+        return
+    job._progress_at = now
+    if total:
+        # 100 means finished, which only run() decides
+        job.progress = min(99, int(done * 100 / total))
+    job.message = message[:200]
+    Job.objects.filter(pk=job.pk).update(progress=job.progress, message=job.message,
+                                         heartbeat_at=timezone.now())
+
+
+# Path of a result file of a job (created by the task)
+def result_path(job, extension):
+    result_dir = get_config()['RESULT_DIR']
+    os.makedirs(result_dir, exist_ok=True)
+    return os.path.join(result_dir, f'job-{job.pk}.{extension}')
+
+
+# Copy an uploaded file next to the result files, where a job can read it; returns its path
+def save_upload(upload):
+    directory = os.path.join(get_config()['RESULT_DIR'], 'uploads')
+    os.makedirs(directory, exist_ok=True)
+    descriptor, path = tempfile.mkstemp(suffix=os.path.splitext(upload.name)[1], dir=directory)
+    with os.fdopen(descriptor, 'wb') as output:
+        for chunk in upload.chunks():
+            output.write(chunk)
+    return path
+
+
+# Write text or byte chunks to a job's result file, reporting progress every chunk; returns the result
+# dict the download view serves (file name, download name, content type, size)
+def write_result(job, chunks, content_type, filename):
+    path = result_path(job, filename.rsplit('.', 1)[-1])
+    written = 0
+    with open(path, 'wb') as output:
+        for chunk in chunks:
+            output.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            written += len(chunk)
+            progress(job, message=f'{written // 1024} KB written')
+    return {
+        'file': os.path.basename(path),
+        'filename': filename,
+        'content_type': content_type,
+        'size': os.path.getsize(path),
+        'message': f'{filename} is ready',
+    }
+
+
+# Requeue running jobs whose worker stopped sending heartbeats (or fail them after MAX_ATTEMPTS starts);
+# returns the number of jobs requeued and failed
+def requeue_stale():
+    config = get_config()
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING,
+                               heartbeat_at__lt=now - timedelta(seconds=config['HEARTBEAT_TIMEOUT']))
+    failed = stale.filter(attempts__gte=config['MAX_ATTEMPTS']).update(
+        status=Job.FAILED, error='The worker running this job stopped responding.', finished_at=now, expires_at=now,
+    )
+    requeued = stale.filter(attempts__lt=config['MAX_ATTEMPTS']).update(status=Job.QUEUED, heartbeat_at=None)
+    return requeued, failed
+
+
+# Delete jobs that finished more than KEEP_DAYS ago, with their result files; returns how many
+def purge():
+    config = get_config()
+    old = Job.objects.filter(finished_at__lt=timezone.now() - timedelta(days=config['KEEP_DAYS']))
+    for result in old.exclude(result=None).values_list('result', flat=True).iterator():
+        if isinstance(result, dict) and result.get('file'):
+            try:
+                os.remove(os.path.join(config['RESULT_DIR'], result['file']))
+            except FileNotFoundError:
+                pass
+    return old.delete()[0]
+
+
+# Loop that claims and runs jobs until stopped; `manage.py run_jobs` runs a pool of these in threads
+class Worker:
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval if poll_interval is not None else get_config()['POLL_INTERVAL']
+        self.stopping = threading.Event()
+        self._maintained_at = 0
+
+    # Run one queued job, if there is one; returns it
+    def run_once(self):
+        close_old_connections()
+        if time.monotonic() - self._maintained_at > MAINTENANCE_INTERVAL:
+            self._maintained_at = time.monotonic()
+            requeue_stale()
+            purge()
+        job = claim()
+        if job is not None:
+            self._run_with_heartbeat(job)
+        return job
+
+    # Keep the job's heartbeat fresh from a second thread while a task runs without reporting progress
+    def _run_with_heartbeat(self, job):
+        finished = threading.Event()
+
+        def beat():
+            interval = get_config()['HEARTBEAT_TIMEOUT'] / 3
+            try:
+                while not finished.wait(interval):
+                    Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+            finally:
+                connection.close()
+
+        heartbeat = threading.Thread(target=beat, name=f'job-{job.pk}-heartbeat', daemon=True)
+        heartbeat.start()
+        try:
+            run(job)
+        finally:
+            finished.set()
+            heartbeat.join()
+
+    # Run jobs until stop() is called (or, with once, until the queue is empty)
+    def run(self, once=False):
+        try:
+            while not self.stopping.is_set():
+                if self.run_once() is None:
+                    if once:
+                        return
+                    self.stopping.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopping.set()
+
+
+_thread_worker = None
+_thread_lock = threading.Lock()
+
+
+# Start this process's worker thread (MODE 'thread') if it is not running yet
+def start_thread_worker():
+    global _thread_worker
+    with _thread_lock:
+        if _thread_worker is None or not _thread_worker.is_alive():
+            worker = Worker()
+            _thread_worker = threading.Thread(target=worker.run, name='pos-jobs', daemon=True)
+            _thread_worker.start()
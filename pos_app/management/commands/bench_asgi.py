@@ -0,0 +1,43 @@
+# Import Django management command helpers and the benchmark harness
+import json
+
+from django.core.management.base import BaseCommand
+
+from pos_app import benchmark
+
+
+# Management command that compares the async cart endpoint under the ASGI and WSGI handlers
+class Command(BaseCommand):
+    help = ('Drive add_to_cart from many mostly idle till connections, once through the WSGI handler '
+            '(a thread per connection) and once through the ASGI handler (a coroutine per connection), '
+            'and report requests per second, latency and memory per connection')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tills', type=int, default=200, help='Number of concurrent till connections')
+        parser.add_argument('--requests', type=int, default=5, help='Requests per till connection')
+        parser.add_argument('--think-ms', type=int, default=1000, help='Average idle time before each request')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+
+    def handle(self, *args, **options):
+        # Never load-test the live database
+        with benchmark.throwaway_database():
+            report = benchmark.compare_servers(tills=options['tills'], requests_per_till=options['requests'],
+                                               think_ms=options['think_ms'])
+
+        config = report['config']
+        self.stdout.write(f"{config['vendor']} | {config['tills']} tills x {config['requests_per_till']} requests, "
+                          f"{config['think_ms']}ms think time")
+        self.stdout.write(f"{'handler':<9}{'reqs':>7}{'err':>6}{'rps':>9}{'p50ms':>9}{'p95ms':>9}"
+                          f"{'peak MiB':>10}{'KiB/conn':>10}")
+        for handler in ('wsgi', 'asgi'):
+            stats = report[handler]
+            peak = round(stats['peak_rss_kib'] / 1024, 1) if stats['peak_rss_kib'] is not None else '-'
+            per_connection = stats['kib_per_connection'] if stats['kib_per_connection'] is not None else '-'
+            self.stdout.write(
+                f"{handler:<9}{stats['requests']:>7}{stats['errors']:>6}{stats['requests_per_second']:>9}"
+                f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{peak:>10}{per_connection:>10}"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
@@ -0,0 +1,88 @@
+# Import Django management command helpers and the benchmark harness
+import json
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_app import benchmark
+
+
+# Management command that load-tests add_to_cart, sale_confirm and sales_report on a throwaway database
+class Command(BaseCommand):
+    help = ('Seed a throwaway copy of the database and drive the checkout URLs from concurrent cashiers, '
+            'reporting throughput, latency percentiles, query counts and stock anomalies')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=200, help='Number of products to seed')
+        parser.add_argument('--cashiers', type=int, default=8, help='Number of concurrent cashiers')
+        parser.add_argument('--baskets', type=int, default=25, help='Sales per cashier')
+        parser.add_argument('--items', type=int, default=5, help='Cart lines per sale')
+        parser.add_argument('--stock', type=int, default=1000,
+                            help='Starting stock per product (use a low value to provoke stock contention)')
+        parser.add_argument('--report-every', type=int, default=10,
+                            help='Open the sales report after every N sales (0 disables)')
+        parser.add_argument('--mode', choices=['thread', 'process'], default='thread',
+                            help='Run cashiers as threads or forked processes')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed for basket contents')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--baseline', help='Fail if the run regresses against this JSON report')
+        parser.add_argument('--max-latency-ratio', type=float, default=1.25,
+                            help='Allowed p95 latency growth over the baseline (1.25 = 25%%)')
+        parser.add_argument('--max-throughput-drop', type=float, default=0.2,
+                            help='Allowed checkout throughput drop versus the baseline (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        # Failed requests are counted in the report; don't also print each traceback
+        request_logger = logging.getLogger('django.request')
+        previous_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            # Never load-test the live database
+            with benchmark.throwaway_database():
+                report = benchmark.run(
+                    products=options['products'], cashiers=options['cashiers'], baskets=options['baskets'],
+                    items_per_basket=options['items'], stock=options['stock'],
+                    report_every=options['report_every'], mode=options['mode'], rng_seed=options['seed'],
+                )
+        finally:
+            request_logger.setLevel(previous_level)
+        report['config']['debug'] = settings.DEBUG
+
+        self._print_report(report)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                json.dump(report, handle, indent=2)
+            self.stdout.write(f"Report written to {options['output']}")
+
+        # Correctness anomalies always fail; performance only fails against a baseline
+        baseline = benchmark.load_report(options['baseline']) if options['baseline'] else {}
+        problems = benchmark.regressions(report, baseline, options['max_latency_ratio'],
+                                         options['max_throughput_drop'])
+        if problems:
+            raise CommandError('Benchmark regression: ' + '; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('No anomalies or regressions detected.'))
+
+    # Human-readable table of the results
+    def _print_report(self, report):
+        config = report['config']
+        self.stdout.write(
+            f"{config['vendor']} | {config['cashiers']} cashiers ({config['mode']} mode) x {config['baskets']} sales "
+            f"x {config['items_per_basket']} items | {report['wall_seconds']}s wall"
+        )
+        self.stdout.write(
+            f"Checkouts: {report['confirmed_sales']} confirmed, {report['rejected_sales']} rejected, "
+            f"{report['checkouts_per_second']}/s"
+        )
+        self.stdout.write(f"{'endpoint':<14}{'reqs':>7}{'err':>6}{'rps':>9}{'p50ms':>9}{'p95ms':>9}"
+                          f"{'p99ms':>9}{'q/req':>8}{'maxq':>6}")
+        for name, stats in sorted(report['endpoints'].items()):
+            self.stdout.write(
+                f"{name:<14}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput_rps']:>9}"
+                f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}"
+                f"{stats['mean_queries']:>8}{stats['max_queries']:>6}"
+            )
+        for kind, rows in report['anomalies'].items():
+            self.stdout.write(f"{kind}: {len(rows)}")
+        for error in report['error_samples']:
+            self.stdout.write(self.style.WARNING(f"error: {error}"))
@@ -0,0 +1,27 @@
+# Import Django management command base class and the stock ledger module
+from django.core.management.base import BaseCommand
+
+from pos_app import jobs, pagecache, stock
+
+
+# Management command that folds the stock ledger into new Inventory snapshots (run periodically, e.g. from cron)
+class Command(BaseCommand):
+    help = ('Fold recent stock movements into the Inventory snapshots, so current stock and stock-at-time '
+            'queries only read a short tail of the ledger')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=stock.COMPACT_BATCH_SIZE,
+                            help='Products folded per transaction')
+        parser.add_argument('--database', default='default', help='Database alias to compact')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue the compaction as a background job (see run_jobs) instead of running it now')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = jobs.enqueue('compact_stock', {'batch_size': options['batch_size']})
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.pk} ({job.status}).'))
+            return
+        compacted = stock.compact(batch_size=options['batch_size'], using=options['database'])
+        # The product list counts stock from the compacted levels
+        pagecache.bump('stock')
+        self.stdout.write(self.style.SUCCESS(f'Compacted the stock ledger of {compacted} products.'))
@@ -0,0 +1,53 @@
+# Import Django management command helpers and the instrumentation statistics
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from pos_app import instrumentation
+
+
+# Management command that prints the per-view request statistics written by the running server processes
+class Command(BaseCommand):
+    help = 'Dump the rolling per-view latency/query histograms recorded by QueryInstrumentationMiddleware'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+        parser.add_argument('--sort', choices=['p95', 'queries', 'requests'], default='p95',
+                            help='Column to sort views by')
+        parser.add_argument('--reset', action='store_true', help='Delete the statistics files after dumping')
+
+    def handle(self, *args, **options):
+        dump_dir = instrumentation.get_config()['DUMP_DIR']
+        merged, files = instrumentation.load_dumps(dump_dir)
+        if not files:
+            self.stdout.write(f'No instrumentation data found in {dump_dir}.')
+            return
+
+        rows = {}
+        for name, view in merged.items():
+            summary = instrumentation.summarize(view['samples'])
+            summary['requests'] = view['requests']
+            summary['duplicates'] = dict(view['duplicates'].most_common(3))
+            rows[name] = summary
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+        else:
+            key = {'p95': 'p95_ms', 'queries': 'mean_queries', 'requests': 'requests'}[options['sort']]
+            bounds = ' '.join(f'<={b}' for b in instrumentation.HISTOGRAM_BOUNDS_MS) + ' >'
+            self.stdout.write(f'{len(files)} process file(s); latency histogram buckets (ms): {bounds}')
+            self.stdout.write(f"{'view':<40}{'reqs':>7}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'q/req':>8}{'maxq':>6}")
+            for name, row in sorted(rows.items(), key=lambda item: item[1][key], reverse=True):
+                self.stdout.write(
+                    f"{name:<40}{row['requests']:>7}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}"
+                    f"{row['mean_queries']:>8}{row['max_queries']:>6}"
+                )
+                self.stdout.write(f"{'':<40}histogram {row['histogram']}")
+                for shape, count in row['duplicates'].items():
+                    self.stdout.write(self.style.WARNING(f"{'':<40}{count} x {shape[:100]}"))
+
+        if options['reset']:
+            for path in files:
+                os.remove(path)
+            self.stdout.write('Statistics files removed.')
@@ -0,0 +1,114 @@
+# Import Django management command helpers and the modules whose queries are checked
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from pos_app import analytics, reports, stock
+from pos_app.models import DailySalesRollup, Job, Product, Sale, SaleItem, StockForecast
+from pos_app.pagination import KEYSET_PAGE_SIZE, seek
+from pos_app.views import PRODUCT_ORDERING, REORDER_ORDERING, SALE_ORDERING
+
+# Plan lines that mean a whole table is read or rows are sorted outside an index, per database vendor
+SCAN_PATTERNS = {
+    # "SCAN pos_app_sale" (but not "SCAN pos_app_sale USING INDEX ..."), "USE TEMP B-TREE FOR ORDER BY"
+    'sqlite': [
+        (re.compile(r'\bSCAN (\w+)(?! USING (?:COVERING )?INDEX)(?:\s|$)'), 'full scan of {0}'),
+        (re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)'), 'sort for {0}'),
+    ],
+    'postgresql': [
+        (re.compile(r'Seq Scan on (\w+)'), 'full scan of {0}'),
+        (re.compile(r'(?<!Incremental )\bSort\s+\('), 'sort'),
+    ],
+    'mysql': [
+        (re.compile(r'Table scan on (\w+)'), 'full scan of {0}'),
+        (re.compile(r'\bSort\b'), 'sort'),
+    ],
+}
+
+
+# The app's hot-path queries, built with the same helpers the views use: (name, queryset)
+def canonical_queries():
+    today = timezone.localdate()
+    week = {'start_date': today - timedelta(days=7), 'end_date': today, 'payment_method': '', 'user': ''}
+    now = timezone.now()
+    page = KEYSET_PAGE_SIZE + 1
+    sales = Sale.objects.select_related('user')
+    products = Product.objects.select_related('category')
+    return [
+        ('sales report, first page', seek(reports.filter_sales(sales, week), SALE_ORDERING)[:page]),
+        ('sales report, later page', seek(reports.filter_sales(sales, week), SALE_ORDERING, [now, 1])[:page]),
+        ('sales report by payment method',
+         seek(reports.filter_sales(sales, {**week, 'payment_method': 'cash'}), SALE_ORDERING)[:page]),
+        ('sales report by cashier', seek(Sale.objects.filter(user_id=1), SALE_ORDERING)[:page]),
+        ('latest sale time', reports.filter_sales(Sale.objects.all(), week)
+         .order_by('-created_at').values_list('created_at', flat=True)[:1]),
+        ('daily rollup for a date range', reports.filter_daily_rollup(DailySalesRollup.objects.all(), week)),
+        ('offline sales by idempotency key', Sale.objects.filter(client_key__in=['till1-1', 'till1-2'])),
+        ('product list page', seek(products, PRODUCT_ORDERING, ['m', 1])[:page]),
+        ('products in a category', seek(products.filter(category_id=1), PRODUCT_ORDERING)[:page]),
+        ('product admin changelist', Product.objects.order_by('-updated_at')[:100]),
+        ('barcode lookup', Product.objects.filter(barcode__in=['4800000000001'])),
+        ('sales of a product', SaleItem.objects.filter(product_id=1).values_list('sale_id', flat=True)),
+        ('line items of a sale', SaleItem.objects.filter(sale_id=1).select_related('product')),
+        ('sale lines after the analytics watermark',
+         SaleItem.objects.filter(sale_id__gt=1, sale_id__lte=100).order_by('sale_id', 'pk')
+         .values_list(*analytics.LINE_FIELDS)),
+        ('current stock from the ledger',
+         Product.objects.filter(pk__in=[1, 2]).annotate(current_stock=stock.current_stock_expression())),
+        ('reorder report page',
+         seek(StockForecast.objects.filter(status__in=[StockForecast.OUT, StockForecast.REORDER]),
+              REORDER_ORDERING)[:page]),
+        ('next queued job', Job.objects.filter(status=Job.QUEUED).order_by('-priority', 'id')[:1]),
+        ('job with the same key', Job.objects.filter(key='0' * 64).order_by('-id')[:1]),
+    ]
+
+
+# Problems found in one plan
+def plan_problems(vendor, plan):
+    problems = []
+    for pattern, message in SCAN_PATTERNS.get(vendor, []):
+        for match in pattern.finditer(plan):
+            problems.append(message.format(*match.groups()))
+    return problems
+
+
+# Management command that EXPLAINs the app's canonical queries and flags full scans and sorts
+class Command(BaseCommand):
+    help = ('Run EXPLAIN on the checkout, listing and reporting queries and flag full table scans and '
+            'unindexed sorts, so the indexes stay justified as the schema changes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to explain against')
+        parser.add_argument('--strict', action='store_true', help='Exit with an error if any query is flagged')
+
+    def handle(self, *args, **options):
+        alias = options['database']
+        connection = connections[alias]
+        flagged = []
+        with transaction.atomic(using=alias):
+            if connection.vendor == 'postgresql':
+                # Small or empty tables make seq scans the cheapest plan; ask whether an index *can* be used
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in canonical_queries():
+                plan = queryset.using(alias).explain()
+                problems = plan_problems(connection.vendor, plan)
+                status = self.style.WARNING('; '.join(problems)) if problems else self.style.SUCCESS('ok')
+                self.stdout.write(f'{name:<34}{status}')
+                if problems or options['verbosity'] > 1:
+                    for line in plan.splitlines():
+                        self.stdout.write(f'    {line}')
+                if problems:
+                    flagged.append(name)
+            # EXPLAIN never writes, but roll back the session settings anyway
+            transaction.set_rollback(True, using=alias)
+
+        if connection.vendor not in SCAN_PATTERNS:
+            self.stdout.write(self.style.WARNING(f'Plans are not checked on {connection.vendor}.'))
+        if flagged and options['strict']:
+            raise CommandError(f"{len(flagged)} queries need an index: {', '.join(flagged)}")
+        if not flagged:
+            self.stdout.write(self.style.SUCCESS('All canonical queries use indexes.'))
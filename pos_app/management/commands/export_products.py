@@ -0,0 +1,31 @@
+# Import Django management command base class and the export module
+from django.core.management.base import BaseCommand
+
+from pos_app import exports
+from pos_app.models import Product
+
+
+# Management command that writes the product catalog as CSV or JSON Lines (readable by import_products)
+class Command(BaseCommand):
+    help = 'Export the product catalog, with exact stock levels, as CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="File to write ('-' for standard output)")
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='File format (default: from the file extension)')
+        parser.add_argument('--category', help='Only export products of this category')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        export_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        products = Product.objects.all()
+        if options['category']:
+            products = products.filter(category__name=options['category'])
+        chunks = exports.product_csv_chunks(products) if export_format == 'csv' else exports.product_jsonl_chunks(products)
+        if path == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Products written to {path}.'))
@@ -0,0 +1,26 @@
+# Import Django management command helpers and the forecasting engine
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_app import forecasting, jobs
+from pos_app.models import StockForecast
+
+
+# Management command that recomputes demand forecasts and reorder points for the whole catalog (run daily, e.g. from cron)
+class Command(BaseCommand):
+    help = ('Forecast daily demand of every product from its sales history and store its days of cover, '
+            'safety stock and reorder point for the admin stock views and the reorder report')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue the forecast as a background job (see run_jobs) instead of running it now')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = jobs.enqueue('forecast_demand')
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.pk} ({job.status}).'))
+            return
+        if not forecasting.available():
+            raise CommandError('Demand forecasting requires NumPy (pip install numpy).')
+        count = forecasting.run()
+        to_reorder = StockForecast.objects.filter(status__in=[StockForecast.OUT, StockForecast.REORDER]).count()
+        self.stdout.write(self.style.SUCCESS(f'Forecast {count} products; {to_reorder} need reordering.'))
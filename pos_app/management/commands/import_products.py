@@ -0,0 +1,50 @@
+# Import standard library modules for timing and reading standard input
+import sys
+import time
+
+# Import Django management command helpers and the product import module
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_app import imports
+
+
+# Management command that creates and updates products from a CSV or JSON Lines file
+class Command(BaseCommand):
+    help = ('Import products from a CSV or JSON Lines file (columns: ' + ', '.join(imports.PRODUCT_COLUMNS)
+            + '). Rows are matched on barcode and upserted in batches; blank cells leave a value unchanged.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import ('-' reads standard input)")
+        parser.add_argument('--format', choices=imports.IMPORT_FORMATS,
+                            help='File format (default: from the file extension, else csv)')
+        parser.add_argument('--chunk-size', type=int, default=imports.IMPORT_CHUNK_SIZE,
+                            help='Rows validated and written per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without writing anything')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = imports.guess_format(path, options['format'])
+        started = time.perf_counter()
+
+        def progress(report):
+            rate = report.rows / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f'{report.rows} rows: {report.created} new, {report.updated} updated, '
+                              f'{report.error_count} errors ({rate:.0f} rows/s)')
+
+        try:
+            stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as exc:
+            raise CommandError(f'Cannot read {path}: {exc}') from exc
+        with stream:
+            report = imports.import_products(stream, file_format, chunk_size=options['chunk_size'],
+                                             dry_run=options['dry_run'], progress=progress)
+
+        for line, message in report.errors:
+            self.stderr.write(f'line {line}: {message}')
+        if report.error_count > len(report.errors):
+            self.stderr.write(f'... and {report.error_count - len(report.errors)} more errors')
+        summary = (f'{report.created} products created, {report.updated} updated, {report.stock_adjusted} stock '
+                   f'levels adjusted, {report.error_count} rows rejected in {time.perf_counter() - started:.1f}s')
+        if options['dry_run']:
+            summary = 'Dry run: ' + summary.replace('created', 'would be created').replace(' updated', ' would be updated')
+        self.stdout.write(self.style.SUCCESS(summary) if not report.error_count else self.style.WARNING(summary))
@@ -0,0 +1,25 @@
+# Import Django management command base class and the rollup maintenance module
+from django.core.management.base import BaseCommand
+
+from pos_app import jobs, rollups
+from pos_app.models import CategoryDailyRollup, DailySalesRollup, HourlySalesRollup, ProductDailyRollup
+
+
+# Management command that recomputes every sales rollup table from scratch
+class Command(BaseCommand):
+    help = 'Rebuild the daily/hourly/product/category sales rollup tables from the sales history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue the rebuild as a background job (see run_jobs) instead of running it now')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = jobs.enqueue('rebuild_rollups')
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.pk} ({job.status}).'))
+            return
+        rollups.rebuild()
+        # Report how many rows each table now holds
+        for model in (DailySalesRollup, HourlySalesRollup, ProductDailyRollup, CategoryDailyRollup):
+            self.stdout.write(f"{model.__name__}: {model.objects.count()} rows")
+        self.stdout.write(self.style.SUCCESS('Sales rollups rebuilt.'))
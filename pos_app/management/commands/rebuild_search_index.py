@@ -0,0 +1,20 @@
+# Import Django management command base class and the product search module
+from django.core.management.base import BaseCommand
+
+from pos_app import search
+
+
+# Management command that re-indexes every product for search
+class Command(BaseCommand):
+    help = 'Rebuild the product search index (run after bulk imports that bypass model signals)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to re-index')
+
+    def handle(self, *args, **options):
+        kind = search.backend(options['database'])
+        if kind is None:
+            self.stdout.write(self.style.WARNING('This database has no search index; search uses LIKE queries.'))
+            return
+        search.rebuild(options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Product search index rebuilt ({kind}).'))
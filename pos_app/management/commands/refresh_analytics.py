@@ -0,0 +1,30 @@
+# Import Django management command helpers and the analytics store
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_app import analytics, jobs
+
+
+# Management command that appends new sale lines to the columnar analytics store (run periodically, e.g. from cron)
+class Command(BaseCommand):
+    help = ('Append the lines of sales made since the last run to the memory-mapped analytics store behind the '
+            'profit section of the sales report')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Export every sale line again (after sales were deleted or edited)')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue the refresh as a background job (see run_jobs) instead of running it now')
+
+    def handle(self, *args, **options):
+        if options['enqueue']:
+            job = jobs.enqueue('refresh_analytics', {'rebuild': options['rebuild']}, dedupe_key=analytics.JOB_KEY)
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.pk} ({job.status}).'))
+            return
+        if not analytics.available():
+            raise CommandError('The analytics store requires NumPy (pip install numpy).')
+        update = analytics.rebuild if options['rebuild'] else analytics.refresh
+        appended = update()
+        store = analytics.Store()
+        self.stdout.write(self.style.SUCCESS(
+            f'Appended {appended} sale lines; the store holds {store.rows} lines up to sale #{store.watermark}.'
+        ))
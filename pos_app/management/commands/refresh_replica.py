@@ -0,0 +1,25 @@
+# Import Django management command helpers and the replica module
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_app import jobs, replicas
+
+
+# Management command that refreshes the SQLite copy standing in for a read replica (run periodically, e.g. from cron)
+class Command(BaseCommand):
+    help = ('Copy the primary SQLite database over the reporting replica with the SQLite backup API, so reports, '
+            'exports and admin lists read a recent snapshot instead of competing with checkouts')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Queue the refresh as a background job (see run_jobs) instead of running it now')
+
+    def handle(self, *args, **options):
+        if not replicas.is_sqlite_copy():
+            raise CommandError('The reporting database is not a SQLite copy of the primary; '
+                               'a real replica is kept current by the database server.')
+        if options['enqueue']:
+            job = jobs.enqueue('refresh_replica')
+            self.stdout.write(self.style.SUCCESS(f'Queued job #{job.pk} ({job.status}).'))
+            return
+        seconds = replicas.refresh_copy()
+        self.stdout.write(self.style.SUCCESS(f'Reporting replica refreshed in {seconds:.1f}s.'))
@@ -0,0 +1,45 @@
+# Import standard library modules for the worker threads and shutdown signals
+import signal
+import threading
+
+# Import Django management command base class and the job queue
+from django.core.management.base import BaseCommand
+
+from pos_app import jobs
+
+
+# Management command that runs queued background jobs (reports, exports, imports, rollup maintenance)
+# with a pool of worker threads. Run one or more of these next to the web server.
+class Command(BaseCommand):
+    help = ('Run background jobs from the job queue with a pool of worker threads, highest priority first, '
+            'until interrupted (or, with --once, until the queue is empty)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help='Jobs run at the same time')
+        parser.add_argument('--once', action='store_true', help='Exit when no queued jobs are left')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Seconds an idle worker waits before checking the queue again')
+
+    def handle(self, *args, **options):
+        workers = [jobs.Worker(poll_interval=options['poll_interval']) for _ in range(options['workers'])]
+        threads = [
+            threading.Thread(target=worker.run, kwargs={'once': options['once']}, name=f'pos-jobs-{n}')
+            for n, worker in enumerate(workers, start=1)
+        ]
+
+        # Let running jobs finish on SIGTERM/SIGINT instead of abandoning them mid-way
+        def stop(signum, frame):
+            self.stdout.write('Stopping after the running jobs finish...')
+            for worker in workers:
+                worker.stop()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f'Running jobs with {len(workers)} workers.')
+        for thread in threads:
+            thread.start()
+        # join() with a timeout keeps the main thread responsive to signals
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+        self.stdout.write(self.style.SUCCESS('Job workers stopped.'))
@@ -0,0 +1,71 @@
+# Search index tables for pos_app.search: FTS5 on SQLite, tsvector + trigram on PostgreSQL
+
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE pos_app_product_search USING fts5("
+    "name, barcode, category, description, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')",
+    "CREATE VIRTUAL TABLE pos_app_product_search_vocab USING fts5vocab(pos_app_product_search, 'row')",
+    "INSERT INTO pos_app_product_search (rowid, name, barcode, category, description) "
+    "SELECT p.id, p.name, p.barcode, c.name, p.description FROM pos_app_product p "
+    "JOIN pos_app_category c ON c.id = p.category_id",
+]
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS pos_app_product_search_vocab",
+    "DROP TABLE IF EXISTS pos_app_product_search",
+]
+
+POSTGRESQL_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE TABLE pos_app_product_search ("
+    "product_id bigint PRIMARY KEY, document text NOT NULL, tsv tsvector NOT NULL)",
+    "CREATE INDEX pos_app_product_search_tsv ON pos_app_product_search USING gin (tsv)",
+    "CREATE INDEX pos_app_product_search_trgm ON pos_app_product_search USING gin (document gin_trgm_ops)",
+    "INSERT INTO pos_app_product_search (product_id, document, tsv) "
+    "SELECT p.id, concat_ws(' ', p.name, p.barcode, c.name), "
+    "setweight(to_tsvector('simple', p.name), 'A') || setweight(to_tsvector('simple', p.barcode), 'A') || "
+    "setweight(to_tsvector('simple', c.name), 'B') || setweight(to_tsvector('simple', p.description), 'C') "
+    "FROM pos_app_product p JOIN pos_app_category c ON c.id = p.category_id",
+]
+POSTGRESQL_BACKWARD = [
+    "DROP TABLE IF EXISTS pos_app_product_search",
+]
+
+
+def _run(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def create_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            # Without FTS5 the search module falls back to unindexed LIKE queries
+            if not cursor.fetchone()[0]:
+                return
+        _run(schema_editor, SQLITE_FORWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_FORWARD)
+
+
+def drop_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_BACKWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRESQL_BACKWARD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0003_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
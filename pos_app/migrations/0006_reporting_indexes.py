@@ -0,0 +1,52 @@
+# Generated by Django 5.2.7 on 2026-10-17 06:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0005_listing_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Create the composite indexes before dropping the single-column FK indexes they replace
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'name', 'id'], name='product_category_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['updated_at'], name='product_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['payment_method', 'created_at', 'id'], name='sale_method_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='sale_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleitem',
+            index=models.Index(fields=['product', 'sale'], name='saleitem_product_sale_idx'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='pos_app.category'),
+        ),
+        migrations.AlterField(
+            model_name='sale',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='saleitem',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='pos_app.product'),
+        ),
+    ]
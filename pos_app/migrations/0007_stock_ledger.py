@@ -0,0 +1,85 @@
+# Generated by Django 5.2.7 on 2026-10-17 06:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 2000
+
+
+# Product.stock_quantity is what sales have been decrementing, so it is the opening balance of the ledger:
+# give every product an Inventory snapshot (replacing the old, never-synced Inventory.quantity) and a
+# first StockSnapshot
+def open_ledger(apps, schema_editor):
+    Product = apps.get_model('pos_app', 'Product')
+    Inventory = apps.get_model('pos_app', 'Inventory')
+    StockSnapshot = apps.get_model('pos_app', 'StockSnapshot')
+    alias = schema_editor.connection.alias
+    now = timezone.now()
+    last_id = 0
+    while True:
+        batch = list(Product.objects.using(alias).filter(pk__gt=last_id).order_by('pk')
+                     .values_list('pk', 'stock_quantity')[:BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        stock = dict(batch)
+        existing = list(Inventory.objects.using(alias).filter(product_id__in=stock))
+        for inventory in existing:
+            inventory.quantity = stock[inventory.product_id]
+            inventory.movement_id = 0
+        Inventory.objects.using(alias).bulk_update(existing, ['quantity', 'movement_id'])
+        have = {inventory.product_id for inventory in existing}
+        Inventory.objects.using(alias).bulk_create([
+            Inventory(product_id=pk, quantity=quantity) for pk, quantity in batch if pk not in have
+        ])
+        StockSnapshot.objects.using(alias).bulk_create([
+            StockSnapshot(product_id=pk, quantity=quantity, movement_id=0, taken_at=now) for pk, quantity in batch
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0006_reporting_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='movement_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sale', 'Sale'), ('restock', 'Restock'), ('adjustment', 'Adjustment'), ('return', 'Return')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='pos_app.product')),
+                ('sale', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='pos_app.sale')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='stockmovement_product_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('movement_id', models.BigIntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='pos_app.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'taken_at'], name='stocksnapshot_product_idx')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
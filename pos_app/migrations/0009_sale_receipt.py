@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:14
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0008_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='receipt',
+            field=models.JSONField(blank=True, editable=False, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+    ]
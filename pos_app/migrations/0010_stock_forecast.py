@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0009_sale_receipt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockForecast',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='pos_app.product')),
+                ('velocity', models.FloatField(default=0)),
+                ('moving_average', models.FloatField(default=0)),
+                ('forecast', models.FloatField(default=0)),
+                ('safety_stock', models.PositiveIntegerField(default=0)),
+                ('reorder_point', models.PositiveIntegerField(default=0)),
+                ('reorder_quantity', models.PositiveIntegerField(default=0)),
+                ('stock', models.IntegerField(default=0)),
+                ('days_of_cover', models.FloatField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('out', 'Out of stock'), ('reorder', 'Reorder'), ('ok', 'OK'), ('overstock', 'Overstock'), ('idle', 'No recent sales')], default='idle', max_length=10)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'days_of_cover', 'product'], name='forecast_status_cover_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0010_stock_forecast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='client_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='sale',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Rank the SQLite FTS5 product index with weighted bm25 by default, so queries can ORDER BY rank
+
+from django.db import migrations
+
+# bm25 column weights: name, barcode, category, description (keep in step with pos_app.search.SQLITE_RANK)
+SQLITE_RANK = 'bm25(10.0, 8.0, 3.0, 1.0)'
+
+
+def _has_index(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pos_app_product_search'")
+    return cursor.fetchone() is not None
+
+
+def set_rank(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        # No index table when SQLite lacks FTS5 (see 0004_product_search)
+        if _has_index(cursor):
+            cursor.execute(
+                "INSERT INTO pos_app_product_search (pos_app_product_search, rank) VALUES ('rank', %s)",
+                [SQLITE_RANK],
+            )
+
+
+def reset_rank(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if _has_index(cursor):
+            cursor.execute(
+                "INSERT INTO pos_app_product_search (pos_app_product_search, rank) VALUES ('rank', 'bm25()')"
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_app', '0011_sale_client_key'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_rank, reset_rank),
+    ]
@@ -1,6 +1,8 @@
 # Import necessary Django modules for database models and user authentication
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 # Model representing product categories in the POS system
 class Category(models.Model):
@@ -18,12 +20,14 @@ class Product(models.Model):
     # Name of the product
     name = models.CharField(max_length=200)
     # Foreign key linking to Category - when category is deleted, products are deleted too
-    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    # (indexed by product_category_name_idx, which starts with category)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, db_index=False)
     # Selling price of the product
     price = models.DecimalField(max_digits=10, decimal_places=2)
     # Cost price for profit calculation (default 0)
     cost_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    # Current stock quantity
+    # Stock quantity as of the last ledger compaction (opening stock for new products).
+    # The exact level is the Inventory snapshot plus later StockMovements (see pos_app/stock.py)
     stock_quantity = models.PositiveIntegerField(default=0)
     # Optional unique barcode for product identification
     barcode = models.CharField(max_length=100, unique=True, blank=True)
@@ -34,14 +38,24 @@ class Product(models.Model):
     # Timestamp when product was last updated (auto-set)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the product listings (name, pk)
+            models.Index(fields=['name', 'id'], name='product_name_idx'),
+            # Category-filtered listings in name order, and category joins
+            models.Index(fields=['category', 'name', 'id'], name='product_category_name_idx'),
+            # ProductAdmin ordering and its updated_at filter
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+        ]
+
     # String representation of the product object
     def __str__(self):
         return self.name
 
 # Model representing sales transactions
 class Sale(models.Model):
-    # User who processed the sale
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # User who processed the sale (indexed by sale_user_created_idx, which starts with user)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     # Total amount of the sale
     total_amount = models.DecimalField(max_digits=10, decimal_places=2)
     # Payment method choices for the sale
@@ -50,8 +64,24 @@ class Sale(models.Model):
         ('card', 'Card'),
         ('other', 'Other')
     ], default='cash')
-    # Timestamp when sale was created (auto-set)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Timestamp of the sale: now for checkouts, the till's time of sale for sales ingested after an outage
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Receipt as printed at checkout: line names, barcodes, categories and prices as of sale time
+    # (see pos_app/receipts.py); never changed afterwards. None for sales made before snapshots.
+    receipt = models.JSONField(null=True, blank=True, editable=False, encoder=DjangoJSONEncoder)
+    # Idempotency key generated by an offline till for the sale (see checkout.ingest), so a retried batch
+    # cannot record it twice; None for sales checked out online
+    client_key = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the sales report, newest first (created_at, pk), and date filters
+            models.Index(fields=['created_at', 'id'], name='sale_created_idx'),
+            # Report and admin filtered by payment method, in date order
+            models.Index(fields=['payment_method', 'created_at', 'id'], name='sale_method_created_idx'),
+            # Report filtered by cashier, in date order
+            models.Index(fields=['user', 'created_at', 'id'], name='sale_user_created_idx'),
+        ]
 
     # String representation of the sale object
     def __str__(self):
@@ -61,8 +91,8 @@ class Sale(models.Model):
 class SaleItem(models.Model):
     # Foreign key to the Sale this item belongs to
     sale = models.ForeignKey(Sale, on_delete=models.CASCADE, related_name='items')
-    # Foreign key to the Product being sold
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Foreign key to the Product being sold (indexed by saleitem_product_sale_idx, which starts with product)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
     # Quantity of this product in the sale
     quantity = models.PositiveIntegerField()
     # Price per unit at the time of sale
@@ -70,19 +100,283 @@ class SaleItem(models.Model):
     # Total price for this item (quantity * unit_price)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            # Sales of a product (stock reconciliation, product deletion) without touching the sale table
+            models.Index(fields=['product', 'sale'], name='saleitem_product_sale_idx'),
+        ]
+
     # String representation of the sale item
     def __str__(self):
         return f"{self.product.name} x{self.quantity}"
 
-# Model for tracking inventory levels (one-to-one with Product)
+# Model for tracking inventory levels (one-to-one with Product): the latest compacted snapshot of the
+# stock ledger. Current stock is quantity plus the product's StockMovements with an id above movement_id
 class Inventory(models.Model):
     # One-to-one relationship with Product - each product has one inventory record
     product = models.OneToOneField(Product, on_delete=models.CASCADE)
-    # Current inventory quantity
+    # Stock quantity after the movements up to movement_id
     quantity = models.PositiveIntegerField(default=0)
+    # Id of the last StockMovement folded into quantity (0 = none yet)
+    movement_id = models.BigIntegerField(default=0)
     # Timestamp of last inventory update (auto-set)
     last_updated = models.DateTimeField(auto_now=True)
 
     # String representation of the inventory record
     def __str__(self):
         return f"{self.product.name} - {self.quantity}"
+
+# Append-only stock ledger: every change to a product's stock is one row, never updated or deleted
+class StockMovement(models.Model):
+    # Kinds of stock movement
+    SALE = 'sale'
+    RESTOCK = 'restock'
+    ADJUSTMENT = 'adjustment'
+    RETURN = 'return'
+    KIND_CHOICES = [
+        (SALE, 'Sale'),
+        (RESTOCK, 'Restock'),
+        (ADJUSTMENT, 'Adjustment'),
+        (RETURN, 'Return'),
+    ]
+
+    # Product whose stock changed (indexed by stockmovement_product_idx, which starts with product)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    # What caused the change
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Signed change in units (negative for sales)
+    quantity = models.IntegerField()
+    # Sale that caused the movement, for sale movements
+    sale = models.ForeignKey(Sale, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    # User who recorded the movement
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Optional reason (supplier delivery, stock take, damaged goods...)
+    note = models.CharField(max_length=200, blank=True)
+    # Timestamp of the movement (auto-set)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A product's movements after its snapshot (current stock) or up to a time (stock at time T)
+            models.Index(fields=['product', 'id'], name='stockmovement_product_idx'),
+        ]
+
+    # String representation of the movement
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.quantity:+d} {self.product_id}"
+
+# History of compacted stock levels, so stock at a past time is a snapshot plus a bounded tail of movements
+class StockSnapshot(models.Model):
+    # Product the snapshot belongs to
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+    # Stock quantity after the movements up to movement_id
+    quantity = models.PositiveIntegerField()
+    # Id of the last StockMovement folded into quantity
+    movement_id = models.BigIntegerField()
+    # When the snapshot was taken
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Latest snapshot of a product before a time
+            models.Index(fields=['product', 'taken_at'], name='stocksnapshot_product_idx'),
+        ]
+
+    # String representation of the snapshot
+    def __str__(self):
+        return f"{self.product_id} @ {self.taken_at}: {self.quantity}"
+
+# Demand forecast and reorder point of a product, recomputed for the whole catalog by
+# `manage.py forecast_demand` (see pos_app/forecasting.py) so listings only read these numbers
+class StockForecast(models.Model):
+    # Statuses, from most to least urgent
+    OUT = 'out'
+    REORDER = 'reorder'
+    OK = 'ok'
+    OVERSTOCK = 'overstock'
+    IDLE = 'idle'
+    STATUS_CHOICES = [
+        (OUT, 'Out of stock'),
+        (REORDER, 'Reorder'),
+        (OK, 'OK'),
+        (OVERSTOCK, 'Overstock'),
+        (IDLE, 'No recent sales'),
+    ]
+
+    # Product forecast (one row per product)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='forecast')
+    # Average units sold per day over the history window
+    velocity = models.FloatField(default=0)
+    # Average units sold per day over the last week
+    moving_average = models.FloatField(default=0)
+    # Expected units per day (exponentially smoothed daily sales)
+    forecast = models.FloatField(default=0)
+    # Stock kept for demand above the forecast during the lead time
+    safety_stock = models.PositiveIntegerField(default=0)
+    # Reorder when stock falls to this level
+    reorder_point = models.PositiveIntegerField(default=0)
+    # Units to order now to cover the lead time and the review period
+    reorder_quantity = models.PositiveIntegerField(default=0)
+    # Stock when the forecast was computed
+    stock = models.IntegerField(default=0)
+    # Days the stock lasts at the forecast demand (None without demand)
+    days_of_cover = models.FloatField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=IDLE)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Reorder report: products of a status, most urgent (least cover) first
+            models.Index(fields=['status', 'days_of_cover', 'product'], name='forecast_status_cover_idx'),
+        ]
+
+    # String representation of the forecast
+    def __str__(self):
+        return f"{self.product_id}: {self.get_status_display()}"
+
+# Pre-aggregated sales per day, cashier and payment method (serves the by-day, by-cashier
+# and by-payment-method report figures without scanning the sales table)
+class DailySalesRollup(models.Model):
+    # Local calendar date of the sales
+    day = models.DateField()
+    # Cashier who processed the sales
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Payment method of the sales
+    payment_method = models.CharField(max_length=50)
+    # Number of sales in this bucket
+    sale_count = models.PositiveIntegerField(default=0)
+    # Sum of Sale.total_amount in this bucket
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'user', 'payment_method'], name='unique_daily_sales_rollup'),
+        ]
+
+    # String representation of the rollup row
+    def __str__(self):
+        return f"{self.day} {self.user_id} {self.payment_method}: {self.sale_count}"
+
+# Pre-aggregated sales per hour
+class HourlySalesRollup(models.Model):
+    # Start of the hour (local time, stored as an aware datetime)
+    hour = models.DateTimeField(unique=True)
+    # Number of sales in this hour
+    sale_count = models.PositiveIntegerField(default=0)
+    # Sum of Sale.total_amount in this hour
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    # String representation of the rollup row
+    def __str__(self):
+        return f"{self.hour}: {self.sale_count}"
+
+# Pre-aggregated units and revenue per product per day
+class ProductDailyRollup(models.Model):
+    # Local calendar date of the sales
+    day = models.DateField()
+    # Product that was sold
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    # Units sold
+    quantity = models.PositiveIntegerField(default=0)
+    # Sum of SaleItem.total_price
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_product_daily_rollup'),
+        ]
+
+    # String representation of the rollup row
+    def __str__(self):
+        return f"{self.day} {self.product_id}: {self.quantity}"
+
+# Pre-aggregated units and revenue per category per day
+class CategoryDailyRollup(models.Model):
+    # Local calendar date of the sales
+    day = models.DateField()
+    # Category of the products that were sold
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    # Units sold
+    quantity = models.PositiveIntegerField(default=0)
+    # Sum of SaleItem.total_price
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='unique_category_daily_rollup'),
+        ]
+
+    # String representation of the rollup row
+    def __str__(self):
+        return f"{self.day} {self.category_id}: {self.quantity}"
+
+# Single-row counter bumped whenever products or categories change, so every worker
+# process can tell that its in-memory catalog cache is stale
+class CatalogVersion(models.Model):
+    # Incremented on every Product/Category save or delete
+    version = models.BigIntegerField(default=0)
+
+    # String representation of the version counter
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+# Background job run by the run_jobs worker pool (see pos_app/jobs.py); finished jobs double as a
+# cache of their result for identical requests until expires_at
+class Job(models.Model):
+    # Job states
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Name of the registered task
+    task = models.CharField(max_length=100)
+    # Keyword arguments of the task
+    params = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    # Hash of task and params: identical requests share one job
+    key = models.CharField(max_length=64)
+    # Jobs with a higher priority are started first
+    priority = models.SmallIntegerField(default=0)
+    # Current state of the job
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    # Percent done and a short description of the current step
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    # Value returned by the task, or the error of a failed job
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    # Number of times a worker has started the job
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # User who requested the job
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    # Timestamp when the job was queued (auto-set)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # When a worker started the job, and its last sign of life (stale running jobs are retried)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # When the job finished, and until when its result is reused
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Next job for a worker: queued jobs by priority, oldest first
+            models.Index(fields=['status', '-priority', 'id'], name='job_queue_idx'),
+            # Queued, running or cached jobs with the same key
+            models.Index(fields=['key', '-id'], name='job_key_idx'),
+        ]
+        constraints = [
+            # Identical requests never queue a second job while one is waiting or running
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status__in=['queued', 'running']),
+                                    name='job_active_key_unique'),
+        ]
+
+    # String representation of the job
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
@@ -0,0 +1,123 @@
+# Import standard library modules for version stamps and ETags
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+
+# Import Django modules for the configured cache, messages and conditional responses
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+# Defaults for settings.POS_PAGE_CACHE
+DEFAULTS = {
+    # Cache alias (settings.CACHES) holding the versions, cached page data and template fragments
+    'ALIAS': 'default',
+    # Seconds cached data and fragments live; a change invalidates them sooner through its version
+    'TIMEOUT': 600,
+}
+
+# The data pages are built from, each with its own version: catalog (products with their category names),
+# categories (the category list), stock (levels, changed by every sale) and sales (dashboard figures)
+NAMESPACES = ('catalog', 'categories', 'stock', 'sales')
+
+# Marks a cache miss (None is a valid cached value)
+_MISSING = object()
+
+
+# Merged page cache settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_PAGE_CACHE', {}))
+    return config
+
+
+def get_cache():
+    return caches[get_config()['ALIAS']]
+
+
+def _version_key(namespace):
+    return f'pos:version:{namespace}'
+
+
+# Current versions {namespace: version}, read in one cache round trip. A version is the time of the last
+# change (nanoseconds since the epoch), so it doubles as a Last-Modified time; a missing version (cold or
+# evicted cache) starts now, which invalidates anything cached under an older one.
+def versions(*namespaces):
+    cache = get_cache()
+    found = cache.get_many([_version_key(namespace) for namespace in namespaces])
+    current = {}
+    for namespace in namespaces:
+        version = found.get(_version_key(namespace))
+        if version is None:
+            version = time.time_ns()
+            # Another process may have started this version first; everyone uses the winner
+            if not cache.add(_version_key(namespace), version, None):
+                version = cache.get(_version_key(namespace), version)
+        current[namespace] = version
+    return current
+
+
+# Move namespaces to a new version, so every page and fragment built from them is rebuilt
+def bump(*namespaces):
+    get_cache().set_many({_version_key(namespace): time.time_ns() for namespace in namespaces}, None)
+
+
+# Bump now and again when the current transaction commits: a request that cached the old rows between
+# the two bumps (the change was not visible to it yet) has its entry invalidated by the second one
+def invalidate(*namespaces, using=None):
+    bump(*namespaces)
+    transaction.on_commit(lambda: bump(*namespaces), using=using)
+
+
+# One string for a set of versions, for template fragment keys
+def token(current):
+    return '-'.join(str(current[namespace]) for namespace in sorted(current))
+
+
+# Time of the latest change among some versions
+def last_modified(current):
+    return datetime.fromtimestamp(max(current.values()) / 1e9, tz=dt_timezone.utc)
+
+
+# Context for {% cache fragment_timeout name fragment_version ... using=fragment_cache %} in templates
+def fragment_context(current):
+    config = get_config()
+    return {'fragment_version': token(current), 'fragment_timeout': config['TIMEOUT'], 'fragment_cache': config['ALIAS']}
+
+
+# Value of compute(), cached until one of the versions it was built under changes
+def get_or_set(name, current, compute):
+    cache = get_cache()
+    key = f'pos:data:{name}:{token(current)}'
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        cache.set(key, value, get_config()['TIMEOUT'])
+    return value
+
+
+# 304 Not Modified if the client's copy is current, otherwise render(); both carry ETag and Last-Modified.
+# parts identify the page content (versions, page parameters). The user and CSRF secret are added because
+# every page shows the user's name and embeds a form token.
+def conditional_response(request, parts, modified, render):
+    # Pending messages are only shown by a freshly rendered page
+    if len(messages.get_messages(request)):
+        return render()
+    # Create the CSRF secret now on the client's first page (rendering would), so the tag stays the same
+    get_token(request)
+    digest = hashlib.md5(repr([*parts, request.user.pk, request.META.get('CSRF_COOKIE')]).encode(),
+                         usedforsecurity=False)
+    etag = quote_etag(digest.hexdigest())
+    timestamp = int(modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = render()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    # Pages are per user: browsers may keep them but must revalidate every time
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,142 @@
+# Import standard library modules for cursor encoding
+import base64
+import binascii
+import json
+from collections import namedtuple
+from functools import reduce
+from operator import or_
+
+# Import Django modules for pagination and raw catalog queries
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+# Below this many rows an exact COUNT(*) is cheap enough to run
+ESTIMATE_THRESHOLD = 10000
+
+# Default number of rows per keyset page
+KEYSET_PAGE_SIZE = 25
+
+# One keyset page: the rows and opaque cursors for the neighbouring pages (None at either end)
+KeysetPage = namedtuple('KeysetPage', 'items next_cursor previous_cursor')
+
+
+# Approximate number of rows in a table from catalog statistics, or None if unavailable
+def estimated_table_rows(model, using='default'):
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            row = cursor.fetchone()
+            # reltuples is -1 for tables that have never been analyzed
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # MAX(rowid) is read from the end of the table b-tree; deleted rows make it an overestimate
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+            row = cursor.fetchone()
+            return row[0] or 0
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+                [table],
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+    return None
+
+
+# Paginator for very large tables: unfiltered changelists use the table's row estimate instead of COUNT(*)
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        # Filtered querysets (search, list_filter) still need an exact count
+        if query is None or query.where:
+            return super().count
+        estimate = estimated_table_rows(queryset.model, queryset.db)
+        if estimate is None or estimate < ESTIMATE_THRESHOLD:
+            return super().count
+        return estimate
+
+
+# Opaque URL-safe cursor for the row values a page starts after (or ends before)
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, [value if isinstance(value, (int, str)) or value is None else str(value)
+                                      for value in values]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+# Direction and typed row values of a cursor, or None if it is missing or malformed
+def decode_cursor(cursor, model, ordering):
+    if not cursor:
+        return None
+    try:
+        direction, raw_values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if direction not in ('after', 'before') or len(raw_values) != len(ordering):
+            return None
+        values = [_field(model, name).to_python(value) for name, value in zip(_names(ordering), raw_values)]
+    except (ValueError, TypeError, binascii.Error, ValidationError):
+        return None
+    return direction, values
+
+
+def _names(ordering):
+    return [field.lstrip('-') for field in ordering]
+
+
+def _field(model, name):
+    return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+
+# Rows strictly after the given values in the given ordering (row-value comparison spelled as ORs)
+def _after(ordering, values):
+    clauses = []
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = f'{name}__lt' if field.startswith('-') else f'{name}__gt'
+        clauses.append(Q(**equal, **{lookup: value}))
+        equal[name] = value
+    return reduce(or_, clauses)
+
+
+# Queryset ordered by ordering and starting strictly after the given row values (None = from the start)
+def seek(queryset, ordering, values=None):
+    if values is not None:
+        queryset = queryset.filter(_after(ordering, values))
+    return queryset.order_by(*ordering)
+
+
+# Keyset (seek) pagination: each page is one indexed range scan, however deep the page is.
+# ordering must end in a unique column (usually pk) and match an index for the scan to stay cheap.
+def keyset_paginate(queryset, ordering, cursor=None, per_page=KEYSET_PAGE_SIZE):
+    ordering = list(ordering)
+    decoded = decode_cursor(cursor, queryset.model, ordering)
+    direction, values = decoded if decoded else ('after', None)
+    # Pages before the cursor are read backwards and flipped
+    scan_order = ordering if direction == 'after' else [
+        field[1:] if field.startswith('-') else f'-{field}' for field in ordering
+    ]
+    # Fetch one extra row to know whether the scan continues without counting
+    items = list(seek(queryset, scan_order, values)[:per_page + 1])
+    more = len(items) > per_page
+    items = items[:per_page]
+    if direction == 'before':
+        items.reverse()
+    if not items:
+        return KeysetPage(items, None, None)
+
+    def row_values(item):
+        return [getattr(item, name) for name in _names(ordering)]
+
+    has_next = more if direction == 'after' else True
+    has_previous = values is not None if direction == 'after' else more
+    return KeysetPage(
+        items,
+        encode_cursor('after', row_values(items[-1])) if has_next else None,
+        encode_cursor('before', row_values(items[0])) if has_previous else None,
+    )
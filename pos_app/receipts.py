@@ -0,0 +1,50 @@
+# Import standard library modules for the receipt line tuples
+from collections import namedtuple
+from decimal import Decimal
+
+# Import Django modules for loading the items of sales made before receipt snapshots
+from django.db.models import Prefetch, prefetch_related_objects
+
+from .models import SaleItem
+
+# Layout of Sale.receipt; a new layout gets a new number and its own reader
+RECEIPT_VERSION = 1
+
+# One receipt line as of sale time
+ReceiptLine = namedtuple('ReceiptLine', 'name barcode category quantity unit_price total_price')
+
+
+# Receipt snapshot for Sale.receipt from checkout lines [(product with its category, quantity, total price)].
+# Lines are stored as arrays in ReceiptLine order, which keeps the JSON small.
+def snapshot(lines):
+    return {
+        'version': RECEIPT_VERSION,
+        'lines': [
+            [product.name, product.barcode, product.category.name, quantity, product.price, total_price]
+            for product, quantity, total_price in lines
+        ],
+    }
+
+
+# Load the items of sales without a receipt snapshot, with their products and categories, in one query
+def prefetch_legacy_items(sales):
+    legacy = [sale for sale in sales if sale.receipt is None]
+    if legacy:
+        prefetch_related_objects(
+            legacy, Prefetch('items', queryset=SaleItem.objects.select_related('product__category').order_by('pk')),
+        )
+
+
+# ReceiptLines of a sale: from its snapshot, or from its items (as the products are now) for older sales,
+# which should have been passed through prefetch_legacy_items first
+def receipt_lines(sale):
+    if sale.receipt is not None:
+        return [
+            ReceiptLine(name, barcode, category, quantity, Decimal(unit_price), Decimal(total_price))
+            for name, barcode, category, quantity, unit_price, total_price in sale.receipt['lines']
+        ]
+    return [
+        ReceiptLine(item.product.name, item.product.barcode, item.product.category.name, item.quantity,
+                    item.unit_price, item.total_price)
+        for item in sale.items.all()
+    ]
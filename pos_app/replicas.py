@@ -0,0 +1,256 @@
+# Import standard library modules for the routing state of a block, lag checks and the SQLite copy
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Import Django modules for settings, connections and async middleware support
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, connections, transaction
+
+from . import jobs
+
+# Defaults for settings.POS_REPLICA
+DEFAULTS = {
+    # Database alias (settings.DATABASES) of the read replica
+    'ALIAS': 'reporting',
+    # Seconds the replica may trail the primary before reporting reads go to the primary instead
+    'MAX_LAG': 300,
+    # Seconds each process reuses a lag measurement
+    'CHECK_INTERVAL': 15,
+    # Seconds a session reads its reports from the primary after it wrote to the app's tables, so a saved change
+    # is never missing from the next page. Keep it at least MAX_LAG, the longest the replica may trail.
+    'PIN_SECONDS': 300,
+}
+
+# Alias of the primary database: every write, and every read outside a reporting block
+PRIMARY = 'default'
+
+# Apps whose reads may go to the replica. Django's own tables (sessions, users, permissions) are always read
+# where they are written, so a new login or session is never missing from the next page.
+ROUTED_APPS = {'pos_app'}
+# Models of those apps that are always read on the primary: the job queue is claimed and polled, not reported on
+PINNED_MODELS = {'job'}
+
+# Routing state of the current reporting block, {'alias': replica alias or None, 'pinned': bool}; None outside
+_state = ContextVar('pos_replica_state', default=None)
+# Pinning state of the current request (see ReplicaPinMiddleware), {'pinned': bool, 'wrote': bool}; None outside
+_request = ContextVar('pos_replica_request', default=None)
+
+# Session key holding the time (epoch seconds) until which the session reads from the primary
+PIN_SESSION_KEY = '_pos_replica_pinned_until'
+
+# Seconds a PostgreSQL standby trails its primary: 0 while it has replayed everything it received (an idle
+# primary sends nothing new), otherwise the age of the last transaction it replayed. 0 when the alias points
+# at a primary. NULL before the standby has replayed anything.
+POSTGRES_LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+# Last lag measurement of this process
+_lag = {'at': None, 'value': None}
+
+
+# Merged replica settings
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'POS_REPLICA', {}))
+    return config
+
+
+# Whether a model's reads may go to the replica
+def _routed(model):
+    return model._meta.app_label in ROUTED_APPS and model._meta.model_name not in PINNED_MODELS
+
+
+# Whether the replica is a SQLite file copied from a SQLite primary (see refresh_copy), rather than a replica
+# kept current by the database server
+def is_sqlite_copy():
+    alias = get_config()['ALIAS']
+    if alias not in settings.DATABASES:
+        return False
+    primary, replica = connections[PRIMARY].settings_dict, connections[alias].settings_dict
+    return (primary['ENGINE'] == replica['ENGINE'] == 'django.db.backends.sqlite3'
+            and str(primary['NAME']) != str(replica['NAME']))
+
+
+# File next to a SQLite copy recording when the snapshot it holds was taken (written by refresh_copy)
+def _copy_stamp_path():
+    return str(connections[get_config()['ALIAS']].settings_dict['NAME']) + '.refreshed'
+
+
+# Seconds the replica trails the primary, for every table alike: a SQLite copy is as old as its snapshot, and a
+# PostgreSQL standby reports how far its replay is behind. None when there is no replica, it cannot be read
+# (down, or a copy not made yet) or its lag cannot be measured.
+def measure_lag():
+    alias = get_config()['ALIAS']
+    if alias not in settings.DATABASES or alias == PRIMARY:
+        return None
+    if is_sqlite_copy():
+        try:
+            with open(_copy_stamp_path()) as stamp:
+                copied_at = float(stamp.read())
+        except (OSError, ValueError):
+            return None
+        return max(0.0, time.time() - copied_at)
+    replica = connections[alias]
+    if replica.vendor == 'postgresql':
+        try:
+            with replica.cursor() as cursor:
+                cursor.execute(POSTGRES_LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            return None
+        return None if lag is None else float(lag)
+    # A SQLite alias that is not a copy opens the primary's own file
+    if replica.vendor == 'sqlite':
+        return 0.0
+    return None
+
+
+# Current replica lag, measured at most once per CHECK_INTERVAL in each process. A SQLite copy found missing
+# or lagging is refreshed by a background job.
+def replica_lag():
+    config = get_config()
+    now = time.monotonic()
+    if _lag['at'] is None or now - _lag['at'] >= config['CHECK_INTERVAL']:
+        _lag['value'] = measure_lag()
+        _lag['at'] = now
+        if is_sqlite_copy() and (_lag['value'] is None or _lag['value'] > config['MAX_LAG']):
+            jobs.enqueue('refresh_replica')
+    return _lag['value']
+
+
+# Alias reporting reads should use now: the replica, or None (the primary) when it is missing or too far behind
+def reporting_alias():
+    config = get_config()
+    lag = replica_lag()
+    if lag is None or lag > config['MAX_LAG']:
+        return None
+    return config['ALIAS']
+
+
+# Send the reads of a block (a report, an export, an admin list) to the replica while it is current enough;
+# usable as a decorator. Reads inside a transaction on the primary (checkout, and every test), reads of a
+# session that recently wrote (see ReplicaPinMiddleware), and all reads after the block writes to the app's
+# tables, stay on the primary.
+@contextmanager
+def reporting():
+    request = _request.get()
+    if transaction.get_connection(PRIMARY).in_atomic_block or (request is not None and request['pinned']):
+        alias = None
+    else:
+        alias = reporting_alias()
+    token = _state.set({'alias': alias, 'pinned': False})
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+# Database router (settings.DATABASE_ROUTERS) for the primary and its reporting replica
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state['alias'] is None or state['pinned'] or not _routed(model):
+            return None
+        # A transaction started inside the block reads its own writes
+        if transaction.get_connection(PRIMARY).in_atomic_block:
+            return None
+        return state['alias']
+
+    def db_for_write(self, model, **hints):
+        # Read what was just written from where it was written, in this block and in the session's next pages
+        if _routed(model):
+            state, request = _state.get(), _request.get()
+            if state is not None:
+                state['pinned'] = True
+            if request is not None:
+                request['wrote'] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary, by replication or with the copy
+        if db != PRIMARY and db == get_config()['ALIAS']:
+            return False
+        return None
+
+
+# Replace the SQLite replica with a copy of the SQLite primary using SQLite's online backup API: a consistent
+# snapshot taken while the tills keep writing. Readers of the replica wait (busy_timeout) while it is
+# overwritten. Returns the seconds taken.
+def refresh_copy():
+    if not is_sqlite_copy():
+        raise ImproperlyConfigured('Only a SQLite replica of a SQLite primary can be refreshed as a copy')
+    started = time.monotonic()
+    # The copy is at least as new as the moment the backup starts
+    copied_at = time.time()
+    target_name = str(connections[get_config()['ALIAS']].settings_dict['NAME'])
+    os.makedirs(os.path.dirname(target_name) or '.', exist_ok=True)
+    source = sqlite3.connect(str(connections[PRIMARY].settings_dict['NAME']))
+    try:
+        target = sqlite3.connect(target_name, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    # Record the snapshot's age for measure_lag in every process; replaced whole so it is never read half-written
+    stamp_path = _copy_stamp_path()
+    with open(stamp_path + '.tmp', 'w') as stamp:
+        stamp.write(repr(copied_at))
+    os.replace(stamp_path + '.tmp', stamp_path)
+    # Measure again on the next reporting block of this process instead of trusting the old lag
+    _lag['at'] = None
+    return time.monotonic() - started
+
+
+# Middleware (after SessionMiddleware) pinning a session's reporting reads to the primary for PIN_SECONDS after
+# a request of that session writes to the app's tables, e.g. an admin save followed by its changelist
+class ReplicaPinMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = {'pinned': self._pinned(request.session.get(PIN_SESSION_KEY)), 'wrote': False}
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        if state['wrote']:
+            request.session[PIN_SESSION_KEY] = time.time() + get_config()['PIN_SECONDS']
+        return response
+
+    async def __acall__(self, request):
+        state = {'pinned': self._pinned(await request.session.aget(PIN_SESSION_KEY)), 'wrote': False}
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        if state['wrote']:
+            await request.session.aset(PIN_SESSION_KEY, time.time() + get_config()['PIN_SECONDS'])
+        return response
+
+    # Whether a session pinned until the given time still reads from the primary
+    def _pinned(self, until):
+        return until is not None and until > time.time()
@@ -0,0 +1,216 @@
+# Import Django modules for database-side aggregation and date handling
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import CategoryDailyRollup, DailySalesRollup, ProductDailyRollup, Sale
+
+# Payment method codes offered by the report filter (taken from the Sale model choices)
+PAYMENT_METHODS = [code for code, label in Sale._meta.get_field('payment_method').choices]
+
+
+# Read the report filters rendered by sales_report.html from a GET QueryDict
+def parse_report_filters(params):
+    # Dates that fail to parse are ignored rather than raising an error
+    try:
+        start_date = parse_date(params.get('start_date', '').strip())
+    except ValueError:
+        start_date = None
+    try:
+        end_date = parse_date(params.get('end_date', '').strip())
+    except ValueError:
+        end_date = None
+    # Only accept payment methods the model knows about
+    payment_method = params.get('payment_method', '').strip()
+    if payment_method not in PAYMENT_METHODS:
+        payment_method = ''
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'payment_method': payment_method,
+        'user': params.get('user', '').strip(),
+    }
+
+
+# Report filters back in the form of GET parameters (plain strings), e.g. for the parameters of a job
+def filter_params(filters):
+    return {
+        'start_date': filters['start_date'].isoformat() if filters.get('start_date') else '',
+        'end_date': filters['end_date'].isoformat() if filters.get('end_date') else '',
+        'payment_method': filters.get('payment_method', ''),
+        'user': filters.get('user', ''),
+    }
+
+
+# Convert a local calendar date to the aware datetime at its midnight
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+# Apply report filters to a Sale queryset
+def filter_sales(queryset, filters):
+    # Date filters use a half-open datetime range so an index on created_at can be used
+    if filters.get('start_date'):
+        queryset = queryset.filter(created_at__gte=_start_of_day(filters['start_date']))
+    if filters.get('end_date'):
+        queryset = queryset.filter(created_at__lt=_start_of_day(filters['end_date'] + timedelta(days=1)))
+    if filters.get('payment_method'):
+        queryset = queryset.filter(payment_method=filters['payment_method'])
+    if filters.get('user'):
+        queryset = queryset.filter(user__username=filters['user'])
+    return queryset
+
+
+# Average sale amount rounded to centavos (0 when there are no sales)
+def _average(total, count):
+    if not count:
+        return Decimal('0.00')
+    return (total / count).quantize(Decimal('0.01'))
+
+
+# Count, total, average and last sale time computed by a single aggregate query
+def sales_totals(queryset):
+    totals = queryset.aggregate(
+        count=Count('id'),
+        total=Sum('total_amount'),
+        last_sale_at=Max('created_at'),
+    )
+    total = totals['total'] or Decimal('0.00')
+    return {
+        'count': totals['count'],
+        'total': total,
+        'average': _average(total, totals['count']),
+        'last_sale_at': totals['last_sale_at'],
+    }
+
+
+# Per-group count and total computed with GROUP BY (one row per distinct value of field)
+def sales_breakdown(queryset, field):
+    rows = (
+        queryset.order_by()
+        .values(field)
+        .annotate(count=Count('id'), total=Sum('total_amount'))
+        .order_by('-total')
+    )
+    return [
+        {
+            'key': row[field],
+            'count': row['count'],
+            'total': row['total'] or Decimal('0.00'),
+            'average': _average(row['total'] or Decimal('0.00'), row['count']),
+        }
+        for row in rows
+    ]
+
+
+# Apply report filters to the per-day sales rollup (one row per day, cashier and method)
+def filter_daily_rollup(queryset, filters):
+    if filters.get('start_date'):
+        queryset = queryset.filter(day__gte=filters['start_date'])
+    if filters.get('end_date'):
+        queryset = queryset.filter(day__lte=filters['end_date'])
+    if filters.get('payment_method'):
+        queryset = queryset.filter(payment_method=filters['payment_method'])
+    if filters.get('user'):
+        queryset = queryset.filter(user__username=filters['user'])
+    return queryset
+
+
+# Count, total and average read from the daily rollup, so the cost grows with days rather than sales
+def rollup_totals(filters):
+    rows = filter_daily_rollup(DailySalesRollup.objects.all(), filters)
+    totals = rows.aggregate(count=Sum('sale_count'), total=Sum('total_amount'))
+    count = totals['count'] or 0
+    total = totals['total'] or Decimal('0.00')
+    return {'count': count, 'total': total, 'average': _average(total, count)}
+
+
+# Rollup totals plus payment method and cashier breakdowns
+def rollup_summary(filters):
+    rows = filter_daily_rollup(DailySalesRollup.objects.all(), filters)
+    summary = rollup_totals(filters)
+    summary['by_payment_method'] = _rollup_breakdown(rows, 'payment_method')
+    summary['by_cashier'] = _rollup_breakdown(rows, 'user__username')
+    return summary
+
+
+# Per-group figures from the daily rollup, skipping groups whose sales were all removed
+def _rollup_breakdown(rows, field):
+    grouped = (
+        rows.order_by()
+        .values(field)
+        .annotate(count=Sum('sale_count'), total=Sum('total_amount'))
+        .filter(count__gt=0)
+        .order_by('-total')
+    )
+    return [
+        {
+            'key': row[field],
+            'count': row['count'],
+            'total': row['total'],
+            'average': _average(row['total'], row['count']),
+        }
+        for row in grouped
+    ]
+
+
+# Full summary for the sales report: rollup totals plus the time of the latest matching sale
+def sales_summary(filters):
+    summary = rollup_summary(filters)
+    summary['last_sale_at'] = (
+        filter_sales(Sale.objects.all(), filters)
+        .order_by('-created_at')
+        .values_list('created_at', flat=True)
+        .first()
+    )
+    return summary
+
+
+# Everything the sales report page shows above the sales table
+def report_summary(filters):
+    summary = sales_summary(filters)
+    # Product and category rollups are only kept per day, so show them for date-only filters
+    if not filters.get('payment_method') and not filters.get('user'):
+        summary['top_products'] = top_sellers(ProductDailyRollup, 'product', filters)
+        summary['top_categories'] = top_sellers(CategoryDailyRollup, 'category', filters)
+    return summary
+
+
+# Best-selling products or categories for a date range, read from the per-day rollups
+def top_sellers(model, field, filters, limit=5):
+    rows = model.objects.all()
+    if filters.get('start_date'):
+        rows = rows.filter(day__gte=filters['start_date'])
+    if filters.get('end_date'):
+        rows = rows.filter(day__lte=filters['end_date'])
+    return list(
+        rows.order_by()
+        .values(name=F(f'{field}__name'))
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .filter(quantity__gt=0)
+        .order_by('-revenue')[:limit]
+    )
+
+
+# Usernames for the cashier filter dropdown (reads the small user table, not the sales table)
+def cashier_usernames():
+    return list(User.objects.order_by('username').values_list('username', flat=True))
+
+
+# Restore the amounts and last sale time of a summary that went through JSON (a sales_summary job result)
+def summary_from_json(data):
+    def amounts(row, *fields):
+        return {**row, **{field: Decimal(row[field]) for field in fields if row.get(field) is not None}}
+
+    summary = amounts(data, 'total', 'average')
+    summary['last_sale_at'] = parse_datetime(data['last_sale_at']) if data.get('last_sale_at') else None
+    for breakdown in ('by_payment_method', 'by_cashier'):
+        summary[breakdown] = [amounts(row, 'total', 'average') for row in data.get(breakdown, [])]
+    for top in ('top_products', 'top_categories'):
+        if top in data:
+            summary[top] = [amounts(row, 'revenue') for row in data[top]]
+    return summary
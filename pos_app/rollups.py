@@ -0,0 +1,160 @@
+# Import Django modules for incremental and full maintenance of the sales rollup tables
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Sum, When
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from . import pagecache
+from .models import (
+    CategoryDailyRollup, DailySalesRollup, HourlySalesRollup, ProductDailyRollup, Sale, SaleItem,
+)
+
+# Number of rows written per INSERT when rebuilding
+REBUILD_BATCH_SIZE = 1000
+
+
+# Local calendar date and hour bucket for a sale timestamp
+def _buckets(created_at):
+    local = timezone.localtime(created_at)
+    return local.date(), local.replace(minute=0, second=0, microsecond=0)
+
+
+# Add increments to the rollup row identified by keys, creating the row if it does not exist
+def _bump(model, keys, increments):
+    changes = {field: F(field) + value for field, value in increments.items()}
+    if model.objects.filter(**keys).update(**changes):
+        return
+    try:
+        # Savepoint so a concurrent insert of the same row does not abort the outer transaction
+        with transaction.atomic():
+            model.objects.create(**keys, **increments)
+    except IntegrityError:
+        model.objects.filter(**keys).update(**changes)
+
+
+# Add increments to several rollup rows that share keys and differ only in field, using one
+# SELECT, one UPDATE and one bulk INSERT regardless of how many rows are touched
+def _bump_many(model, keys, field, increments):
+    if not increments:
+        return
+    columns = next(iter(increments.values())).keys()
+    existing = set(
+        model.objects.filter(**keys, **{f'{field}__in': list(increments)}).values_list(field, flat=True)
+    )
+    if existing:
+        model.objects.filter(**keys, **{f'{field}__in': list(existing)}).update(**{
+            column: Case(
+                *(When(**{field: value}, then=F(column) + increments[value][column]) for value in existing),
+                default=F(column),
+                output_field=model._meta.get_field(column),
+            )
+            for column in columns
+        })
+    missing = [value for value in increments if value not in existing]
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create([model(**keys, **{field: value}, **increments[value]) for value in missing])
+    except IntegrityError:
+        # Another transaction created some of the rows first; fall back to row-by-row upserts
+        for value in missing:
+            _bump(model, {**keys, field: value}, increments[value])
+
+
+# Apply (sign=1) or reverse (sign=-1) sales [(sale, items)] in every rollup table. Sales falling in the same
+# rows are combined first, so each row is touched once however many sales are applied together.
+def _apply(sales, sign):
+    daily = defaultdict(lambda: {'sale_count': 0, 'total_amount': Decimal('0')})
+    hourly = defaultdict(lambda: {'sale_count': 0, 'total_amount': Decimal('0')})
+    per_product = defaultdict(lambda: defaultdict(lambda: {'quantity': 0, 'revenue': Decimal('0')}))
+    per_category = defaultdict(lambda: defaultdict(lambda: {'quantity': 0, 'revenue': Decimal('0')}))
+    for sale, items in sales:
+        day, hour = _buckets(sale.created_at)
+        for bucket in (daily[day, sale.user_id, sale.payment_method], hourly[hour]):
+            bucket['sale_count'] += sign
+            bucket['total_amount'] += sale.total_amount * sign
+        for item in items:
+            for bucket in (per_product[day][item.product_id], per_category[day][item.product.category_id]):
+                bucket['quantity'] += item.quantity * sign
+                bucket['revenue'] += item.total_price * sign
+
+    for (day, user_id, payment_method), increments in daily.items():
+        _bump(DailySalesRollup, {'day': day, 'user_id': user_id, 'payment_method': payment_method}, increments)
+    for hour, increments in hourly.items():
+        _bump(HourlySalesRollup, {'hour': hour}, increments)
+    for day, increments in per_product.items():
+        _bump_many(ProductDailyRollup, {'day': day}, 'product_id', increments)
+    for day, increments in per_category.items():
+        _bump_many(CategoryDailyRollup, {'day': day}, 'category_id', increments)
+
+
+# Add a newly committed sale to the rollups (call inside the checkout transaction)
+def apply_sale(sale, items):
+    _apply([(sale, items)], 1)
+
+
+# Add a batch of new sales [(sale, items)] to the rollups (call inside the ingesting transaction)
+def apply_sales(sales):
+    _apply(sales, 1)
+
+
+# Remove a sale from the rollups (used when a sale is deleted)
+def revert_sale(sale, items):
+    _apply([(sale, items)], -1)
+
+
+# Recompute every rollup table from the sales tables
+@transaction.atomic
+def rebuild():
+    for model in (DailySalesRollup, HourlySalesRollup, ProductDailyRollup, CategoryDailyRollup):
+        model.objects.all().delete()
+
+    daily = (
+        Sale.objects.annotate(day=TruncDate('created_at'))
+        .values('day', 'user_id', 'payment_method')
+        .annotate(sale_count=Count('id'), total_amount=Sum('total_amount'))
+        .order_by()
+    )
+    _bulk_insert(DailySalesRollup, daily)
+
+    hourly = (
+        Sale.objects.annotate(hour=TruncHour('created_at'))
+        .values('hour')
+        .annotate(sale_count=Count('id'), total_amount=Sum('total_amount'))
+        .order_by()
+    )
+    _bulk_insert(HourlySalesRollup, hourly)
+
+    products = (
+        SaleItem.objects.annotate(day=TruncDate('sale__created_at'))
+        .values('day', 'product_id')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('total_price'))
+        .order_by()
+    )
+    _bulk_insert(ProductDailyRollup, products)
+
+    categories = (
+        SaleItem.objects.annotate(day=TruncDate('sale__created_at'))
+        .values('day', category_id=F('product__category_id'))
+        .annotate(quantity=Sum('quantity'), revenue=Sum('total_price'))
+        .order_by()
+    )
+    _bulk_insert(CategoryDailyRollup, categories)
+    # Cached dashboard figures were read from the old rollups
+    pagecache.invalidate('sales')
+
+
+# Stream aggregated rows into a rollup table in batches
+def _bulk_insert(model, rows):
+    batch = []
+    for row in rows.iterator(chunk_size=REBUILD_BATCH_SIZE):
+        batch.append(model(**row))
+        if len(batch) >= REBUILD_BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
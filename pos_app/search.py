@@ -0,0 +1,253 @@
+# Import standard library modules for query parsing and typo correction
+import difflib
+import re
+import time
+from collections import namedtuple
+
+# Import Django database access for the backend-specific search index
+from django.db import connections
+from django.db.models import Q
+
+from .models import Product
+
+# Inverted index tables (created by migration 0004_product_search)
+INDEX_TABLE = 'pos_app_product_search'
+VOCAB_TABLE = 'pos_app_product_search_vocab'
+
+# Ranking function of the SQLite index (set as its rank by migration 0012), with bm25 column weights for name,
+# barcode, category and description
+SQLITE_RANK = 'bm25(10.0, 8.0, 3.0, 1.0)'
+# Queries made only of prefixes this short match most of the catalog, so they rank just their first RANK_WINDOW
+# matches (in index order) instead of scoring every product on each keystroke
+SHORT_PREFIX = 2
+RANK_WINDOW = 500
+# Query terms beyond this are ignored (keeps autocomplete queries bounded)
+MAX_TERMS = 8
+# Typo correction: how many similar index terms to try per unknown word, and how similar they must be
+SUGGESTIONS_PER_TERM = 3
+SUGGESTION_CUTOFF = 0.75
+# Seconds the per-letter index vocabulary used for typo correction is reused
+VOCABULARY_CACHE_SECONDS = 300
+
+# Letters and digits only; the FTS tokenizers split on everything else (including underscores)
+_TOKEN = re.compile(r'[^\W_]+', re.UNICODE)
+
+# (alias, first letter) -> (loaded at, index terms)
+_vocabulary = {}
+# (alias, database name) -> whether the SQLite index table exists
+_sqlite_index = {}
+
+# One page of ranked search results; corrected lists the words substituted by typo correction
+SearchPage = namedtuple('SearchPage', 'products number has_next corrected')
+
+
+# Lower-cased word tokens of a search query
+def tokens(query):
+    return _TOKEN.findall(query.lower())[:MAX_TERMS]
+
+
+# Which index implementation a database uses ('sqlite', 'postgresql' or None for the LIKE fallback)
+def backend(using='default'):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite' and _sqlite_index_exists(connection):
+        return 'sqlite'
+    return None
+
+
+# Whether the FTS5 index table exists: migration 0004 skips it when SQLite is built without FTS5. Checked once
+# per database and process.
+def _sqlite_index_exists(connection):
+    key = (connection.alias, str(connection.settings_dict['NAME']))
+    if key not in _sqlite_index:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [INDEX_TABLE])
+            _sqlite_index[key] = cursor.fetchone() is not None
+    return _sqlite_index[key]
+
+
+# Add or refresh the index entries of the given products
+def index_products(product_ids, using='default'):
+    product_ids = [int(product_id) for product_id in product_ids]
+    kind = backend(using)
+    if not product_ids or kind is None:
+        return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with connections[using].cursor() as cursor:
+        if kind == 'sqlite':
+            cursor.execute(f'DELETE FROM {INDEX_TABLE} WHERE rowid IN ({placeholders})', product_ids)
+            cursor.execute(
+                f'INSERT INTO {INDEX_TABLE} (rowid, name, barcode, category, description) '
+                f'SELECT p.id, p.name, p.barcode, c.name, p.description FROM pos_app_product p '
+                f'JOIN pos_app_category c ON c.id = p.category_id WHERE p.id IN ({placeholders})',
+                product_ids,
+            )
+        else:
+            cursor.execute(
+                f'INSERT INTO {INDEX_TABLE} (product_id, document, tsv) '
+                f'SELECT p.id, {_PG_DOCUMENT}, {_PG_TSV} FROM pos_app_product p '
+                f'JOIN pos_app_category c ON c.id = p.category_id WHERE p.id IN ({placeholders}) '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document, tsv = EXCLUDED.tsv',
+                product_ids,
+            )
+
+
+# Remove deleted products from the index
+def remove_products(product_ids, using='default'):
+    product_ids = [int(product_id) for product_id in product_ids]
+    kind = backend(using)
+    if not product_ids or kind is None:
+        return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    key = 'rowid' if kind == 'sqlite' else 'product_id'
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INDEX_TABLE} WHERE {key} IN ({placeholders})', product_ids)
+
+
+# Re-index every product (after bulk imports or raw SQL changes that bypass the signals)
+def rebuild(using='default'):
+    kind = backend(using)
+    if kind is None:
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {INDEX_TABLE}')
+        if kind == 'sqlite':
+            cursor.execute(
+                f'INSERT INTO {INDEX_TABLE} (rowid, name, barcode, category, description) '
+                f'SELECT p.id, p.name, p.barcode, c.name, p.description FROM pos_app_product p '
+                f'JOIN pos_app_category c ON c.id = p.category_id'
+            )
+            # Keep the weighted ranking (stored in the index's configuration since migration 0012)
+            cursor.execute(f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}, rank) VALUES ('rank', %s)", [SQLITE_RANK])
+            # Merge the index b-trees so prefix queries touch as few segments as possible
+            cursor.execute(f"INSERT INTO {INDEX_TABLE} ({INDEX_TABLE}) VALUES ('optimize')")
+        else:
+            cursor.execute(
+                f'INSERT INTO {INDEX_TABLE} (product_id, document, tsv) '
+                f'SELECT p.id, {_PG_DOCUMENT}, {_PG_TSV} FROM pos_app_product p '
+                f'JOIN pos_app_category c ON c.id = p.category_id'
+            )
+    _vocabulary.clear()
+
+
+# PostgreSQL document text (for trigram typo matching) and weighted tsvector (for ranked prefix matching)
+_PG_DOCUMENT = "concat_ws(' ', p.name, p.barcode, c.name)"
+_PG_TSV = (
+    "setweight(to_tsvector('simple', p.name), 'A') || setweight(to_tsvector('simple', p.barcode), 'A') || "
+    "setweight(to_tsvector('simple', c.name), 'B') || setweight(to_tsvector('simple', p.description), 'C')"
+)
+
+
+# FTS5 MATCH expression: every term must match as a prefix; a term may carry typo alternatives
+def _fts5_expression(term_groups):
+    return ' AND '.join(
+        '(' + ' OR '.join(f'"{term}"*' for term in group) + ')' for group in term_groups
+    )
+
+
+# Ranked product ids for FTS5 term groups
+def _sqlite_ids(cursor, term_groups, category_id, limit, offset):
+    matches = f'SELECT rowid, rank FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s'
+    params = [_fts5_expression(term_groups)]
+    if category_id is not None:
+        matches += ' AND rowid IN (SELECT id FROM pos_app_product WHERE category_id = %s)'
+        params.append(category_id)
+    # Every match is ranked, except for one- and two-letter prefixes (see SHORT_PREFIX)
+    if all(len(term) <= SHORT_PREFIX for group in term_groups for term in group):
+        matches = f'SELECT rowid FROM ({matches} LIMIT %s)'
+        params.append(max(RANK_WINDOW, offset + limit))
+    cursor.execute(f'{matches} ORDER BY rank, rowid LIMIT %s OFFSET %s', params + [limit, offset])
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Index terms starting with a letter; cached for a while because reading term statistics is slow
+def _sqlite_vocabulary(cursor, first):
+    key = (cursor.db.alias, first)
+    cached = _vocabulary.get(key)
+    if cached is not None and time.monotonic() - cached[0] < VOCABULARY_CACHE_SECONDS:
+        return cached[1]
+    cursor.execute(f'SELECT term FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s', [first, chr(ord(first) + 1)])
+    terms = [row[0] for row in cursor.fetchall()]
+    _vocabulary[key] = (time.monotonic(), terms)
+    return terms
+
+
+# Index terms close to a word that matches nothing (same first letter, similar length)
+def _sqlite_suggestions(cursor, term):
+    cursor.execute(f'SELECT 1 FROM {VOCAB_TABLE} WHERE term >= %s AND term < %s LIMIT 1', [term, term + '\U0010ffff'])
+    if cursor.fetchone():
+        return [term]
+    candidates = [
+        candidate for candidate in _sqlite_vocabulary(cursor, term[0])
+        if abs(len(candidate) - len(term)) <= 2
+    ]
+    return difflib.get_close_matches(term, candidates, n=SUGGESTIONS_PER_TERM, cutoff=SUGGESTION_CUTOFF)
+
+
+# Ranked product ids on SQLite, retrying with typo corrections when nothing matches
+def _search_sqlite(cursor, terms, category_id, limit, offset):
+    ids = _sqlite_ids(cursor, [[term] for term in terms], category_id, limit, offset)
+    if ids or offset:
+        return ids, []
+    groups = [_sqlite_suggestions(cursor, term) for term in terms]
+    if not all(groups) or groups == [[term] for term in terms]:
+        return [], []
+    corrected = [group[0] for term, group in zip(terms, groups) if group != [term]]
+    return _sqlite_ids(cursor, groups, category_id, limit, offset), corrected
+
+
+# Ranked product ids on PostgreSQL: tsvector prefix match, then trigram word similarity for typos
+def _search_postgresql(cursor, terms, category_id, limit, offset):
+    category_sql = ' AND p.category_id = %s' if category_id is not None else ''
+    category_params = [category_id] if category_id is not None else []
+    tsquery = ' & '.join(f'{term}:*' for term in terms)
+    cursor.execute(
+        f"SELECT s.product_id FROM {INDEX_TABLE} s JOIN pos_app_product p ON p.id = s.product_id "
+        f"WHERE s.tsv @@ to_tsquery('simple', %s){category_sql} "
+        f"ORDER BY ts_rank(s.tsv, to_tsquery('simple', %s)) DESC, s.product_id LIMIT %s OFFSET %s",
+        [tsquery, *category_params, tsquery, limit, offset],
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    if ids or offset:
+        return ids, []
+    text = ' '.join(terms)
+    cursor.execute(
+        f"SELECT s.product_id FROM {INDEX_TABLE} s JOIN pos_app_product p ON p.id = s.product_id "
+        f"WHERE %s <%% s.document{category_sql} "
+        f"ORDER BY word_similarity(%s, s.document) DESC, s.product_id LIMIT %s",
+        [text, *category_params, text, limit],
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    return ids, terms if ids else []
+
+
+# Ranked product ids matching a query, and the typo-corrected words used (if any)
+def search_ids(query, category_id=None, limit=20, offset=0, using='default'):
+    terms = tokens(query)
+    if not terms:
+        return [], []
+    kind = backend(using)
+    if kind is not None:
+        with connections[using].cursor() as cursor:
+            if kind == 'sqlite':
+                return _search_sqlite(cursor, terms, category_id, limit, offset)
+            return _search_postgresql(cursor, terms, category_id, limit, offset)
+    # Unindexed fallback for other databases, and SQLite without FTS5
+    products = Product.objects.using(using)
+    for term in terms:
+        products = products.filter(Q(name__icontains=term) | Q(barcode__icontains=term))
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    return list(products.order_by('name', 'pk').values_list('pk', flat=True)[offset:offset + limit]), []
+
+
+# One page of ranked products (with their categories) for a search query
+def search(query, category_id=None, page=1, per_page=24, using='default'):
+    page = max(1, page)
+    # Fetch one extra id to know whether another page exists without counting
+    ids, corrected = search_ids(query, category_id, per_page + 1, (page - 1) * per_page, using)
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    found = Product.objects.using(using).select_related('category').in_bulk(ids)
+    return SearchPage([found[pk] for pk in ids if pk in found], page, has_next, corrected)
@@ -0,0 +1,126 @@
+# Import Django signal helpers and the models whose changes need side effects
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from . import events, pagecache, rollups, search, stock
+from .catalog import bump_version, catalog
+from .models import Category, Product, Sale
+
+# Sent after a checkout transaction commits, with sale, items and stock_levels ({product id: new stock})
+sale_committed = Signal()
+
+# Sent after a batch of offline sales commits (see checkout.ingest), once per batch rather than per sale,
+# with sales (the new ones) and stock_levels ({product id: new stock})
+sales_ingested = Signal()
+
+
+# Take a deleted sale back out of the rollup tables before its items are removed
+@receiver(pre_delete, sender=Sale)
+def remove_sale_from_rollups(sender, instance, **kwargs):
+    rollups.revert_sale(instance, list(instance.items.select_related('product')))
+
+
+# Drop a changed product from this process's catalog cache and tell the other processes
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, using, **kwargs):
+    catalog.invalidate_product(instance.pk)
+    bump_version()
+    # Cached pages and fragments showing products are rebuilt
+    pagecache.invalidate('catalog', using=using)
+
+
+# Start the stock ledger of a new product from its opening stock
+@receiver(post_save, sender=Product)
+def open_product_inventory(sender, instance, created, using, raw=False, **kwargs):
+    if created and not raw:
+        stock.open_inventory([instance], using=using)
+
+
+# Push price and stock changes to the connected tills once the save is durable
+@receiver(post_save, sender=Product)
+def publish_product(sender, instance, using, **kwargs):
+    payload = events.product_payload(instance)
+    # Product.stock_quantity is only the compacted level; send the exact one
+    payload['stock'] = stock.current_stock([instance.pk], using=using).get(instance.pk, payload['stock'])
+    transaction.on_commit(lambda: events.publish('product', payload), using=using)
+
+
+@receiver(post_delete, sender=Product)
+def publish_product_removed(sender, instance, using, **kwargs):
+    payload = {'id': instance.pk}
+    transaction.on_commit(lambda: events.publish('product_removed', payload), using=using)
+
+
+# Keep the product search index in step with saved and deleted products
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, using, **kwargs):
+    search.index_products([instance.pk], using=using)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, using, **kwargs):
+    search.remove_products([instance.pk], using=using)
+
+
+# Category names are embedded in cached products, so a category change clears the whole cache
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, using, **kwargs):
+    catalog.clear()
+    bump_version()
+    pagecache.invalidate('catalog', 'categories', using=using)
+
+
+# Category names are also indexed for search; re-index the category's products on rename
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, using, **kwargs):
+    if not created:
+        search.index_products(instance.product_set.using(using).values_list('pk', flat=True), using=using)
+
+
+# Keep the stock snapshots of this process's catalog cache in step with committed sales and movements
+@receiver(sale_committed)
+@receiver(sales_ingested)
+@receiver(stock.stock_changed)
+def update_cached_stock(sender, stock_levels, **kwargs):
+    catalog.update_stock(stock_levels)
+
+
+# New stock levels and sales totals make cached product grids and dashboard figures stale
+@receiver(sale_committed)
+@receiver(sales_ingested)
+def sale_recorded(sender, **kwargs):
+    pagecache.bump('stock', 'sales')
+
+
+# Sales changed or deleted outside checkout (e.g. in the admin)
+@receiver([post_save, post_delete], sender=Sale)
+def sale_changed(sender, instance, using, **kwargs):
+    pagecache.invalidate('stock', 'sales', using=using)
+
+
+# Restocks and adjustments are rare, so make the other processes reload their catalog caches too
+@receiver(stock.stock_changed)
+def stock_movement_recorded(sender, **kwargs):
+    bump_version()
+    pagecache.bump('stock')
+
+
+# Push the new stock levels of the sold products to the connected tills
+@receiver(sale_committed)
+def publish_stock(sender, sale, stock_levels, **kwargs):
+    events.publish('stock', {'sale': sale.pk, 'stock': {str(pid): stock for pid, stock in stock_levels.items()}})
+
+
+@receiver(sales_ingested)
+def publish_ingested_stock(sender, sales, stock_levels, **kwargs):
+    events.publish('stock', {
+        'sales': [sale.pk for sale in sales],
+        'stock': {str(pid): level for pid, level in stock_levels.items()},
+    })
+
+
+# Push restocks, returns and adjustments to the connected tills like sales
+@receiver(stock.stock_changed)
+def publish_stock_movement(sender, kind, stock_levels, **kwargs):
+    events.publish('stock', {'kind': kind, 'stock': {str(pid): level for pid, level in stock_levels.items()}})
@@ -0,0 +1,200 @@
+# Import Django modules for the stock ledger: movements, snapshots and compaction
+from django.db import transaction
+from django.db.models import F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Inventory, Product, StockMovement, StockSnapshot
+
+# Products folded per compaction transaction
+COMPACT_BATCH_SIZE = 1000
+
+# Sent after a non-sale stock movement commits, with kind and stock_levels ({product id: new stock}).
+# Sales announce their stock levels through signals.sale_committed instead.
+stock_changed = Signal()
+
+
+# Raised when a movement would take a product below zero; the message is safe to show to staff
+class StockError(Exception):
+    pass
+
+
+# Sum of a product's movements recorded after its Inventory snapshot (0 when there are none); product and
+# movement_id are the paths to the product id and the snapshot's last movement from the annotated model
+def _tail_expression(product='pk', movement_id='inventory__movement_id'):
+    tail = (
+        StockMovement.objects
+        .filter(product=OuterRef(product), id__gt=Coalesce(OuterRef(movement_id), Value(0)))
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    return Coalesce(Subquery(tail, output_field=IntegerField()), Value(0))
+
+
+# Exact stock of each product, as an annotation on Product querysets: the snapshot plus the tail of
+# movements after it. Products without an Inventory row start from Product.stock_quantity.
+def current_stock_expression():
+    return Coalesce(F('inventory__quantity'), F('stock_quantity')) + _tail_expression()
+
+
+# Exact stock of each snapshot's product, as an annotation on Inventory querysets
+def inventory_stock_expression():
+    return F('quantity') + _tail_expression('product_id', 'movement_id')
+
+
+# Exact stock of several products in one query: {product id: quantity}; missing products are left out
+def current_stock(product_ids, using='default'):
+    return dict(
+        Product.objects.using(using).filter(pk__in=list(product_ids))
+        .annotate(current_stock=current_stock_expression()).values_list('pk', 'current_stock')
+    )
+
+
+# Set stock_quantity on product instances to their exact stock, for display; returns the products
+def refresh(products, using='default'):
+    products = list(products)
+    levels = current_stock([product.pk for product in products], using=using)
+    for product in products:
+        product.stock_quantity = levels.get(product.pk, product.stock_quantity)
+    return products
+
+
+# Ledger rows for the items of a sale (bulk inserted by checkout)
+def sale_movements(sale, items):
+    return [
+        StockMovement(product_id=item.product_id, kind=StockMovement.SALE, quantity=-item.quantity,
+                      sale=sale, user_id=sale.user_id)
+        for item in items
+    ]
+
+
+# Append movements of one kind ({product id: signed quantity}) to the ledger; returns the new movements.
+# The products are locked first so concurrent movements of the same product cannot take it below zero.
+def record(kind, changes, user=None, note='', using='default'):
+    changes = {int(product_id): quantity for product_id, quantity in changes.items() if quantity}
+    if not changes:
+        return []
+    with transaction.atomic(using=using):
+        locked = set(Product.objects.using(using).select_for_update(of=('self',), no_key=True)
+                     .filter(pk__in=list(changes)).values_list('pk', flat=True))
+        # Read stock in a new statement, after the locks are held, so it includes every committed movement
+        levels = current_stock(locked, using=using)
+        for product_id, quantity in changes.items():
+            if product_id not in locked:
+                raise StockError(f'Product {product_id} does not exist')
+            if levels[product_id] + quantity < 0:
+                raise StockError(f'Product {product_id} has only {levels[product_id]} in stock')
+        movements = StockMovement.objects.using(using).bulk_create([
+            StockMovement(product_id=product_id, kind=kind, quantity=quantity, user=user, note=note)
+            for product_id, quantity in changes.items()
+        ])
+        stock_levels = {product_id: levels[product_id] + quantity for product_id, quantity in changes.items()}
+        transaction.on_commit(lambda: stock_changed.send(
+            sender=StockMovement, kind=kind, stock_levels=stock_levels,
+        ), using=using)
+    return movements
+
+
+# Bring products to target levels ({product id: quantity}) with adjustment movements; returns the new levels
+def set_levels(levels, user=None, note='', using='default'):
+    levels = {int(product_id): quantity for product_id, quantity in levels.items()}
+    with transaction.atomic(using=using):
+        # Lock before reading, as record() does, so the adjustments land exactly on the targets
+        list(Product.objects.using(using).select_for_update(of=('self',), no_key=True)
+             .filter(pk__in=list(levels)).values_list('pk', flat=True))
+        current = current_stock(levels, using=using)
+        record(StockMovement.ADJUSTMENT, {pid: levels[pid] - quantity for pid, quantity in current.items()},
+               user=user, note=note, using=using)
+    return {pid: levels[pid] for pid in current}
+
+
+# Give new products their Inventory row and opening snapshot (bulk_create skips the post_save signal)
+def open_inventory(products, using='default'):
+    now = timezone.now()
+    products = list(products)
+    Inventory.objects.using(using).bulk_create(
+        [Inventory(product_id=product.pk, quantity=product.stock_quantity) for product in products],
+        ignore_conflicts=True,
+    )
+    StockSnapshot.objects.using(using).bulk_create([
+        StockSnapshot(product_id=product.pk, quantity=product.stock_quantity, movement_id=0, taken_at=now)
+        for product in products
+    ])
+
+
+# Fold the movements of some products into their Inventory snapshots; returns how many were folded
+def _fold(product_ids, using):
+    now = timezone.now()
+    with transaction.atomic(using=using):
+        # No sale or adjustment of these products can commit until their new snapshot is written
+        list(Product.objects.using(using).select_for_update(of=('self',), no_key=True)
+             .filter(pk__in=product_ids).values_list('pk', flat=True))
+        last_movement = (StockMovement.objects.filter(product=OuterRef('pk')).order_by()
+                         .values('product').annotate(last=Max('id')).values('last'))
+        rows = list(
+            Product.objects.using(using).filter(pk__in=product_ids)
+            .annotate(current_stock=current_stock_expression(), last_movement=Subquery(last_movement))
+            .values_list('pk', 'current_stock', 'last_movement')
+        )
+        folded = {pk: (quantity, last) for pk, quantity, last in rows}
+        inventories = list(Inventory.objects.using(using).filter(product_id__in=list(folded)))
+        for inventory in inventories:
+            inventory.quantity, inventory.movement_id = folded[inventory.product_id]
+            inventory.last_updated = now
+        Inventory.objects.using(using).bulk_update(inventories, ['quantity', 'movement_id', 'last_updated'])
+        have = {inventory.product_id for inventory in inventories}
+        Inventory.objects.using(using).bulk_create([
+            Inventory(product_id=pk, quantity=quantity, movement_id=last)
+            for pk, (quantity, last) in folded.items() if pk not in have
+        ])
+        StockSnapshot.objects.using(using).bulk_create([
+            StockSnapshot(product_id=pk, quantity=quantity, movement_id=last, taken_at=now)
+            for pk, (quantity, last) in folded.items()
+        ])
+        # Keep the denormalised copy on Product close to the truth for the admin and reports
+        Product.objects.using(using).bulk_update(
+            [Product(pk=pk, stock_quantity=quantity) for pk, (quantity, last) in folded.items()],
+            ['stock_quantity'],
+        )
+    return len(folded)
+
+
+# Fold every product's ledger tail into a new snapshot, a batch of products per transaction.
+# Products are walked by primary key and each probe uses stockmovement_product_idx, so the cost
+# depends on the catalog size and the unfolded tail, never on the length of the whole ledger.
+def compact(batch_size=COMPACT_BATCH_SIZE, using='default'):
+    compacted = 0
+    last_pk = 0
+    while True:
+        ids = list(Product.objects.using(using).filter(pk__gt=last_pk).order_by('pk')
+                   .values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return compacted
+        last_pk = ids[-1]
+        pending = list(
+            StockMovement.objects.using(using)
+            .filter(product_id__in=ids, id__gt=Coalesce(F('product__inventory__movement_id'), Value(0)))
+            .order_by().values_list('product_id', flat=True).distinct()
+        )
+        if pending:
+            compacted += _fold(pending, using)
+
+
+# Stock of several products at a past time: {product id: quantity}, from each product's latest snapshot
+# taken by then plus the movements recorded after it up to that time (at most one compaction interval's
+# worth). Products with no snapshot by then (created later, or before the ledger existed) map to None.
+def stock_at(product_ids, when, using='default'):
+    snapshots = StockSnapshot.objects.filter(product=OuterRef('pk'), taken_at__lte=when).order_by('-taken_at', '-id')
+    tail = (
+        StockMovement.objects
+        .filter(product=OuterRef('pk'), id__gt=OuterRef('snapshot_movement'), created_at__lte=when)
+        .order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    )
+    rows = (
+        Product.objects.using(using).filter(pk__in=list(product_ids))
+        .annotate(snapshot_quantity=Subquery(snapshots.values('quantity')[:1]),
+                  snapshot_movement=Subquery(snapshots.values('movement_id')[:1]))
+        .annotate(tail=Coalesce(Subquery(tail, output_field=IntegerField()), Value(0)))
+        .values_list('pk', 'snapshot_quantity', 'tail')
+    )
+    return {pk: None if quantity is None else quantity + tail for pk, quantity, tail in rows}
@@ -0,0 +1,112 @@
+# Import standard library modules for the uploaded files of import jobs
+import os
+
+# Import the job queue and the modules whose heavy work runs in background jobs
+from . import analytics, exports, forecasting, imports, jobs, pagecache, replicas, reports, rollups, stock
+from .models import DailySalesRollup, Product, Sale
+
+# Seconds a finished report summary is shown to identical requests (a new sale starts a new job anyway)
+SUMMARY_TTL = 60
+# Seconds an export file is handed to identical requests
+EXPORT_TTL = 300
+
+
+# Totals, breakdowns and best sellers for the sales report page; filters are GET-style strings
+@jobs.task(priority=jobs.HIGH, ttl=SUMMARY_TTL)
+@replicas.reporting()
+def sales_summary(job, filters):
+    return reports.report_summary(reports.parse_report_filters(filters))
+
+
+# Sales export file: the sales matching report filters, or the given sales
+@jobs.task(ttl=EXPORT_TTL)
+@replicas.reporting()
+def export_sales(job, format, filters=None, sale_ids=None, filename=None):
+    filters = reports.parse_report_filters(filters or {})
+    if sale_ids is not None:
+        sales = Sale.objects.filter(pk__in=sale_ids)
+    else:
+        sales = reports.filter_sales(Sale.objects.all(), filters)
+    return jobs.write_result(job, *exports.export_file(format, sales, filters, filename))
+
+
+# Product catalog file in the import format, of all products or the given ones
+@jobs.task(ttl=EXPORT_TTL)
+@replicas.reporting()
+def export_products(job, format, product_ids=None):
+    products = Product.objects.all()
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    return jobs.write_result(job, *exports.product_export_file(format, products))
+
+
+# Import an uploaded product file (saved by jobs.save_upload, removed afterwards)
+@jobs.task()
+def import_products(job, path, format, dry_run=False):
+    size = os.path.getsize(path)
+    try:
+        with open(path, 'rb') as stream:
+            report = imports.import_products(
+                stream, format, user=job.user, dry_run=dry_run,
+                progress=lambda report: jobs.progress(job, stream.tell(), size, f'{report.rows} rows read'),
+            )
+    finally:
+        os.remove(path)
+    prefix = 'Dry run: would create' if dry_run else 'Created'
+    return {
+        'rows': report.rows,
+        'created': report.created,
+        'updated': report.updated,
+        'stock_adjusted': report.stock_adjusted,
+        'error_count': report.error_count,
+        'errors': report.errors,
+        'message': f'{prefix} {report.created} and update {report.updated} products '
+                   f'({report.stock_adjusted} stock levels adjusted) from {report.rows} rows; '
+                   f'{report.error_count} rows rejected.',
+    }
+
+
+# Bring products to target stock levels ({product id: quantity}) with adjustment movements
+@jobs.task()
+def set_stock_levels(job, levels, note=''):
+    updated = stock.set_levels(levels, user=job.user, note=note)
+    return {'updated': len(updated), 'message': f'Set the stock of {len(updated)} products.'}
+
+
+# Recompute the sales rollup tables
+@jobs.task(priority=jobs.LOW)
+def rebuild_rollups(job):
+    rollups.rebuild()
+    return {'message': f'Sales rollups rebuilt ({DailySalesRollup.objects.count()} daily rows).'}
+
+
+# Fold the stock ledger into new Inventory snapshots
+@jobs.task(priority=jobs.LOW)
+def compact_stock(job, batch_size=stock.COMPACT_BATCH_SIZE):
+    compacted = stock.compact(batch_size=batch_size)
+    # The product list counts stock from the compacted levels
+    pagecache.bump('stock')
+    return {'message': f'Compacted the stock ledger of {compacted} products.'}
+
+
+# Append new sale lines to the columnar analytics store (or export them all again with rebuild). Queue it
+# with dedupe_key=analytics.JOB_KEY: two refreshes would append the same lines twice.
+@jobs.task(priority=jobs.LOW)
+def refresh_analytics(job, rebuild=False):
+    update = analytics.rebuild if rebuild else analytics.refresh
+    appended = update(progress=lambda rows: jobs.progress(job, message=f'{rows} sale lines exported'))
+    return {'appended': appended, 'message': f'Exported {appended} sale lines to the analytics store.'}
+
+
+# Recompute demand forecasts and reorder points for the whole catalog
+@jobs.task(priority=jobs.LOW)
+def forecast_demand(job):
+    count = forecasting.run()
+    return {'count': count, 'message': f'Forecast demand for {count} products.'}
+
+
+# Copy the primary SQLite database over the reporting replica
+@jobs.task(priority=jobs.LOW)
+def refresh_replica(job):
+    seconds = replicas.refresh_copy()
+    return {'message': f'Reporting replica refreshed in {seconds:.1f}s.'}
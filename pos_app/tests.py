@@ -1,3 +1,1467 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse, QueryDict
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+# Optional: an in-memory Redis (with Lua scripting) for the Redis backends, `pip install fakeredis[lua]`
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from . import (
+    analytics, benchmark, cart, events, exports, forecasting, imports, instrumentation, jobs, pagecache, pagination,
+    replicas, reports, rollups, search, stock, views,
+)
+from .catalog import CatalogCache, catalog
+from .checkout import CREATED, DUPLICATE, REJECTED, CheckoutError, InsufficientStockError, checkout, ingest
+from .management.commands.explain_queries import plan_problems
+from .models import (
+    Category, DailySalesRollup, Inventory, Job, Product, ProductDailyRollup, Sale, SaleItem, StockForecast,
+    StockMovement, StockSnapshot,
+)
+
+
+# Helper that creates a sale, back-dates it and records it in the rollups
+def make_sale(user, amount, payment_method='cash', created_at=None, items=()):
+    sale = Sale.objects.create(user=user, total_amount=Decimal(amount), payment_method=payment_method)
+    if created_at is not None:
+        Sale.objects.filter(pk=sale.pk).update(created_at=created_at)
+        sale.refresh_from_db()
+    sale_items = [
+        SaleItem.objects.create(sale=sale, product=product, quantity=quantity,
+                                unit_price=product.price, total_price=product.price * quantity)
+        for product, quantity in items
+    ]
+    rollups.apply_sale(sale, sale_items)
+    return sale
+
+
+# Run background jobs inside enqueue(), with result files in a temporary directory
+def run_jobs_eagerly(test):
+    result_dir = test.enterContext(tempfile.TemporaryDirectory())
+    test.enterContext(override_settings(POS_JOBS={'MODE': 'eager', 'RESULT_DIR': result_dir},
+                                        POS_ANALYTICS={'DIRECTORY': os.path.join(result_dir, 'analytics')}))
+
+
+# Follow a redirect to a job page and return the job's result file
+def download_job_result(test, response):
+    job = Job.objects.latest('pk')
+    test.assertRedirects(response, reverse('pos_app:job_status', args=[job.pk]), fetch_redirect_response=False)
+    test.assertContains(test.client.get(response.url), reverse('pos_app:job_download', args=[job.pk]))
+    download = test.client.get(reverse('pos_app:job_download', args=[job.pk]))
+    return download, b''.join(download.streaming_content)
+
+
+class ReportAggregationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='pw')
+        cls.bob = User.objects.create_user('bob', password='pw')
+        day = timezone.make_aware(datetime(2025, 3, 10, 12, 0))
+        make_sale(cls.alice, '100.00', 'cash', day)
+        make_sale(cls.alice, '50.00', 'card', day + timedelta(days=1))
+        make_sale(cls.bob, '25.50', 'cash', day + timedelta(days=2))
+
+    def test_totals_and_breakdowns_are_computed_in_the_database(self):
+        with self.assertNumQueries(4):
+            summary = reports.sales_summary(reports.parse_report_filters(QueryDict()))
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['total'], Decimal('175.50'))
+        self.assertEqual(summary['average'], Decimal('58.50'))
+        by_method = {row['key']: row['total'] for row in summary['by_payment_method']}
+        self.assertEqual(by_method, {'cash': Decimal('125.50'), 'card': Decimal('50.00')})
+        by_cashier = {row['key']: row['count'] for row in summary['by_cashier']}
+        self.assertEqual(by_cashier, {'alice': 2, 'bob': 1})
+
+    def test_filters_restrict_dates_method_and_cashier(self):
+        filters = reports.parse_report_filters(QueryDict(
+            'start_date=2025-03-11&end_date=2025-03-12&payment_method=cash&user=bob'
+        ))
+        summary = reports.sales_summary(filters)
+        self.assertEqual(summary['count'], 1)
+        self.assertEqual(summary['total'], Decimal('25.50'))
+
+    def test_invalid_filters_are_ignored(self):
+        filters = reports.parse_report_filters(QueryDict('start_date=2025-99-99&payment_method=bitcoin'))
+        self.assertIsNone(filters['start_date'])
+        self.assertEqual(filters['payment_method'], '')
+
+    def test_sales_report_view_renders_summary(self):
+        run_jobs_eagerly(self)
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('pos_app:sales_report'), {'payment_method': 'card'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['summary']['count'], 1)
+        self.assertEqual(response.context['summary']['total'], Decimal('50.00'))
+        self.assertEqual(response.context['payment_method'], 'card')
+
+    def test_sales_report_shows_the_last_summary_while_a_new_one_is_computed(self):
+        self.client.force_login(self.alice)
+        url = reverse('pos_app:sales_report')
+        # No job worker has run yet: the summary is read from the rollups
+        response = self.client.get(url)
+        self.assertEqual((response.context['summary']['count'], response.context['summary_stale']), (3, False))
+        job = jobs.Worker(poll_interval=0).run_once()
+        # An expired result is still shown, marked stale, and one refresh is queued however often the page loads
+        Job.objects.filter(pk=job.pk).update(expires_at=timezone.now())
+        make_sale(self.alice, '1.00')
+        for _ in range(2):
+            response = self.client.get(url)
+            self.assertEqual(response.context['summary']['count'], 3)
+            self.assertTrue(response.context['summary_stale'])
+        self.assertEqual(Job.objects.filter(task='sales_summary', status=Job.QUEUED).count(), 1)
+
+    def test_profit_section_needs_numpy(self):
+        run_jobs_eagerly(self)
+        self.client.force_login(self.alice)
+        with mock.patch.object(analytics, 'np', None):
+            response = self.client.get(reverse('pos_app:sales_report'))
+        self.assertIsNone(response.context['profit'])
+        self.assertNotContains(response, 'Gross Margin')
+
+    def test_home_dashboard_uses_counts(self):
+        category = Category.objects.create(name='Drinks')
+        Product.objects.create(name='Cola', category=category, price=Decimal('1.00'), barcode='111')
+        response = self.client.get(reverse('pos_app:home'))
+        self.assertEqual(response.context['product_count'], 1)
+        self.assertEqual(response.context['sale_count'], 3)
+        self.assertEqual(response.context['total_sales'], Decimal('175.50'))
+
+
+class RollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('cashier', password='pw')
+        category = Category.objects.create(name='Snacks')
+        cls.chips = Product.objects.create(name='Chips', category=category, price=Decimal('2.50'),
+                                           stock_quantity=100, barcode='200')
+        cls.day = timezone.make_aware(datetime(2025, 5, 1, 9, 30))
+
+    def test_incremental_updates_match_full_rebuild(self):
+        make_sale(self.cashier, '5.00', 'cash', self.day, items=[(self.chips, 2)])
+        make_sale(self.cashier, '2.50', 'cash', self.day + timedelta(minutes=10), items=[(self.chips, 1)])
+        make_sale(self.cashier, '7.50', 'card', self.day + timedelta(days=1), items=[(self.chips, 3)])
+        incremental = sorted(DailySalesRollup.objects.values_list('day', 'payment_method', 'sale_count', 'total_amount'))
+        rollups.rebuild()
+        rebuilt = sorted(DailySalesRollup.objects.values_list('day', 'payment_method', 'sale_count', 'total_amount'))
+        self.assertEqual(incremental, rebuilt)
+        self.assertEqual(ProductDailyRollup.objects.get(day=self.day.date()).quantity, 3)
+
+    def test_deleting_a_sale_reverts_its_rollups(self):
+        sale = make_sale(self.cashier, '5.00', 'cash', self.day, items=[(self.chips, 2)])
+        sale.delete()
+        self.assertEqual(reports.rollup_totals({})['count'], 0)
+        self.assertEqual(ProductDailyRollup.objects.get().quantity, 0)
+
+    def test_sales_cannot_be_edited_in_the_admin(self):
+        admin_user = User.objects.create_superuser('rollup_admin', password='pw')
+        self.client.force_login(admin_user)
+        sale = make_sale(self.cashier, '5.00', 'cash', self.day, items=[(self.chips, 2)])
+        kept = make_sale(self.cashier, '2.50', 'card', self.day, items=[(self.chips, 1)])
+        item = sale.items.get()
+        # The sale and its items can be viewed but not changed, added to or deleted item by item
+        self.assertEqual(self.client.get(reverse('admin:pos_app_sale_change', args=[sale.pk])).status_code, 200)
+        response = self.client.post(reverse('admin:pos_app_sale_change', args=[sale.pk]),
+                                    {'user': admin_user.pk, 'payment_method': 'card'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(reverse('admin:pos_app_saleitem_change', args=[item.pk]),
+                                    {'sale': sale.pk, 'product': self.chips.pk, 'quantity': 9, 'unit_price': '1.00'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(reverse('admin:pos_app_saleitem_delete', args=[item.pk]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:pos_app_sale_add')).status_code, 403)
+        # A whole sale can still be deleted, and the rollups follow
+        response = self.client.post(reverse('admin:pos_app_sale_delete', args=[sale.pk]), {'post': 'yes'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Sale.objects.values_list('pk', flat=True)), [kept.pk])
+        # Reverting leaves emptied rows behind, which a rebuild does not write
+        def rollup_rows():
+            return (
+                sorted(DailySalesRollup.objects.filter(sale_count__gt=0)
+                       .values_list('day', 'payment_method', 'sale_count', 'total_amount')),
+                sorted(ProductDailyRollup.objects.filter(quantity__gt=0)
+                       .values_list('day', 'product', 'quantity', 'revenue')),
+            )
+        incremental = rollup_rows()
+        rollups.rebuild()
+        self.assertEqual(incremental, rollup_rows())
+
+    def test_report_matches_sales_table(self):
+        make_sale(self.cashier, '5.00', 'cash', self.day, items=[(self.chips, 2)])
+        make_sale(self.cashier, '7.50', 'card', self.day + timedelta(days=3), items=[(self.chips, 3)])
+        filters = reports.parse_report_filters(QueryDict('end_date=2025-05-02'))
+        exact = reports.sales_totals(reports.filter_sales(Sale.objects.all(), filters))
+        summary = reports.sales_summary(filters)
+        self.assertEqual((summary['count'], summary['total']), (exact['count'], exact['total']))
+        top = reports.top_sellers(ProductDailyRollup, 'product', filters)
+        self.assertEqual(top, [{'name': 'Chips', 'quantity': 2, 'revenue': Decimal('5.00')}])
+
+
+@skipUnless(analytics.available(), 'NumPy is not installed')
+class AnalyticsStoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till9', password='pw')
+        bakery = Category.objects.create(name='Bakery')
+        drinks = Category.objects.create(name='Drinks')
+        cls.bread = Product.objects.create(name='Bread', category=bakery, price=Decimal('2.00'),
+                                           cost_price=Decimal('1.50'), barcode='501')
+        cls.juice = Product.objects.create(name='Juice', category=drinks, price=Decimal('3.00'),
+                                           cost_price=Decimal('1.00'), barcode='502')
+        day = timezone.make_aware(datetime(2025, 3, 10, 9, 0))
+        make_sale(cls.cashier, '7.00', 'cash', day, [(cls.bread, 2), (cls.juice, 1)])
+        make_sale(cls.cashier, '6.00', 'card', day + timedelta(days=1), [(cls.juice, 2)])
+
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(POS_ANALYTICS={'DIRECTORY': directory, 'BATCH_SIZE': 1,
+                                                           'SETTLE_SECONDS': 0}))
+
+    def test_refresh_appends_only_sales_after_the_watermark(self):
+        self.assertEqual(analytics.refresh(), 3)
+        self.assertEqual(analytics.refresh(), 0)
+        sale = make_sale(self.cashier, '2.00', items=[(self.bread, 1)])
+        self.assertEqual(analytics.refresh(), 1)
+        store = analytics.Store()
+        self.assertEqual((store.rows, store.watermark), (4, sale.pk))
+        self.assertEqual(list(store['quantity']), [2, 1, 2, 1])
+
+    def test_sales_ingested_with_an_earlier_time_of_sale_are_exported(self):
+        analytics.refresh()
+        make_sale(self.cashier, '2.00', items=[(self.bread, 1)])
+        # Recorded later (a higher id) but sold before the sale above
+        late = make_sale(self.cashier, '3.00', 'cash', timezone.now() - timedelta(days=2), [(self.juice, 1)])
+        self.assertEqual(analytics.refresh(), 2)
+        self.assertEqual(analytics.Store().watermark, late.pk)
+
+    def test_new_sales_wait_until_their_ids_have_settled(self):
+        with override_settings(POS_ANALYTICS={**analytics.get_config(), 'SETTLE_SECONDS': 60}):
+            self.assertEqual(analytics.refresh(), 0)
+            with mock.patch.object(analytics.time, 'time', return_value=time.time() + 61):
+                self.assertEqual(analytics.refresh(), 3)
+
+    def test_revenue_margin_top_and_series(self):
+        analytics.refresh()
+        store = analytics.Store()
+        everything = analytics.select(store, {})
+        self.assertEqual(analytics.totals(store, everything),
+                         analytics.Totals(3, 5, Decimal('13.00'), Decimal('6.00'), Decimal('7.00'), Decimal('53.8')))
+        top = analytics.top(store, everything, 'product_id', 'margin', limit=1)
+        self.assertEqual([(row['id'], row['margin']) for row in top], [(self.juice.pk, Decimal('6.00'))])
+        days = analytics.series(store, everything, 'day')
+        self.assertEqual([row['revenue'] for row in days], [Decimal('7.00'), Decimal('6.00')])
+        cash = analytics.select(store, reports.parse_report_filters(QueryDict('payment_method=cash')))
+        self.assertEqual(analytics.totals(store, cash).margin, Decimal('3.00'))
+
+    def test_sales_report_shows_the_profit_section(self):
+        analytics.refresh()
+        self.client.force_login(self.cashier)
+        response = self.client.get(reverse('pos_app:sales_report'))
+        self.assertEqual(response.context['profit']['totals'].margin, Decimal('7.00'))
+        self.assertContains(response, 'Gross Margin')
+
+
+class ForecastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('buyer', 'buyer@example.com', 'pw')
+        category = Category.objects.create(name='Snacks')
+        cls.fast = Product.objects.create(name='Chips', category=category, price=Decimal('1.00'),
+                                          stock_quantity=30, barcode='601')
+        cls.slow = Product.objects.create(name='Nuts', category=category, price=Decimal('4.00'),
+                                          stock_quantity=6, barcode='602')
+
+    def _forecast(self, product, **figures):
+        return StockForecast.objects.create(product=product, computed_at=timezone.now(), **figures)
+
+    def test_stock_status_uses_the_stored_reorder_point(self):
+        self._forecast(self.fast, forecast=5.0, reorder_point=40, status=StockForecast.REORDER)
+        self._forecast(self.slow, forecast=0.1, reorder_point=2, status=StockForecast.OK)
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:pos_app_product_changelist'))
+        self.assertContains(response, 'Reorder (30)')
+        self.assertContains(response, 'OK (6)')
+        # Without a forecast the fixed threshold applies
+        StockForecast.objects.all().delete()
+        self.assertContains(self.client.get(reverse('admin:pos_app_product_changelist')), 'Reorder (6)')
+
+    def test_reorder_report_lists_urgent_products_first(self):
+        self._forecast(self.fast, forecast=5.0, reorder_point=40, reorder_quantity=45, stock=30, days_of_cover=6.0,
+                       status=StockForecast.REORDER)
+        self._forecast(self.slow, forecast=0.1, reorder_point=2, stock=6, days_of_cover=60.0, status=StockForecast.OK)
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('pos_app:reorder_report'))
+        self.assertEqual([f.product for f in response.context['forecasts']], [self.fast])
+
+    @skipUnless(forecasting.available(), 'NumPy is not installed')
+    def test_forecast_computes_cover_and_reorder_points_for_all_products(self):
+        demand = forecasting.np.array([[5.0] * 14, [0.0] * 14, [1.0, 0.0] * 7])
+        levels = forecasting.np.array([20.0, 3.0, 100.0])
+        config = {**forecasting.DEFAULTS, 'LEAD_TIME_DAYS': 7, 'REVIEW_DAYS': 7, 'SERVICE_FACTOR': 0}
+        figures = forecasting.forecast(demand, levels, config)
+        self.assertEqual(list(figures['reorder_point']), [35, 0, 3])
+        self.assertEqual(list(figures['status']), [StockForecast.REORDER, StockForecast.IDLE, StockForecast.OVERSTOCK])
+        self.assertAlmostEqual(figures['days_of_cover'][0], 4.0)
+
+    @skipUnless(forecasting.available(), 'NumPy is not installed')
+    def test_run_stores_a_forecast_per_product(self):
+        today = timezone.localdate()
+        for days_ago in range(1, 15):
+            ProductDailyRollup.objects.create(day=today - timedelta(days=days_ago), product=self.fast, quantity=5)
+        self.assertEqual(forecasting.run(today), 2)
+        fast = StockForecast.objects.get(product=self.fast)
+        self.assertEqual(fast.status, StockForecast.REORDER)
+        self.assertEqual(StockForecast.objects.get(product=self.slow).status, StockForecast.IDLE)
+
+
+class CheckoutServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till1', password='pw')
+        cls.category = Category.objects.create(name='Grocery')
+        cls.products = [
+            Product.objects.create(name=f'Item {n}', category=cls.category, price=Decimal('1.25'),
+                                   stock_quantity=10, barcode=f'900{n}')
+            for n in range(40)
+        ]
+
+    def setUp(self):
+        # The process-wide catalog cache outlives each test's rolled-back transaction
+        catalog.clear()
+
+    def _queries_for(self, cart):
+        with CaptureQueriesContext(connection) as queries:
+            checkout(self.cashier, cart)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_basket_size(self):
+        # Warm up so both baskets below update existing rollup rows
+        checkout(self.cashier, {str(p.pk): 1 for p in self.products})
+        small = self._queries_for({str(self.products[0].pk): 1})
+        large = self._queries_for({str(p.pk): 2 for p in self.products[1:]})
+        self.assertEqual(small, large)
+
+    def test_sale_items_stock_and_total_are_written(self):
+        first, second = self.products[:2]
+        sale = checkout(self.cashier, {str(first.pk): 3, str(second.pk): 1}, 'card')
+        self.assertEqual(sale.total_amount, Decimal('5.00'))
+        self.assertEqual(sale.items.count(), 2)
+        self.assertEqual(stock.current_stock([first.pk]), {first.pk: 7})
+
+    def test_insufficient_stock_rolls_back_everything(self):
+        first, second = self.products[:2]
+        with self.assertRaises(InsufficientStockError) as raised:
+            checkout(self.cashier, {str(first.pk): 1, str(second.pk): 11})
+        self.assertEqual(raised.exception.product, second)
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertEqual(stock.current_stock([first.pk]), {first.pk: 10})
+
+    def test_deleted_product_and_bad_payment_method_are_rejected(self):
+        with self.assertRaises(CheckoutError):
+            checkout(self.cashier, {'999999': 1})
+        with self.assertRaises(CheckoutError):
+            checkout(self.cashier, {str(self.products[0].pk): 1}, 'bitcoin')
+
+    def test_sale_confirm_view_commits_cart(self):
+        self.client.force_login(self.cashier)
+        product = self.products[0]
+        self.client.get(reverse('pos_app:add_to_cart', args=[product.pk]))
+        response = self.client.post(reverse('pos_app:sale_confirm'), {'payment_method': 'cash'})
+        sale = Sale.objects.get()
+        self.assertRedirects(response, reverse('pos_app:sale_detail', args=[sale.pk]), fetch_redirect_response=False)
+        self.assertEqual(reports.rollup_totals({})['count'], 1)
+
+    def _sale_detail_queries(self, sale):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('pos_app:sale_detail', args=[sale.pk]))
+        self.assertEqual(response.status_code, 200)
+        # The login user lookup of every page aside
+        return response, [q['sql'] for q in queries if 'FROM "auth_user"' not in q['sql']]
+
+    def test_sale_detail_renders_the_receipt_as_sold(self):
+        self.client.force_login(self.cashier)
+        sale = checkout(self.cashier, {str(p.pk): 1 for p in self.products})
+        Product.objects.filter(pk=self.products[0].pk).update(name='Renamed', price=Decimal('9.99'))
+        response, queries = self._sale_detail_queries(sale)
+        self.assertEqual(len(queries), 1)
+        self.assertContains(response, 'Item 0')
+        self.assertNotContains(response, 'Renamed')
+        self.assertContains(response, '40 items')
+        # Sales made before receipt snapshots load their items in one more query, whatever their size
+        legacy = make_sale(self.cashier, '50.00', items=[(p, 1) for p in self.products])
+        response, queries = self._sale_detail_queries(legacy)
+        self.assertEqual(len(queries), 2)
+        self.assertContains(response, 'Renamed')
+
+
+class SaleIngestionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till1', password='pw')
+        cls.category = Category.objects.create(name='Grocery')
+        cls.products = [
+            Product.objects.create(name=f'Item {n}', category=cls.category, price=Decimal('2.00'),
+                                   stock_quantity=10, barcode=f'800{n}')
+            for n in range(20)
+        ]
+
+    def setUp(self):
+        catalog.clear()
+
+    def _batch(self, count, start=0, quantity=1):
+        return [
+            {'key': f'till1-{n}', 'items': {str(self.products[n % 20].pk): quantity}, 'payment_method': 'card'}
+            for n in range(start, start + count)
+        ]
+
+    def test_batch_is_recorded_once_and_retries_are_duplicates(self):
+        results = ingest(self.cashier, self._batch(5))
+        self.assertEqual([result.status for result in results], [CREATED] * 5)
+        self.assertEqual(Sale.objects.filter(client_key__startswith='till1-').count(), 5)
+        self.assertEqual(stock.current_stock([self.products[0].pk]), {self.products[0].pk: 9})
+        self.assertEqual(reports.rollup_totals({})['count'], 5)
+        retry = ingest(self.cashier, self._batch(5))
+        self.assertEqual([result.status for result in retry], [DUPLICATE] * 5)
+        self.assertEqual([result.sale.pk for result in retry], [result.sale.pk for result in results])
+        self.assertEqual(Sale.objects.count(), 5)
+        self.assertEqual(stock.current_stock([self.products[0].pk]), {self.products[0].pk: 9})
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        ingest(self.cashier, self._batch(20, start=1000))
+        with CaptureQueriesContext(connection) as small:
+            ingest(self.cashier, self._batch(1))
+        with CaptureQueriesContext(connection) as large:
+            ingest(self.cashier, self._batch(100, start=1))
+        self.assertEqual(len(small), len(large))
+
+    def test_invalid_and_short_sales_are_rejected_alone(self):
+        product = self.products[0]
+        sold_at = timezone.now() - timedelta(days=3)
+        results = ingest(self.cashier, [
+            {'key': 'a', 'items': {str(product.pk): 6}, 'sold_at': sold_at.isoformat()},
+            {'key': 'b', 'items': {str(product.pk): 6}},
+            {'key': 'c', 'items': {'999999': 1}},
+            {'key': 'd', 'items': {str(product.pk): 1}, 'payment_method': 'bitcoin'},
+            {'items': {str(product.pk): 1}},
+            {'key': 'a', 'items': {str(product.pk): 6}},
+        ])
+        self.assertEqual([result.status for result in results],
+                         [CREATED, REJECTED, REJECTED, REJECTED, REJECTED, DUPLICATE])
+        self.assertEqual(results[1].message, 'Insufficient stock for Item 0')
+        self.assertEqual(results[5].sale, results[0].sale)
+        sale = Sale.objects.get()
+        self.assertEqual(sale.created_at, sold_at)
+        self.assertEqual(DailySalesRollup.objects.get().day, timezone.localdate(sold_at))
+
+    def test_ingest_view_reports_each_sale(self):
+        self.client.force_login(self.cashier)
+        url = reverse('pos_app:ingest_sales')
+        body = json.dumps({'sales': self._batch(2) + [{'key': 'x', 'items': {}}]})
+        response = self.client.post(url, body, content_type='application/json')
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertEqual([result['status'] for result in data['results']], [CREATED, CREATED, REJECTED])
+        self.assertEqual(data['results'][0]['total_amount'], '2.00')
+        response = self.client.post(url, json.dumps({'sales': 'no'}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CatalogCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Dairy')
+        cls.products = [
+            Product.objects.create(name=f'Milk {n}', category=cls.category, price=Decimal('3.50'),
+                                   stock_quantity=20, barcode=f'480{n}')
+            for n in range(3)
+        ]
+
+    def setUp(self):
+        self.cache = CatalogCache(max_items=2, check_interval=60)
+
+    def test_hits_are_served_without_queries(self):
+        first = self.products[0]
+        self.assertEqual(self.cache.get(first.pk).category_name, 'Dairy')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get(first.pk).name, 'Milk 0')
+            self.assertEqual(self.cache.get_by_barcode('4800').pk, first.pk)
+
+    def test_least_recently_used_products_are_evicted(self):
+        self.cache.get_many([p.pk for p in self.products])
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache._barcodes.get('4800'))
+        self.assertEqual(self.cache.get_by_barcode('4800').pk, self.products[0].pk)
+
+    def test_saving_a_product_invalidates_it_everywhere(self):
+        product = self.products[1]
+        catalog.clear()
+        catalog.get(product.pk)
+        self.cache.get(product.pk)
+        product.price = Decimal('4.00')
+        product.save()
+        # This process drops it immediately; other caches see the bumped version on their next check
+        self.assertEqual(catalog.get(product.pk).price, Decimal('4.00'))
+        self.cache._checked_at = 0
+        self.assertEqual(self.cache.get(product.pk).price, Decimal('4.00'))
+
+    def test_committed_sale_updates_cached_stock(self):
+        product = self.products[2]
+        catalog.clear()
+        catalog.get(product.pk)
+        cashier = User.objects.create_user('till2', password='pw')
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout(cashier, {str(product.pk): 5})
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.get(product.pk).stock_quantity, 15)
+
+
+class StockLedgerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till7', password='pw')
+        category = Category.objects.create(name='Hardware')
+        cls.product = Product.objects.create(name='Nails', category=category, price=Decimal('0.50'),
+                                             stock_quantity=10, barcode='9901')
+
+    def setUp(self):
+        catalog.clear()
+
+    def test_sales_append_movements_instead_of_updating_the_product(self):
+        with CaptureQueriesContext(connection) as queries:
+            sale = checkout(self.cashier, {str(self.product.pk): 3})
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('UPDATE "pos_app_product"')])
+        movement = StockMovement.objects.get()
+        self.assertEqual((movement.kind, movement.quantity, movement.sale_id), (StockMovement.SALE, -3, sale.pk))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 10)
+        self.assertEqual(stock.current_stock([self.product.pk]), {self.product.pk: 7})
+
+    def test_movements_cannot_take_stock_below_zero(self):
+        stock.record(StockMovement.RESTOCK, {self.product.pk: 5}, user=self.cashier, note='Delivery')
+        with self.assertRaises(stock.StockError):
+            stock.record(StockMovement.ADJUSTMENT, {self.product.pk: -16})
+        self.assertEqual(stock.set_levels({self.product.pk: 0}), {self.product.pk: 0})
+        self.assertEqual(stock.current_stock([self.product.pk]), {self.product.pk: 0})
+        self.assertEqual(list(StockMovement.objects.order_by('id').values_list('quantity', flat=True)), [5, -15])
+
+    def test_compaction_folds_the_tail_into_the_snapshot(self):
+        checkout(self.cashier, {str(self.product.pk): 4})
+        stock.record(StockMovement.RETURN, {self.product.pk: 1})
+        self.assertEqual(stock.compact(), 1)
+        inventory = Inventory.objects.get(product=self.product)
+        self.assertEqual((inventory.quantity, inventory.movement_id), (7, StockMovement.objects.latest('id').pk))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 7)
+        self.assertEqual(stock.current_stock([self.product.pk]), {self.product.pk: 7})
+        # Nothing left to fold
+        self.assertEqual(stock.compact(), 0)
+
+    def test_product_list_cards_count_the_exact_stock(self):
+        self.assertEqual(views._product_stats(), {'total': 1, 'in_stock': 1, 'low_stock': 1})
+        # Sold out, but not compacted yet
+        checkout(self.cashier, {str(self.product.pk): 10})
+        self.assertEqual(views._product_stats(), {'total': 1, 'in_stock': 0, 'low_stock': 0})
+        stock.record(StockMovement.RESTOCK, {self.product.pk: 20})
+        self.assertEqual(views._product_stats(), {'total': 1, 'in_stock': 1, 'low_stock': 0})
+
+    def test_stock_at_a_past_time_uses_the_snapshot_before_it(self):
+        start = timezone.now()
+        StockSnapshot.objects.filter(product=self.product).update(taken_at=start - timedelta(hours=3))
+        checkout(self.cashier, {str(self.product.pk): 2})
+        StockMovement.objects.update(created_at=start - timedelta(hours=2))
+        with mock.patch('django.utils.timezone.now', return_value=start - timedelta(hours=1)):
+            stock.compact()
+        stock.record(StockMovement.ADJUSTMENT, {self.product.pk: -5})
+        times = [start - timedelta(hours=hours) for hours in (4, 2.5, 1.5, 0.5)] + [timezone.now()]
+        levels = [stock.stock_at([self.product.pk], when)[self.product.pk] for when in times]
+        self.assertEqual(levels, [None, 10, 8, 8, 3])
+
+
+class BarcodeScanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till3', password='pw')
+        cls.category = Category.objects.create(name='Snacks')
+        cls.products = [
+            Product.objects.create(name=f'Chips {n}', category=cls.category, price=Decimal('1.50'),
+                                   stock_quantity=30, barcode=f'555{n}')
+            for n in range(3)
+        ]
+
+    def setUp(self):
+        catalog.clear()
+        self.client.force_login(self.cashier)
+
+    def cart_items(self):
+        return cart.get_backend().items(self.client.session.session_key)
+
+    def test_scan_returns_cart_delta(self):
+        url = reverse('pos_app:scan_barcode')
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+        self.client.post(url, {'barcode': '5550'}, headers=headers)
+        data = self.client.post(url, {'barcode': '5550'}, headers=headers).json()
+        self.assertEqual(data['lines'], [{'product_id': self.products[0].pk, 'barcode': '5550', 'name': 'Chips 0',
+                                          'price': '1.50', 'quantity': 2, 'subtotal': '3.00'}])
+        self.assertEqual(self.cart_items(), {self.products[0].pk: 2})
+        missing = self.client.post(url, {'barcode': '0000'}, headers=headers)
+        self.assertEqual(missing.status_code, 404)
+
+    def test_batch_scan_uses_one_lookup_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('pos_app:scan_batch'),
+                                        {'barcodes': ['5551', '5552', '5551', 'nope']},
+                                        content_type='application/json')
+        data = response.json()
+        self.assertEqual(data['not_found'], ['nope'])
+        self.assertEqual(self.cart_items(), {self.products[1].pk: 2, self.products[2].pk: 1})
+        product_queries = [q for q in queries if 'FROM "pos_app_product"' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertIn('"barcode" IN', product_queries[0]['sql'])
+
+
+class ProductSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.drinks = Category.objects.create(name='Beverages')
+        cls.bakery = Category.objects.create(name='Bakery')
+        cls.cola = Product.objects.create(name='Cola Classic 330ml', category=cls.drinks, price=Decimal('1.00'),
+                                          barcode='8801')
+        cls.water = Product.objects.create(name='Sparkling Water', category=cls.drinks, price=Decimal('0.80'),
+                                           barcode='8802', description='Lightly carbonated')
+        cls.bread = Product.objects.create(name='Chocolate Bread', category=cls.bakery, price=Decimal('2.00'),
+                                           barcode='8803')
+
+    def setUp(self):
+        # Typo correction caches index terms per process
+        search._vocabulary.clear()
+
+    def names(self, query, **kwargs):
+        return [product.name for product in search.search(query, **kwargs).products]
+
+    def test_prefix_matching_across_indexed_fields(self):
+        self.assertEqual(set(self.names('c')), {'Cola Classic 330ml', 'Chocolate Bread', 'Sparkling Water'})
+        self.assertEqual(self.names('spark wat'), ['Sparkling Water'])
+        self.assertEqual(self.names('carbon'), ['Sparkling Water'])
+        self.assertEqual(self.names('bever', category_id=self.drinks.pk), ['Cola Classic 330ml', 'Sparkling Water'])
+        self.assertEqual(self.names('8803'), ['Chocolate Bread'])
+
+    def test_typo_tolerance(self):
+        page = search.search('choclate')
+        self.assertEqual([product.name for product in page.products], ['Chocolate Bread'])
+        self.assertEqual(page.corrected, ['chocolate'])
+
+    def test_index_follows_product_and_category_signals(self):
+        self.cola.name = 'Root Beer'
+        self.cola.save()
+        self.assertEqual(self.names('cola'), [])
+        self.assertEqual(self.names('root'), ['Root Beer'])
+        self.bakery.name = 'Pastry'
+        self.bakery.save()
+        self.assertEqual(self.names('pastry'), ['Chocolate Bread'])
+        self.water.delete()
+        self.assertEqual(self.names('sparkling'), [])
+
+    def test_autocomplete_limits_filters_and_reports_corrections(self):
+        self.client.force_login(User.objects.create_user('till8', password='pw'))
+        url = reverse('pos_app:product_search')
+        for n in range(55):
+            Product.objects.create(name=f'Bun {n}', category=self.bakery, price=Decimal('0.30'), barcode=f'890{n}')
+        # limit defaults to 10, is capped at 50 and ignored when not a number
+        self.assertEqual(len(self.client.get(url, {'q': 'bun'}).json()['results']), 10)
+        self.assertEqual(len(self.client.get(url, {'q': 'bun', 'limit': '3'}).json()['results']), 3)
+        self.assertEqual(len(self.client.get(url, {'q': 'bun', 'limit': '500'}).json()['results']), 50)
+        self.assertEqual(len(self.client.get(url, {'q': 'bun', 'limit': '-1'}).json()['results']), 10)
+        data = self.client.get(url, {'q': 'c', 'category': self.drinks.pk}).json()
+        self.assertEqual({row['name'] for row in data['results']}, {'Cola Classic 330ml', 'Sparkling Water'})
+        self.assertEqual(data['corrected'], [])
+        data = self.client.get(url, {'q': 'choclate'}).json()
+        self.assertEqual(data['corrected'], ['chocolate'])
+        self.assertEqual(data['results'], [{
+            'id': self.bread.pk, 'name': 'Chocolate Bread', 'barcode': '8803', 'category': 'Bakery', 'price': '2.00',
+            'stock_quantity': 0,
+        }])
+
+    def test_strong_matches_rank_first_however_many_products_match(self):
+        best = Product.objects.create(name='Beverage Crate', category=self.bakery, price=Decimal('9.00'),
+                                      barcode='8805')
+        with mock.patch.object(search, 'RANK_WINDOW', 1):
+            # A name match outranks the category matches indexed before it
+            self.assertEqual(self.names('bever', per_page=1), [best.name])
+
+    def test_products_save_and_search_without_the_index_table(self):
+        # SQLite built without FTS5: migration 0004 created no index table
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {search.VOCAB_TABLE}')
+            cursor.execute(f'DROP TABLE {search.INDEX_TABLE}')
+        search._sqlite_index.clear()
+        self.addCleanup(search._sqlite_index.clear)
+        Product.objects.create(name='Cola Zero', category=self.drinks, price=Decimal('1.00'), barcode='8804')
+        self.bakery.name = 'Pastry'
+        self.bakery.save()
+        self.water.delete()
+        self.assertIsNone(search.backend())
+        self.assertEqual(self.names('zero'), ['Cola Zero'])
+
+    def test_pages_are_ranked_and_bounded(self):
+        first = search.search('beverages', per_page=1)
+        second = search.search('beverages', page=2, per_page=1)
+        self.assertTrue(first.has_next)
+        self.assertFalse(second.has_next)
+        self.assertNotEqual(first.products, second.products)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till4', password='pw')
+        cls.category = Category.objects.create(name='Stationery')
+        # Duplicate names so the pk tie-breaker matters
+        cls.products = [
+            Product.objects.create(name=f'Pen {n // 2}', category=cls.category, price=Decimal('0.50'),
+                                   stock_quantity=n, barcode=f'330{n}')
+            for n in range(7)
+        ]
+
+    def test_pages_walk_forward_and_back_without_gaps(self):
+        ordering = ('name', 'pk')
+        seen = []
+        cursor = None
+        pages = []
+        while True:
+            page = pagination.keyset_paginate(Product.objects.all(), ordering, cursor, per_page=3)
+            pages.append(page)
+            seen.extend(product.pk for product in page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        expected = list(Product.objects.order_by('name', 'pk').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertIsNone(pages[0].previous_cursor)
+        back = pagination.keyset_paginate(Product.objects.all(), ordering, pages[-1].previous_cursor, per_page=3)
+        self.assertEqual(back.items, pages[-2].items)
+        # A garbled cursor starts from the first page instead of failing
+        garbled = pagination.keyset_paginate(Product.objects.all(), ordering, 'not-a-cursor', per_page=3)
+        self.assertEqual(garbled.items, pages[0].items)
+
+    def test_sales_report_queries_do_not_grow_with_sales(self):
+        self.client.force_login(self.cashier)
+        make_sale(self.cashier, '5.00')
+        # The first request queues the summary job; later ones find it
+        self.client.get(reverse('pos_app:sales_report'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('pos_app:sales_report'))
+        for _ in range(30):
+            make_sale(User.objects.create_user(f'extra{_}'), '5.00')
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('pos_app:sales_report'))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.context['sales']), pagination.KEYSET_PAGE_SIZE)
+
+    def test_product_feed_continues_from_its_cursor_one_bounded_page_at_a_time(self):
+        self.client.force_login(self.cashier)
+        other = Category.objects.create(name='Paper')
+        for n in range(pagination.KEYSET_PAGE_SIZE):
+            Product.objects.create(name=f'Pad {n:02}', category=other, price=Decimal('1.00'), barcode=f'340{n}')
+        url = reverse('pos_app:product_feed')
+        first = self.client.get(url).json()
+        second = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        self.assertEqual(len(first['results']), pagination.KEYSET_PAGE_SIZE)
+        self.assertEqual(len(second['results']), 7)
+        self.assertIsNone(second['next_cursor'])
+        names = [row['name'] for row in first['results'] + second['results']]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len({row['id'] for row in first['results'] + second['results']}), 32)
+        self.assertEqual(first['results'][0], {
+            'id': Product.objects.get(name='Pad 00').pk, 'name': 'Pad 00', 'barcode': '3400', 'category': 'Paper',
+            'price': '1.00', 'stock_quantity': 0,
+        })
+        # The category filter applies to every page; a bad cursor starts from the beginning
+        stationery = self.client.get(url, {'category': self.category.pk}).json()
+        self.assertEqual([row['id'] for row in stationery['results']], [product.pk for product in self.products])
+        self.assertIsNone(stationery['next_cursor'])
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).json()['results'], first['results'])
+
+    def test_sales_feed_returns_next_cursor(self):
+        self.client.force_login(self.cashier)
+        for _ in range(pagination.KEYSET_PAGE_SIZE + 1):
+            make_sale(self.cashier, '1.00')
+        first = self.client.get(reverse('pos_app:sales_feed')).json()
+        second = self.client.get(reverse('pos_app:sales_feed'), {'cursor': first['next_cursor']}).json()
+        self.assertEqual(len(first['results']), pagination.KEYSET_PAGE_SIZE)
+        self.assertEqual(len(second['results']), 1)
+        self.assertIsNone(second['next_cursor'])
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_superuser('exporter', 'exporter@example.com', 'pw')
+        category = Category.objects.create(name='Produce')
+        cls.apple = Product.objects.create(name='=Apple', category=category, price=Decimal('0.40'), barcode='6601')
+        cls.pear = Product.objects.create(name='Pear & Co', category=category, price=Decimal('0.60'), barcode='6602')
+        make_sale(cls.cashier, '1.40', 'cash', timezone.now() - timedelta(days=3),
+                  items=[(cls.apple, 2), (cls.pear, 1)])
+        make_sale(cls.cashier, '0.60', 'card', items=[(cls.pear, 1)])
+
+    def setUp(self):
+        run_jobs_eagerly(self)
+        self.client.force_login(self.cashier)
+
+    def download(self, **params):
+        return download_job_result(self, self.client.get(reverse('pos_app:sales_report'), params))
+
+    def test_csv_streams_filtered_line_items(self):
+        response, body = self.download(export='csv', payment_method='cash')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(body.decode('utf-8-sig'))))
+        self.assertEqual(rows[0], exports.LINE_ITEM_HEADER)
+        self.assertEqual([row[4] for row in rows[1:]], ["'=Apple", 'Pear & Co'])
+        self.assertEqual(rows[1][7:10], ['2', '0.40', '0.80'])
+
+    def test_xlsx_is_a_valid_workbook(self):
+        response, body = self.download(export='xlsx')
+        with zipfile.ZipFile(io.BytesIO(body)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        rows = sheet.findall(f'{namespace}sheetData/{namespace}row')
+        self.assertEqual(len(rows), 4)
+        self.assertIn('Pear & Co', [t.text for t in rows[2].iter(f'{namespace}t')])
+
+    def test_pdf_summary_and_admin_action(self):
+        response, body = self.download(export='pdf')
+        self.assertTrue(body.startswith(b'%PDF-1.4'))
+        self.assertTrue(body.rstrip().endswith(b'%%EOF'))
+        self.assertIn(b'/Count 1', body)
+        self.assertIn(b'Sales: 2', body)
+        response, body = download_job_result(self, self.client.post(reverse('admin:pos_app_sale_changelist'), {
+            'action': 'export_sales_data',
+            '_selected_action': list(Sale.objects.values_list('pk', flat=True)),
+        }))
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="sales-selected.csv"')
+        self.assertEqual(len(body.splitlines()), 4)
+
+
+class ProductImportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('importer', 'importer@example.com', 'pw')
+        cls.category = Category.objects.create(name='Bakery')
+        cls.bread = Product.objects.create(name='Bread', category=cls.category, price=Decimal('2.00'),
+                                           stock_quantity=8, barcode='5501')
+
+    def setUp(self):
+        catalog.clear()
+
+    def test_csv_rows_are_upserted_in_chunks_with_errors_reported(self):
+        data = (
+            'barcode,price,name,category,stock_quantity\n'
+            '5501,1.50,,,12\n'
+            '5502,3.00,Cake,Pastry,4\n'
+            '5503,abc,Pie,Pastry,\n'
+            '5504,1.00,,,\n'
+            '5505,0.99,Bun,Bakery,\n'
+        ).encode()
+        chunks = []
+        report = imports.import_products(io.BytesIO(data), 'csv', chunk_size=2,
+                                         progress=lambda report: chunks.append(report.rows))
+        self.assertEqual((report.rows, report.created, report.updated, report.stock_adjusted), (5, 2, 1, 1))
+        self.assertEqual([line for line, message in report.errors], [4, 5])
+        self.assertEqual(chunks, [2, 5])
+        self.bread.refresh_from_db()
+        # Columns left blank keep their values; stock goes through the ledger
+        self.assertEqual((self.bread.name, self.bread.price), ('Bread', Decimal('1.50')))
+        self.assertEqual(stock.current_stock([self.bread.pk]), {self.bread.pk: 12})
+        self.assertEqual(StockMovement.objects.get().quantity, 4)
+        cake = Product.objects.get(barcode='5502')
+        self.assertEqual((cake.category.name, stock.current_stock([cake.pk])[cake.pk]), ('Pastry', 4))
+        self.assertEqual(search.search('cake').products, [cake])
+
+    def test_export_round_trips_through_the_command(self):
+        output = io.StringIO()
+        call_command('export_products', '-', format='jsonl', stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(json.loads(lines[0])['price'], '2.00')
+        report = imports.import_products(io.StringIO(output.getvalue().replace('"2.00"', '"2.50"')), 'jsonl')
+        self.assertEqual((report.created, report.updated, report.stock_adjusted), (0, 1, 0))
+        self.bread.refresh_from_db()
+        self.assertEqual(self.bread.price, Decimal('2.50'))
+
+    def test_admin_import_page_and_export_action(self):
+        run_jobs_eagerly(self)
+        self.client.force_login(self.admin)
+        url = reverse('admin:pos_app_product_import')
+        self.assertContains(self.client.get(reverse('admin:pos_app_product_changelist')), url)
+        upload = SimpleUploadedFile('prices.csv', b'barcode,price\n5501,2.25\nbad,x\n')
+        response = self.client.post(url, {'file': upload})
+        job = Job.objects.get(task='import_products')
+        self.assertRedirects(response, reverse('pos_app:job_status', args=[job.pk]), fetch_redirect_response=False)
+        self.assertEqual((job.status, job.result['updated'], job.result['error_count']), (Job.DONE, 1, 1))
+        self.assertContains(self.client.get(response.url), 'price is not a number')
+        self.bread.refresh_from_db()
+        self.assertEqual(self.bread.price, Decimal('2.25'))
+        response, body = download_job_result(self, self.client.post(reverse('admin:pos_app_product_changelist'), {
+            'action': 'export_products_csv', '_selected_action': [self.bread.pk],
+        }))
+        rows = list(csv.reader(io.StringIO(body.decode('utf-8-sig'))))
+        self.assertEqual(rows, [exports.PRODUCT_HEADER, ['5501', 'Bread', 'Bakery', '2.25', '0.00', '8', '']])
+
+
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', password='pw')
+        make_sale(cls.manager, '12.00', 'cash')
+
+    def test_identical_requests_share_a_job_and_higher_priority_runs_first(self):
+        filters = reports.filter_params(reports.parse_report_filters(QueryDict()))
+        first = jobs.enqueue('sales_summary', {'filters': filters}, user=self.manager, version=1)
+        self.assertEqual(jobs.enqueue('sales_summary', {'filters': filters}, version=1), first)
+        self.assertNotEqual(jobs.enqueue('sales_summary', {'filters': filters}, version=2), first)
+        maintenance = jobs.enqueue('rebuild_rollups')
+        export = jobs.enqueue('export_sales', {'format': 'csv'})
+        # A more urgent request for queued work moves it up
+        jobs.enqueue('rebuild_rollups', priority=jobs.HIGH + 1)
+        claimed = [jobs.claim().pk for _ in range(4)]
+        self.assertEqual(claimed[0], maintenance.pk)
+        self.assertEqual(claimed[3], export.pk)
+        self.assertIsNone(jobs.claim())
+        self.assertEqual(Job.objects.filter(status=Job.RUNNING).count(), 4)
+
+    def test_worker_runs_jobs_and_caches_results_until_they_expire(self):
+        job = jobs.enqueue('sales_summary', {'filters': {}}, user=self.manager)
+        self.assertEqual(jobs.Worker(poll_interval=0).run_once(), job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress, job.attempts), (Job.DONE, 100, 1))
+        self.assertEqual(reports.summary_from_json(job.result)['total'], Decimal('12.00'))
+        # Within its ttl the result is reused; a job with ttl 0 only dedupes while queued or running
+        self.assertEqual(jobs.enqueue('sales_summary', {'filters': {}}), job)
+        Job.objects.filter(pk=job.pk).update(expires_at=timezone.now())
+        self.assertNotEqual(jobs.enqueue('sales_summary', {'filters': {}}), job)
+        response = self.client.get(reverse('pos_app:job_status', args=[job.pk]), {'format': 'json'})
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.manager)
+        data = self.client.get(reverse('pos_app:job_status', args=[job.pk]), {'format': 'json'}).json()
+        self.assertEqual((data['status'], data['result']['count']), ('done', 1))
+
+    def test_jobs_are_only_shown_to_their_user_and_staff(self):
+        run_jobs_eagerly(self)
+        other = User.objects.create_user('other', password='pw')
+        self.client.force_login(self.manager)
+        download_job_result(self, self.client.get(reverse('pos_app:sales_report'), {'export': 'csv'}))
+        job = Job.objects.get(task='export_sales')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('pos_app:job_status', args=[job.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('pos_app:job_download', args=[job.pk])).status_code, 404)
+        # The same export for another user is their own job
+        self.client.get(reverse('pos_app:sales_report'), {'export': 'csv'})
+        self.assertEqual(Job.objects.get(task='export_sales', user=other).status, Job.DONE)
+        self.client.force_login(User.objects.create_user('boss', password='pw', is_staff=True))
+        self.assertEqual(self.client.get(reverse('pos_app:job_download', args=[job.pk])).status_code, 200)
+
+    def test_analytics_refreshes_share_one_job_while_it_is_active(self):
+        refresh = jobs.enqueue('refresh_analytics', dedupe_key=analytics.JOB_KEY)
+        self.assertEqual(jobs.enqueue('refresh_analytics', {'rebuild': True}, dedupe_key=analytics.JOB_KEY), refresh)
+        jobs.claim()
+        self.assertEqual(jobs.enqueue('refresh_analytics', dedupe_key=analytics.JOB_KEY), refresh)
+
+    def test_progress_failures_and_lost_workers(self):
+        job = jobs.enqueue('set_stock_levels', {'levels': {'not-a-product': 0}})
+        claimed = jobs.claim()
+        jobs.progress(claimed, 3, 4, 'three of four')
+        self.assertEqual(Job.objects.values_list('progress', 'message').get(pk=job.pk), (75, 'three of four'))
+        with self.assertLogs('pos_app.jobs', 'ERROR'):
+            jobs.run(claimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('ValueError', job.error)
+        # A running job whose heartbeat stopped is queued again, up to MAX_ATTEMPTS starts
+        lost = jobs.enqueue('rebuild_rollups')
+        jobs.claim()
+        Job.objects.filter(pk=lost.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), (1, 0))
+        self.assertEqual(jobs.claim().pk, lost.pk)
+        Job.objects.filter(pk=lost.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1), attempts=3)
+        self.assertEqual(jobs.requeue_stale(), (0, 1))
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        # Every test measures the lag afresh
+        replicas._lag['at'] = None
+
+    def _reads_in_block(self, lag):
+        # Outside a transaction, as a report request would run (the test's own transaction is hidden)
+        with mock.patch.object(replicas, 'measure_lag', return_value=lag), \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            with replicas.reporting():
+                reads = [Product.objects.all().db, Job.objects.all().db, User.objects.all().db]
+                replicas.ReplicaRouter().db_for_write(Sale)
+                reads.append(Product.objects.all().db)
+        return reads
+
+    def test_reporting_reads_go_to_a_current_replica_until_the_block_writes(self):
+        self.assertEqual(self._reads_in_block(10.0), ['reporting', 'default', 'default', 'default'])
+        self.assertEqual(Product.objects.all().db, 'default')
+
+    def test_lagging_or_missing_replica_falls_back_to_the_primary(self):
+        self.assertEqual(self._reads_in_block(1000.0)[0], 'default')
+        replicas._lag['at'] = None
+        self.assertEqual(self._reads_in_block(None)[0], 'default')
+
+    def test_reads_inside_a_transaction_stay_on_the_primary(self):
+        with mock.patch.object(replicas, 'measure_lag', return_value=0.0) as measure:
+            with replicas.reporting():
+                self.assertEqual(Sale.objects.all().db, 'default')
+        measure.assert_not_called()
+        self.assertFalse(replicas.ReplicaRouter().allow_migrate('reporting', 'pos_app'))
+
+    def test_a_session_that_wrote_reads_reports_from_the_primary(self):
+        def write(request):
+            replicas.ReplicaRouter().db_for_write(Product)
+            return HttpResponse()
+
+        def report(request):
+            with replicas.reporting():
+                return HttpResponse(Product.objects.all().db)
+
+        factory = RequestFactory()
+        session = SessionStore()
+        with mock.patch.object(replicas, 'measure_lag', return_value=0.0), \
+                mock.patch.object(connection, 'in_atomic_block', False):
+            for view, expected in [(report, 'reporting'), (write, ''), (report, 'default')]:
+                request = factory.get('/')
+                request.session = session
+                self.assertEqual(replicas.ReplicaPinMiddleware(view)(request).content.decode(), expected)
+            # Another session still reads the replica, and the pin runs out
+            request = factory.get('/')
+            request.session = SessionStore()
+            self.assertEqual(replicas.ReplicaPinMiddleware(report)(request).content.decode(), 'reporting')
+            session[replicas.PIN_SESSION_KEY] = time.time() - 1
+            request = factory.get('/')
+            request.session = session
+            self.assertEqual(replicas.ReplicaPinMiddleware(report)(request).content.decode(), 'reporting')
+
+    def test_copy_lag_is_the_age_of_its_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            stamp = os.path.join(directory, 'reporting.sqlite3.refreshed')
+            with mock.patch.object(replicas, 'is_sqlite_copy', return_value=True), \
+                    mock.patch.object(replicas, '_copy_stamp_path', return_value=stamp):
+                self.assertIsNone(replicas.measure_lag())
+                with open(stamp, 'w') as f:
+                    f.write(repr(time.time() - 120))
+                self.assertAlmostEqual(replicas.measure_lag(), 120, delta=5)
+
+
+class QueryPlanTests(TestCase):
+    def test_canonical_queries_use_indexes(self):
+        out = io.StringIO()
+        call_command('explain_queries', strict=True, stdout=out)
+        self.assertIn('All canonical queries use indexes.', out.getvalue())
+
+    def test_full_scans_and_sorts_are_flagged(self):
+        self.assertEqual(plan_problems('sqlite', '2 0 0 SCAN pos_app_sale\n9 0 0 USE TEMP B-TREE FOR ORDER BY'),
+                         ['full scan of pos_app_sale', 'sort for ORDER BY'])
+        self.assertEqual(plan_problems('sqlite', '3 0 0 SCAN pos_app_product USING INDEX product_name_idx'), [])
+
+
+class CartStoreTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till5', password='pw')
+        category = Category.objects.create(name='Frozen')
+        cls.product = Product.objects.create(name='Ice', category=category, price=Decimal('2.00'),
+                                             stock_quantity=5, barcode='7701')
+
+    def setUp(self):
+        catalog.clear()
+        self.client.force_login(self.cashier)
+
+    def test_cart_changes_do_not_write_the_session(self):
+        url = reverse('pos_app:add_to_cart', args=[self.product.pk])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+            self.client.get(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+        writes = [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+        response = self.client.post(reverse('pos_app:update_cart', args=[self.product.pk]), {'delta': '-1'},
+                                    headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.json()['quantity'], 1)
+        self.client.post(reverse('pos_app:update_cart', args=[self.product.pk]), {'quantity': '3'})
+        self.client.post(reverse('pos_app:sale_confirm'), {'payment_method': 'cash'})
+        self.assertEqual(stock.current_stock([self.product.pk]), {self.product.pk: 2})
+        self.assertEqual(cart.get_backend().items(self.client.session.session_key), {})
+
+    # The async cart views and JSON checkout served through the ASGI handler
+    async def test_async_cart_and_checkout_over_asgi(self):
+        await self.async_client.aforce_login(self.cashier)
+        ajax = {'X-Requested-With': 'XMLHttpRequest'}
+        url = reverse('pos_app:add_to_cart', args=[self.product.pk])
+        await self.async_client.get(url, headers=ajax)
+        response = await self.async_client.get(url, headers=ajax)
+        self.assertEqual(response.json()['quantity'], 2)
+        response = await self.async_client.get(reverse('pos_app:add_to_cart', args=[999999]), headers=ajax)
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.async_client.post(reverse('pos_app:checkout_api'), {'payment_method': 'card'},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        sale = await Sale.objects.aget(pk=response.json()['sale_id'])
+        self.assertEqual(sale.total_amount, Decimal('4.00'))
+        response = await self.async_client.post(reverse('pos_app:checkout_api'))
+        self.assertEqual(response.json(), {'success': False, 'message': 'Cart is empty'})
+
+    def test_locmem_backend_operations_and_expiry(self):
+        backend = cart.LocMemCartBackend(ttl=60)
+        self.assertEqual(backend.add('till', 7, 2), 2)
+        self.assertEqual(backend.add('till', 7, -1), 1)
+        backend.set('till', 8, 4)
+        self.assertEqual(backend.add('till', 8, -9), 0)
+        self.assertEqual(backend.items('till'), {7: 1})
+        backend.ttl = -1
+        backend.add('old', 7, 1)
+        self.assertEqual(backend.items('old'), {})
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    def test_redis_backend_operations_and_expiry(self):
+        client = fakeredis.FakeRedis()
+        backend = cart.RedisCartBackend(ttl=60, client=client)
+        self.assertEqual(backend.add('till', 7, 2), 2)
+        self.assertEqual(backend.add('till', 7, -1), 1)
+        backend.set('till', 8, 4)
+        # Adding down to zero (or below) drops the product
+        self.assertEqual(backend.add('till', 8, -9), 0)
+        self.assertEqual(backend.add('till', 9, -1), 0)
+        self.assertEqual(backend.items('till'), {7: 1})
+        backend.set('till', 7, 5)
+        self.assertEqual(backend.items('till'), {7: 5})
+        backend.set('till', 7, 0)
+        self.assertEqual(backend.items('till'), {})
+        # Every change restarts the cart's ttl
+        backend.add('till', 7, 1)
+        self.assertTrue(0 < client.ttl('pos:cart:till') <= 60)
+        backend.clear('till')
+        self.assertEqual(backend.items('till'), {})
+        short = cart.RedisCartBackend(ttl=1, client=client)
+        short.add('old', 7, 1)
+        short.set('old', 8, 2)
+        time.sleep(1.1)
+        self.assertEqual(short.items('old'), {})
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    async def test_redis_backend_async_operations(self):
+        backend = cart.RedisCartBackend(ttl=60, client=fakeredis.FakeRedis())
+        self.assertEqual(await backend.aadd('till', 7, 3), 3)
+        await backend.aset('till', 8, 1)
+        self.assertEqual(await backend.aitems('till'), {7: 3, 8: 1})
+        await backend.aclear('till')
+        self.assertEqual(await backend.aitems('till'), {})
+
+
+# Fan-out backend that also remembers what was published
+class RecordingFanout(events.LocalFanout):
+    published = []
+
+    def publish(self, kind, data):
+        self.published.append((kind, data))
+        super().publish(kind, data)
+
+
+@override_settings(POS_EVENTS={'BACKEND': 'pos_app.tests.RecordingFanout', 'HEARTBEAT': 5})
+class EventStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cashier = User.objects.create_user('till6', password='pw')
+        category = Category.objects.create(name='Dairy')
+        cls.product = Product.objects.create(name='Milk', category=category, price=Decimal('1.50'),
+                                             stock_quantity=9, barcode='7801')
+
+    def setUp(self):
+        catalog.clear()
+        events.reset_broker()
+        self.addCleanup(events.reset_broker)
+        RecordingFanout.published.clear()
+
+    def test_product_saves_and_sales_publish_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('1.75')
+            self.product.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            sale = checkout(self.cashier, {self.product.pk: 2})
+        self.assertEqual(RecordingFanout.published, [
+            ('product', {'id': self.product.pk, 'name': 'Milk', 'barcode': '7801', 'price': '1.75', 'stock': 9}),
+            ('stock', {'sale': sale.pk, 'stock': {str(self.product.pk): 7}}),
+        ])
+
+    def test_stream_needs_asgi(self):
+        self.client.force_login(self.cashier)
+        self.assertEqual(self.client.get(reverse('pos_app:event_stream')).status_code, 501)
+
+    async def test_stream_replays_missed_events_then_pushes_live_ones(self):
+        await self.async_client.aforce_login(self.cashier)
+        broker = events.get_broker()
+        broker.dispatch('stock', {'sale': 1, 'stock': {'5': 3}})
+        response = await self.async_client.get(reverse('pos_app:event_stream'), headers={'Last-Event-ID': '0'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        self.assertEqual(await anext(content), b'retry: 3000\n\n')
+        self.assertEqual(await anext(content), b'id: 1\nevent: stock\ndata: {"sale":1,"stock":{"5":3}}\n\n')
+        # Events are dispatched from request threads, not the stream's event loop
+        await sync_to_async(broker.dispatch, thread_sensitive=False)('product_removed', {'id': 5})
+        self.assertEqual(await anext(content), b'id: 2\nevent: product_removed\ndata: {"id":5}\n\n')
+        await content.aclose()
+
+    async def test_unknown_or_expired_event_ids_reset_the_till(self):
+        broker = events.Broker(backend=events.LocalFanout(), history=2)
+        for n in range(4):
+            broker.dispatch('stock', {'n': n})
+        _, missed = broker.subscribe(2)
+        self.assertEqual([event.id for event in missed], [3, 4])
+        _, missed = broker.subscribe(1)
+        self.assertEqual(missed, [events.Event(4, 'reset', {})])
+        _, missed = broker.subscribe(99)
+        self.assertEqual(missed[0].kind, 'reset')
+        # A closed stream unsubscribes its till
+        stream = events.stream()
+        await anext(stream)
+        self.assertEqual(len(events.get_broker()), 1)
+        await stream.aclose()
+        self.assertEqual(len(events.get_broker()), 0)
+
+    @skipUnless(fakeredis, 'fakeredis is not installed')
+    async def test_redis_fanout_reaches_the_tills_of_every_process(self):
+        # Two workers' brokers on one Redis server
+        server = fakeredis.FakeServer()
+        publisher = events.Broker(backend=events.RedisFanout(client=fakeredis.FakeRedis(server=server)))
+        receiver = events.Broker(backend=events.RedisFanout(client=fakeredis.FakeRedis(server=server)))
+        subscriptions = [publisher.subscribe()[0], receiver.subscribe()[0]]
+        publisher.publish('stock', {'sale': 7, 'stock': {'5': 2}})
+        for subscription in subscriptions:
+            self.assertEqual(await subscription.get(5), events.Event(1, 'stock', {'sale': 7, 'stock': {'5': 2}}))
+
+
+class CheckoutLoadTests(TransactionTestCase):
+    # Regression gate: concurrent tills must never oversell or lose stock updates, and a
+    # checkout must cost the same number of queries whatever the basket size
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_concurrent_checkouts_keep_stock_consistent(self):
+        report = benchmark.run(products=6, cashiers=3, baskets=4, items_per_basket=3, stock=5, report_every=2)
+        self.assertEqual(report['anomalies']['oversold'], [])
+        self.assertEqual(report['anomalies']['lost_updates'], [])
+        self.assertEqual(report['anomalies']['missing_sales'], [])
+        self.assertGreater(report['confirmed_sales'], 0)
+        self.assertIn('sales_report', report['endpoints'])
+
+    def test_regressions_compare_against_baseline(self):
+        report = {
+            'checkouts_per_second': 10.0,
+            'endpoints': {'sale_confirm': {'p95_ms': 50.0, 'max_queries': 20, 'errors': 0}},
+            'anomalies': {'oversold': [], 'lost_updates': [{'product_id': 1}]},
+        }
+        baseline = {
+            'checkouts_per_second': 20.0,
+            'endpoints': {'sale_confirm': {'p95_ms': 20.0, 'max_queries': 18, 'errors': 0}},
+        }
+        problems = benchmark.regressions(report, baseline)
+        self.assertEqual(len(problems), 4)
+        self.assertEqual(benchmark.percentile([5, 1, 4, 2, 3], 50), 3)
+
+
+class SQLiteProfileTests(TestCase):
+    # The performance profile's pragmas are applied to every new connection
+    def test_connection_pragmas_and_immediate_transactions(self):
+        if connection.vendor != 'sqlite' or 'init_command' not in connection.settings_dict['OPTIONS']:
+            self.skipTest('SQLite performance profile not in use')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+@override_settings(POS_INSTRUMENTATION={'ENABLED': True, 'N_PLUS_ONE_THRESHOLD': 3, 'DUMP_DIR': None})
+class InstrumentationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('boss', 'boss@example.com', 'pw')
+        for n in range(4):
+            make_sale(cls.admin, '10.00')
+
+    def setUp(self):
+        instrumentation.registry.reset()
+        self.client.force_login(self.admin)
+
+    def test_server_timing_header_and_registry(self):
+        response = self.client.get(reverse('pos_app:sales_report'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        stats = instrumentation.registry.snapshot()['views']['pos_app:sales_report']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['samples'][0][1], 0)
+
+    def test_repeated_query_shapes_are_logged_with_their_call_site(self):
+        def n_plus_one_view(request):
+            for sale in Sale.objects.all():
+                sale.user.username
+            return HttpResponse('ok')
+
+        request = RequestFactory().get('/')
+        middleware = instrumentation.QueryInstrumentationMiddleware(n_plus_one_view)
+        with self.assertLogs('pos_app.instrumentation', 'WARNING') as logs:
+            middleware(request)
+        self.assertTrue(any('4 x SELECT' in line and 'n_plus_one_view' in line for line in logs.output))
+
+    def test_checkout_savepoints_are_not_reported_as_n_plus_one(self):
+        category = Category.objects.create(name='Tools')
+        products = [Product.objects.create(name=f'Tool {n}', category=category, price=Decimal('1.00'),
+                                           stock_quantity=5, barcode=f'600{n}') for n in range(6)]
+
+        def checkout_view(request):
+            checkout(self.admin, {str(product.pk): 1 for product in products})
+            return HttpResponse('ok')
+
+        middleware = instrumentation.QueryInstrumentationMiddleware(checkout_view)
+        with self.assertNoLogs('pos_app.instrumentation', 'WARNING'):
+            middleware(RequestFactory().get('/'))
+
+    def test_fingerprint_collapses_values(self):
+        self.assertEqual(
+            instrumentation.fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'x' LIMIT 21"),
+            instrumentation.fingerprint("SELECT * FROM t WHERE id IN (%s) AND name = 'y' LIMIT 5"),
+        )
+
+
+class AdminChangelistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('manager', 'manager@example.com', 'pw')
+        cls.category = Category.objects.create(name='Hardware')
+        cls.products = [
+            Product.objects.create(name=f'Tool {n}', category=cls.category, price=Decimal('2.00'),
+                                   stock_quantity=n + 10, barcode=f'700{n}')
+            for n in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _changelist_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        checkout(self.admin, {str(self.products[0].pk): 1})
+        urls = ['admin:pos_app_sale_changelist', 'admin:pos_app_saleitem_changelist',
+                'admin:pos_app_category_changelist', 'pos_admin:pos_app_sale_changelist']
+        before = {url: self._changelist_queries(url) for url in urls}
+        for n in range(5):
+            checkout(self.admin, {str(p.pk): 1 for p in self.products[:2]})
+            Category.objects.create(name=f'Extra {n}')
+        after = {url: self._changelist_queries(url) for url in urls}
+        self.assertEqual(before, after)
+
+    def test_category_total_value_is_sum_of_price_times_stock(self):
+        checkout(self.admin, {str(self.products[0].pk): 4})
+        response = self.client.get(reverse('admin:pos_app_category_changelist'))
+        category = response.context['cl'].result_list[0]
+        # 2.00 * (6 + 11 + 12): the exact stock, not the last compacted level
+        self.assertEqual(category._total_value, Decimal('58.00'))
+        self.assertEqual(category._product_count, 3)
+
+    def test_stock_columns_and_filter_use_the_exact_stock(self):
+        stock.set_levels({self.products[0].pk: 0})
+        stock.compact()
+        checkout(self.admin, {str(self.products[1].pk): 11})
+        response = self.client.get(reverse('admin:pos_app_product_changelist'), {'stock': 'out'})
+        self.assertEqual({product.pk for product in response.context['cl'].result_list},
+                         {self.products[0].pk, self.products[1].pk})
+        response = self.client.get(reverse('admin:pos_app_inventory_changelist'))
+        levels = {row.product_id: row._current_stock for row in response.context['cl'].result_list}
+        self.assertEqual(levels[self.products[1].pk], 0)
+
+    def test_estimated_paginator_skips_count_for_large_unfiltered_tables(self):
+        with self.settings():
+            original = pagination.ESTIMATE_THRESHOLD
+            pagination.ESTIMATE_THRESHOLD = 1
+            try:
+                paginator = pagination.EstimatedCountPaginator(Product.objects.order_by('pk'), 2)
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(paginator.count, Product.objects.order_by('-pk').first().pk)
+                self.assertNotIn('COUNT', queries[0]['sql'])
+                filtered = pagination.EstimatedCountPaginator(
+                    Product.objects.filter(stock_quantity__gt=10).order_by('pk'), 2)
+                self.assertEqual(filtered.count, 2)
+            finally:
+                pagination.ESTIMATE_THRESHOLD = original
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cashier', password='pw')
+        cls.category = Category.objects.create(name='Bakery')
+        cls.products = [
+            Product.objects.create(name=f'Bread {n}', category=cls.category, price=Decimal('1.50'),
+                                   stock_quantity=20, barcode=f'900{n}')
+            for n in range(2)
+        ]
+
+    def setUp(self):
+        pagecache.get_cache().clear()
+        self.client.force_login(self.user)
+
+    def test_repeat_loads_only_look_up_the_user(self):
+        urls = [reverse('pos_app:home'), reverse('pos_app:product_list'), reverse('pos_app:sale_process'),
+                reverse('pos_app:product_detail', args=[self.products[0].pk])]
+        for url in urls:
+            self.client.get(url)
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([q['sql'] for q in queries if 'auth_user' not in q['sql']], [], url)
+        self.assertContains(response, 'Bread 0')
+
+    def test_unchanged_pages_are_not_modified(self):
+        url = reverse('pos_app:product_detail', args=[self.products[0].pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        product = self.products[0]
+        product.price = Decimal('2.25')
+        product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '2.25')
+
+    def test_changes_rebuild_cached_fragments(self):
+        self.client.get(reverse('pos_app:sale_process'))
+        self.category.name = 'Pastry'
+        self.category.save()
+        checkout(self.user, {str(self.products[1].pk): 3})
+        response = self.client.get(reverse('pos_app:sale_process'))
+        self.assertContains(response, 'Pastry')
+        self.assertContains(response, '<span data-stock>17</span>', html=False)
+        self.assertNotContains(response, 'Bakery')
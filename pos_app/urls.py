@@ -13,20 +13,44 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     # Product list page - requires login
     path('products/', views.product_list, name='product_list'),
+    # Product list as an infinite-scroll JSON feed - requires login
+    path('products/feed/', views.product_feed, name='product_feed'),
     # Individual product detail page - requires login
     path('products/<int:pk>/', views.product_detail, name='product_detail'),
     # Sale processing page - requires login
     path('sale/', views.sale_process, name='sale_process'),
+    # Product search autocomplete (JSON) - requires login
+    path('sale/search/', views.product_search, name='product_search'),
     # Add product to cart - requires login
     path('sale/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
+    # Add product to cart by exact barcode - requires login
+    path('sale/scan/', views.scan_barcode, name='scan_barcode'),
+    # Add a queue of scanned barcodes to cart in one request - requires login
+    path('sale/scan/batch/', views.scan_batch, name='scan_batch'),
+    # Change a cart line's quantity (delta or exact) - requires login
+    path('sale/update/<int:product_id>/', views.update_cart, name='update_cart'),
     # Remove product from cart - requires login
     path('sale/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     # Clear entire cart - requires login
     path('sale/clear/', views.clear_cart, name='clear_cart'),
     # Sale confirmation page - requires login
     path('sale/confirm/', views.sale_confirm, name='sale_confirm'),
+    # Check out the cart and return the sale as JSON - requires login
+    path('sale/checkout/', views.checkout_api, name='checkout_api'),
+    # Record a batch of sales queued by an offline till (JSON, idempotent per sale) - requires login
+    path('sale/ingest/', views.ingest_sales, name='ingest_sales'),
+    # Live stock and price changes (Server-Sent Events, ASGI only) - requires login
+    path('sale/events/', views.event_stream, name='event_stream'),
     # Sale detail page - requires login
     path('sale/<int:pk>/', views.sale_detail, name='sale_detail'),
     # Sales reports page - requires login
     path('reports/sales/', views.sales_report, name='sales_report'),
+    # Sales as an infinite-scroll JSON feed - requires login
+    path('reports/sales/feed/', views.sales_feed, name='sales_feed'),
+    # Reorder report from the precomputed demand forecasts - requires login
+    path('reports/reorder/', views.reorder_report, name='reorder_report'),
+    # Progress and result of a background job (page, or JSON with ?format=json) - requires login
+    path('jobs/<int:pk>/', views.job_status, name='job_status'),
+    # Result file of a finished background job - requires login
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
 ]
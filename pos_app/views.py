@@ -1,45 +1,164 @@
 # Import necessary Django modules and functions for views
+import json
+import os
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db import transaction, models
-from django.http import JsonResponse
+from django.db import IntegrityError
+from django.db.models import Count, Q
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.urls import reverse
-from .models import Product, Category, Sale, SaleItem
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import require_POST
+from .models import Product, Category, Sale, Job, StockForecast
+from .checkout import checkout, ingest, CheckoutError, REJECTED
+from .cart import Cart
+from .catalog import catalog
+from . import analytics, events, exports, jobs, pagecache, receipts, replicas, reports, search, stock
+from .pagination import keyset_paginate
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 
+# Maximum number of barcodes accepted by one batch scan request
+SCAN_BATCH_LIMIT = 200
+# Maximum number of sales accepted by one offline ingestion request
+INGEST_BATCH_LIMIT = 500
+# Seconds between analytics refreshes queued by the sales report while the store is behind
+ANALYTICS_REFRESH_INTERVAL = 60
+
+# Keyset orderings for the paged listings (each ends in pk so rows have a unique position)
+PRODUCT_ORDERING = ('name', 'pk')
+SALE_ORDERING = ('-created_at', '-pk')
+# Reorder report: out of stock first ('out' sorts before 'reorder'), then least days of cover
+REORDER_ORDERING = ('status', 'days_of_cover', 'pk')
+
+# Dashboard figures for the home page
+def _dashboard():
+    # Get sales statistics from the daily rollup instead of loading every row
+    totals = reports.rollup_totals({})
+    return {
+        'product_count': Product.objects.count(),
+        'category_count': Category.objects.count(),
+        'sale_count': totals['count'],
+        'total_sales': totals['total'],
+        # Only the few most recent sales are shown in the activity feed
+        'recent_sales': list(Sale.objects.select_related('user').order_by('-created_at')[:5]),
+    }
+
 # View for the home page - accessible to all users
 def home(request):
-    # Get statistics for the dashboard
-    products = Product.objects.all()
-    categories = Category.objects.all()
-    sales = Sale.objects.all()
-    total_sales = sum(sale.total_amount for sale in sales)
-
+    # Dashboard figures are cached until a product, category or sale changes
+    dashboard = pagecache.get_or_set('home', pagecache.versions('catalog', 'categories', 'sales'), _dashboard)
     # Render the home template with statistics
-    return render(request, 'pos_app/home.html', {
-        'products': products,
-        'categories': categories,
-        'sales': sales,
-        'total_sales': total_sales
-    })
+    return render(request, 'pos_app/home.html', dashboard)
+
+# One page of products (with their categories) after the cursor, with exact stock levels from the ledger
+def _product_page(cursor, category_id=None):
+    products = Product.objects.select_related('category')
+    if category_id is not None:
+        products = products.filter(category_id=category_id)
+    page = keyset_paginate(products, PRODUCT_ORDERING, cursor)
+    stock.refresh(page.items)
+    return page
+
+# Inventory statistics for the product list cards, counted in one query from the exact stock levels (the same
+# levels the product rows show)
+def _product_stats():
+    return Product.objects.annotate(current=stock.current_stock_expression()).aggregate(
+        total=Count('pk'),
+        in_stock=Count('pk', filter=Q(current__gt=0)),
+        low_stock=Count('pk', filter=Q(current__gt=0, current__lte=10)),
+    )
 
 # View for displaying list of products - requires user login
 @login_required
 def product_list(request):
-    # Get all products from database
-    products = Product.objects.all()
-    # Render product list template with products data
-    return render(request, 'pos_app/product_list.html', {'products': products})
+    cursor = request.GET.get('cursor')
+    current = pagecache.versions('catalog', 'categories', 'stock')
+
+    def render_page():
+        # The queries run only when the cached product grid fragment is missing or stale
+        page = SimpleLazyObject(lambda: _product_page(cursor))
+        return render(request, 'pos_app/product_list.html', {
+            'products': SimpleLazyObject(lambda: page.items),
+            'page': page,
+            'pager_query': _pager_query(request),
+            'page_cursor': cursor or '',
+            'stats': SimpleLazyObject(_product_stats),
+            'category_count': SimpleLazyObject(Category.objects.count),
+            **pagecache.fragment_context(current),
+        })
+
+    # Repeat loads of an unchanged catalog are answered with 304 Not Modified
+    return pagecache.conditional_response(request, [current, cursor], pagecache.last_modified(current), render_page)
+
+# Product with its category and exact stock level, or None if it does not exist
+def _product_detail(pk):
+    product = Product.objects.select_related('category').filter(pk=pk).first()
+    if product is not None:
+        stock.refresh([product])
+    return product
 
 # View for displaying individual product details - requires user login
 @login_required
 def product_detail(request, pk):
-    # Get product by primary key or return 404 if not found
-    product = get_object_or_404(Product, pk=pk)
+    current = pagecache.versions('catalog', 'categories', 'stock')
+    # Get the product from the page cache (loaded once per catalog or stock change), or 404
+    product = pagecache.get_or_set(f'product:{pk}', current, lambda: _product_detail(pk))
+    if product is None:
+        raise Http404('No product matches the given query.')
+    # The page changes with the product itself, its category name or its stock level
+    shown = {'categories': current['categories'], 'stock': current['stock']}
+    modified = max(product.updated_at, pagecache.last_modified(shown))
     # Render product detail template with product data
-    return render(request, 'pos_app/product_detail.html', {'product': product})
+    return pagecache.conditional_response(
+        request, [pk, product.updated_at, shown], modified,
+        lambda: render(request, 'pos_app/product_detail.html', {'product': product}),
+    )
+
+# Current query string without the page cursor, for building pager links
+def _pager_query(request):
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    return query.urlencode()
+
+# Cached product snapshot for the till, or 404 if the product does not exist
+def _cached_product(product_id):
+    product = catalog.get(product_id)
+    if product is None:
+        raise Http404('No product matches the given query.')
+    return product
+
+# Async variant for the ASGI cart views
+async def _acached_product(product_id):
+    product = await catalog.aget(product_id)
+    if product is None:
+        raise Http404('No product matches the given query.')
+    return product
+
+# Cart lines (product snapshot, quantity, subtotal) and cart total, using the catalog cache
+def _cart_lines(cart):
+    # Look up every product in the cart at once; products deleted since they were added are skipped
+    products = catalog.get_many(cart.keys())
+    cart_items = []
+    total = 0
+    for product_id, quantity in cart.items():
+        product = products.get(product_id)
+        if product is None:
+            continue
+        subtotal = product.price * quantity
+        total += subtotal
+        cart_items.append({
+            'product': product,
+            'quantity': quantity,
+            'subtotal': subtotal
+        })
+    return cart_items, total
 
 # View for processing sales transactions - requires user login
 @login_required
@@ -48,62 +167,25 @@ def sale_process(request):
     if request.method == 'POST':
         # Check if this is a confirmation request
         if 'confirm_sale' in request.POST:
-            # Get cart from session
-            cart = request.session.get('cart', {})
+            # Get this till's cart
+            cart = Cart(request)
+            items = cart.items()
             # Check if cart is empty
-            if not cart:
+            if not items:
                 messages.error(request, 'Cart is empty')
                 return redirect('pos_app:sale_process')
 
-            # Initialize variables for sale calculation
-            total_amount = 0
-            sale_items = []
-
-            # Process each item in cart
-            for product_id, quantity in cart.items():
-                # Get product or return 404
-                product = get_object_or_404(Product, pk=product_id)
-                # Check stock availability
-                if product.stock_quantity < quantity:
-                    messages.error(request, f'Insufficient stock for {product.name}')
-                    return redirect('pos_app:sale_process')
-                # Calculate prices
-                unit_price = product.price
-                total_price = unit_price * quantity
-                total_amount += total_price
-                # Add item to sale items list
-                sale_items.append({
-                    'product': product,
-                    'quantity': quantity,
-                    'unit_price': unit_price,
-                    'total_price': total_price
-                })
-
-            # Use database transaction for atomicity
-            with transaction.atomic():
-                # Create sale record
-                sale = Sale.objects.create(
-                    user=request.user,
-                    total_amount=total_amount,
-                    payment_method=request.POST.get('payment_method', 'cash')
-                )
-                # Create sale items and update stock
-                for item in sale_items:
-                    SaleItem.objects.create(
-                        sale=sale,
-                        product=item['product'],
-                        quantity=item['quantity'],
-                        unit_price=item['unit_price'],
-                        total_price=item['total_price']
-                    )
-                    # Reduce product stock
-                    item['product'].stock_quantity -= item['quantity']
-                    item['product'].save()
-
-            # Clear cart from session
-            request.session['cart'] = {}
+            # Commit the sale: stock is checked and decremented atomically by the checkout service
+            try:
+                sale = checkout(request.user, items, request.POST.get('payment_method', 'cash'))
+            except CheckoutError as error:
+                messages.error(request, str(error))
+                return redirect('pos_app:sale_process')
+
+            # Clear the till's cart
+            cart.clear()
             # Show success message
-            messages.success(request, f'Sale completed successfully! Total: ₱{total_amount}')
+            messages.success(request, f'Sale completed successfully! Total: ₱{sale.total_amount}')
             # Redirect to sale detail page
             return redirect('pos_app:sale_detail', pk=sale.pk)
         elif 'show_confirmation' in request.POST:
@@ -116,31 +198,29 @@ def sale_process(request):
     search_query = request.GET.get('search', '').strip()
 
     # Filter products based on category and search
-    products = Product.objects.all()
-    if category_id and category_id != 'None' and category_id.isdigit():
-        products = products.filter(category_id=int(category_id))
+    selected_category_id = int(category_id) if category_id and category_id.isdigit() else None
+    search_page = None
+    product_page = None
+    current = pagecache.versions('catalog', 'categories', 'stock')
     if search_query:
-        products = products.filter(
-            models.Q(name__icontains=search_query) | models.Q(barcode__icontains=search_query)
-        )
+        # Ranked full-text search with prefix and typo matching, one page at a time
+        page_number = request.GET.get('page', '1')
+        page_number = int(page_number) if page_number.isdigit() else 1
+        search_page = search.search(search_query, selected_category_id, page_number)
+        products = search_page.products
+        # Show exact stock levels from the ledger
+        stock.refresh(products)
+    else:
+        # One page of products in name order; only queried when the cached product grid fragment is stale
+        cursor = request.GET.get('cursor')
+        product_page = SimpleLazyObject(lambda: _product_page(cursor, selected_category_id))
+        products = SimpleLazyObject(lambda: product_page.items)
 
-    # Get all categories for dropdown
-    categories = Category.objects.all()
+    # Get all categories for the dropdown from the catalog cache, when its fragment is stale
+    categories = SimpleLazyObject(catalog.categories)
 
-    # Get cart from session
-    cart = request.session.get('cart', {})
-    # Prepare cart items for display
-    cart_items = []
-    total = 0
-    for product_id, quantity in cart.items():
-        product = get_object_or_404(Product, pk=product_id)
-        subtotal = product.price * quantity
-        total += subtotal
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'subtotal': subtotal
-        })
+    # Prepare this till's cart items for display
+    cart_items, total = _cart_lines(Cart(request).items())
 
     # Render sale process template with data
     return render(request, 'pos_app/sale_process.html', {
@@ -148,39 +228,65 @@ def sale_process(request):
         'categories': categories,
         'selected_category': category_id,
         'search_query': search_query,
+        'search_page': search_page,
+        'page': product_page,
+        'pager_query': _pager_query(request),
+        'page_cursor': request.GET.get('cursor', ''),
         'cart_items': cart_items,
-        'total': total
+        'total': total,
+        'categories_version': current['categories'],
+        **pagecache.fragment_context(current),
     })
 
-# View for adding products to cart - requires user login
+# Autocomplete for the sale page search box: ranked matches as JSON - requires user login
 @login_required
-def add_to_cart(request, product_id):
+def product_search(request):
+    query = request.GET.get('q', '').strip()
+    category_id = request.GET.get('category', '')
+    limit = request.GET.get('limit', '10')
+    limit = min(int(limit), 50) if limit.isdigit() else 10
+    # Ranked ids from the search index, product details from the catalog cache
+    ids, corrected = search.search_ids(query, int(category_id) if category_id.isdigit() else None, limit)
+    products = catalog.get_many(ids)
+    return JsonResponse({
+        'results': [
+            {
+                'id': product.pk,
+                'name': product.name,
+                'barcode': product.barcode,
+                'category': product.category_name,
+                'price': str(product.price),
+                'stock_quantity': product.stock_quantity,
+            }
+            for product in (products.get(pk) for pk in ids) if product is not None
+        ],
+        'corrected': corrected
+    })
+
+# View for adding products to cart - requires user login.
+# The cart views are async: under ASGI they run on the event loop instead of a worker thread each.
+@login_required
+async def add_to_cart(request, product_id):
     # Check if this is an AJAX request
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        # Get product or return 404
-        product = get_object_or_404(Product, pk=product_id)
-        # Get cart from session
-        cart = request.session.get('cart', {})
-        # Increment product quantity in cart
-        cart[str(product_id)] = cart.get(str(product_id), 0) + 1
-        # Save cart back to session
-        request.session['cart'] = cart
+        # Get product from the catalog cache or return 404
+        product = await _acached_product(product_id)
+        # Increment product quantity in this till's cart
+        cart = await Cart.afor_request(request)
+        quantity = await cart.aadd(product.pk)
         # Return JSON response for AJAX
         return JsonResponse({
             'success': True,
             'message': f'{product.name} added to cart',
-            'cart_count': len(cart)
+            'quantity': quantity,
+            'cart_count': len(await cart.aitems())
         })
     else:
         # Fallback for non-AJAX requests
-        # Get product or return 404
-        product = get_object_or_404(Product, pk=product_id)
-        # Get cart from session
-        cart = request.session.get('cart', {})
-        # Increment product quantity in cart
-        cart[str(product_id)] = cart.get(str(product_id), 0) + 1
-        # Save cart back to session
-        request.session['cart'] = cart
+        # Get product from the catalog cache or return 404
+        product = await _acached_product(product_id)
+        # Increment product quantity in this till's cart
+        await (await Cart.afor_request(request)).aadd(product.pk)
         # Redirect back to sale process page with current filters and item_added parameter for toast
         category = request.GET.get('category', '')
         search = request.GET.get('search', '')
@@ -194,23 +300,144 @@ def add_to_cart(request, product_id):
         query_string = '?' + '&'.join(params) if params else ''
         return redirect(base_url + query_string)
 
+# Add one unit per scanned barcode to the till's cart; returns the changed cart lines, unknown barcodes and cart
+def _scan_into_cart(request, barcodes):
+    # Exact-match lookup through the catalog cache (one indexed query for the misses)
+    products = catalog.get_many_by_barcode(barcodes)
+    scanned = {}
+    counts = {}
+    not_found = []
+    for barcode in barcodes:
+        product = products.get(barcode)
+        if product is None:
+            not_found.append(barcode)
+            continue
+        scanned[product.pk] = product
+        counts[product.pk] = counts.get(product.pk, 0) + 1
+    # One increment per distinct product
+    cart = Cart(request)
+    quantities = {product_id: cart.add(product_id, count) for product_id, count in counts.items()}
+    # Only the lines touched by this scan are sent back to the till
+    lines = [
+        {
+            'product_id': product.pk,
+            'barcode': product.barcode,
+            'name': product.name,
+            'price': str(product.price),
+            'quantity': quantities[product.pk],
+            'subtotal': str(product.price * quantities[product.pk]),
+        }
+        for product in scanned.values()
+    ]
+    return lines, not_found, cart.items()
+
+# View for adding a product to the cart by its exact barcode - requires user login
+@login_required
+@require_POST
+def scan_barcode(request):
+    barcode = request.POST.get('barcode', '').strip()
+    lines, not_found, cart = _scan_into_cart(request, [barcode])
+    # Check if this is an AJAX request
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if not lines:
+            return JsonResponse({
+                'success': False,
+                'message': f'No product with barcode {barcode}',
+                'not_found': not_found,
+                'cart_count': len(cart)
+            }, status=404)
+        # Return the cart delta for AJAX
+        return JsonResponse({
+            'success': True,
+            'message': f'{lines[0]["name"]} added to cart',
+            'lines': lines,
+            'cart_count': len(cart)
+        })
+    # Fallback for non-AJAX requests (scanner typing into the scan form)
+    if lines:
+        messages.success(request, f'{lines[0]["name"]} added to cart')
+    else:
+        messages.error(request, f'No product with barcode {barcode}')
+    return redirect('pos_app:sale_process')
+
+# View for adding a queue of scanned barcodes to the cart in one request - requires user login
+@login_required
+@require_POST
+def scan_batch(request):
+    # Accept a JSON body {"barcodes": [...]} or repeated form fields named barcode
+    if request.content_type == 'application/json':
+        try:
+            barcodes = json.loads(request.body or b'{}').get('barcodes', [])
+        except (ValueError, AttributeError):
+            return JsonResponse({'success': False, 'message': 'Invalid JSON body'}, status=400)
+    else:
+        barcodes = request.POST.getlist('barcode')
+    if not isinstance(barcodes, list) or not all(isinstance(barcode, str) for barcode in barcodes):
+        return JsonResponse({'success': False, 'message': 'barcodes must be a list of strings'}, status=400)
+    if len(barcodes) > SCAN_BATCH_LIMIT:
+        return JsonResponse({
+            'success': False,
+            'message': f'At most {SCAN_BATCH_LIMIT} barcodes can be scanned per request'
+        }, status=400)
+
+    lines, not_found, cart = _scan_into_cart(request, [barcode.strip() for barcode in barcodes])
+    # Return the cart delta; unknown barcodes are reported but do not fail the batch
+    return JsonResponse({
+        'success': not not_found,
+        'lines': lines,
+        'not_found': not_found,
+        'cart_count': len(cart)
+    })
+
+# View for changing a cart line by a delta (+1/-1) or to an exact quantity - requires user login
+@login_required
+@require_POST
+def update_cart(request, product_id):
+    # Read either an exact quantity or a signed delta
+    try:
+        if 'quantity' in request.POST:
+            quantity, delta = int(request.POST['quantity']), None
+            if quantity < 0:
+                raise ValueError
+        else:
+            quantity, delta = None, int(request.POST.get('delta', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Send a whole-number delta or quantity'}, status=400)
+    # Only existing products can be put into the cart
+    adding = delta > 0 if quantity is None else quantity > 0
+    if adding and catalog.get(product_id) is None:
+        raise Http404('No product matches the given query.')
+    cart = Cart(request)
+    if quantity is None:
+        quantity = cart.add(product_id, delta)
+    else:
+        cart.set(product_id, quantity)
+    # Check if this is an AJAX request
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        return JsonResponse({
+            'success': True,
+            'product_id': product_id,
+            'quantity': quantity,
+            'cart_count': len(cart.items())
+        })
+    # Fallback for non-AJAX requests
+    return redirect('pos_app:sale_process')
+
 # View for removing products from cart - requires user login
 @login_required
-def remove_from_cart(request, product_id):
+async def remove_from_cart(request, product_id):
     # Check if this is an AJAX request
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        # Get cart from session
-        cart = request.session.get('cart', {})
+        # Get this till's cart
+        cart = await Cart.afor_request(request)
         # Remove product from cart if it exists
-        if str(product_id) in cart:
-            del cart[str(product_id)]
-            # Save updated cart to session
-            request.session['cart'] = cart
+        if product_id in await cart.aitems():
+            await cart.aremove(product_id)
             # Return JSON response for AJAX
             return JsonResponse({
                 'success': True,
                 'message': 'Item removed from cart',
-                'cart_count': len(cart)
+                'cart_count': len(await cart.aitems())
             })
         else:
             return JsonResponse({
@@ -219,13 +446,11 @@ def remove_from_cart(request, product_id):
             })
     else:
         # Fallback for non-AJAX requests
-        # Get cart from session
-        cart = request.session.get('cart', {})
+        # Get this till's cart
+        cart = await Cart.afor_request(request)
         # Remove product from cart if it exists
-        if str(product_id) in cart:
-            del cart[str(product_id)]
-            # Save updated cart to session
-            request.session['cart'] = cart
+        if product_id in await cart.aitems():
+            await cart.aremove(product_id)
             # Show success message
             messages.success(request, 'Item removed from cart')
         # Redirect back to sale process page with current filters
@@ -235,11 +460,11 @@ def remove_from_cart(request, product_id):
 
 # View for clearing the entire cart - requires user login
 @login_required
-def clear_cart(request):
+async def clear_cart(request):
     # Check if this is an AJAX request
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        # Clear cart from session
-        request.session['cart'] = {}
+        # Clear this till's cart
+        await (await Cart.afor_request(request)).aclear()
         # Return JSON response for AJAX
         return JsonResponse({
             'success': True,
@@ -248,8 +473,8 @@ def clear_cart(request):
         })
     else:
         # Fallback for non-AJAX requests
-        # Clear cart from session
-        request.session['cart'] = {}
+        # Clear this till's cart
+        await (await Cart.afor_request(request)).aclear()
         # Show success message
         messages.success(request, 'Cart cleared successfully')
         # Redirect back to sale process page
@@ -258,108 +483,294 @@ def clear_cart(request):
 # View for sale confirmation - requires user login
 @login_required
 def sale_confirm(request):
-    # Get cart from session
-    cart = request.session.get('cart', {})
+    # Get this till's cart
+    cart = Cart(request)
+    items = cart.items()
     # Check if cart is empty
-    if not cart:
+    if not items:
         messages.error(request, 'Cart is empty')
         return redirect('pos_app:sale_process')
 
-    # Prepare cart items for display
-    cart_items = []
-    total = 0
-    for product_id, quantity in cart.items():
-        product = get_object_or_404(Product, pk=product_id)
-        subtotal = product.price * quantity
-        total += subtotal
-        cart_items.append({
-            'product': product,
-            'quantity': quantity,
-            'subtotal': subtotal
-        })
-
     # Handle POST request for confirming sale
     if request.method == 'POST':
-        # Process the sale
-        total_amount = 0
-        sale_items = []
-
-        # Process each item in cart
-        for product_id, quantity in cart.items():
-            # Get product or return 404
-            product = get_object_or_404(Product, pk=product_id)
-            # Check stock availability
-            if product.stock_quantity < quantity:
-                messages.error(request, f'Insufficient stock for {product.name}')
-                return redirect('pos_app:sale_process')
-            # Calculate prices
-            unit_price = product.price
-            total_price = unit_price * quantity
-            total_amount += total_price
-            # Add item to sale items list
-            sale_items.append({
-                'product': product,
-                'quantity': quantity,
-                'unit_price': unit_price,
-                'total_price': total_price
-            })
+        # Commit the sale: stock is checked and decremented atomically by the checkout service
+        try:
+            sale = checkout(request.user, items, request.POST.get('payment_method', 'cash'))
+        except CheckoutError as error:
+            messages.error(request, str(error))
+            return redirect('pos_app:sale_process')
 
-        # Use database transaction for atomicity
-        with transaction.atomic():
-            # Create sale record
-            sale = Sale.objects.create(
-                user=request.user,
-                total_amount=total_amount,
-                payment_method=request.POST.get('payment_method', 'cash')
-            )
-            # Create sale items and update stock
-            for item in sale_items:
-                SaleItem.objects.create(
-                    sale=sale,
-                    product=item['product'],
-                    quantity=item['quantity'],
-                    unit_price=item['unit_price'],
-                    total_price=item['total_price']
-                )
-                # Reduce product stock
-                item['product'].stock_quantity -= item['quantity']
-                item['product'].save()
-
-        # Clear cart from session
-        request.session['cart'] = {}
+        # Clear the till's cart
+        cart.clear()
         # Show success message
-        messages.success(request, f'Sale completed successfully! Total: ₱{total_amount}')
+        messages.success(request, f'Sale completed successfully! Total: ₱{sale.total_amount}')
         # Redirect to sale detail page
         return redirect('pos_app:sale_detail', pk=sale.pk)
 
+    # Prepare cart items for display
+    cart_items, total = _cart_lines(items)
+
     # Render confirmation template with cart data
     return render(request, 'pos_app/sale_confirm.html', {
         'cart_items': cart_items,
         'total': total
     })
 
+# JSON checkout of the till's cart for the async till client - requires user login
+@login_required
+@require_POST
+async def checkout_api(request):
+    # Accept a JSON body {"payment_method": "..."} or a form field
+    if request.content_type == 'application/json':
+        try:
+            payment_method = json.loads(request.body or b'{}').get('payment_method', 'cash')
+        except (ValueError, AttributeError):
+            return JsonResponse({'success': False, 'message': 'Invalid JSON body'}, status=400)
+    else:
+        payment_method = request.POST.get('payment_method', 'cash')
+    cart = await Cart.afor_request(request)
+    user = await request.auser()
+    # The checkout transaction cannot span awaits, so it runs as one call on the ORM's sync thread
+    try:
+        sale = await sync_to_async(checkout)(user, await cart.aitems(), payment_method)
+    except CheckoutError as error:
+        return JsonResponse({'success': False, 'message': str(error)}, status=400)
+    # Clear the till's cart
+    await cart.aclear()
+    return JsonResponse({
+        'success': True,
+        'sale_id': sale.pk,
+        'total_amount': str(sale.total_amount),
+        'receipt_url': reverse('pos_app:sale_detail', args=[sale.pk])
+    })
+
+# Record sales a till queued while it was offline, each with its own idempotency key - requires user login
+@login_required
+@require_POST
+def ingest_sales(request):
+    # Accept a JSON body {"sales": [{"key": "...", "items": {"<product id>": quantity}, "payment_method": "cash",
+    # "sold_at": "<ISO 8601>"}, ...]}
+    try:
+        sales = json.loads(request.body or b'{}').get('sales')
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'message': 'Invalid JSON body'}, status=400)
+    if not isinstance(sales, list):
+        return JsonResponse({'success': False, 'message': 'sales must be a list'}, status=400)
+    if len(sales) > INGEST_BATCH_LIMIT:
+        return JsonResponse({
+            'success': False,
+            'message': f'At most {INGEST_BATCH_LIMIT} sales can be sent per request'
+        }, status=400)
+
+    try:
+        results = ingest(request.user, sales)
+    except IntegrityError:
+        # Another request recorded one of the keys at the same moment; the retry will report it as a duplicate
+        return JsonResponse({'success': False, 'message': 'Sales were recorded concurrently, retry'}, status=409)
+    # One result per sale, in order; rejected sales are reported but do not fail the batch
+    return JsonResponse({
+        'success': all(result.status != REJECTED for result in results),
+        'results': [
+            {
+                'key': result.key,
+                'status': result.status,
+                'sale_id': result.sale.pk if result.sale else None,
+                'total_amount': str(result.sale.total_amount) if result.sale else None,
+                'message': result.message,
+            }
+            for result in results
+        ]
+    })
+
+# Server-Sent Events stream of stock and price changes for the till - requires user login
+@login_required
+async def event_stream(request):
+    # A WSGI server would buffer the endless stream instead of sending it; EventSource gives up on the error
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'success': False, 'message': 'The event stream needs an ASGI server'}, status=501)
+    # Browsers send Last-Event-ID when they reconnect
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    response = StreamingHttpResponse(
+        events.stream(int(last_event_id) if last_event_id.isdigit() else None),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 # View for displaying sale details - requires user login
 @login_required
 def sale_detail(request, pk):
-    # Get sale by primary key or return 404
-    sale = get_object_or_404(Sale, pk=pk)
+    # Get sale (with its cashier and receipt snapshot) by primary key or return 404
+    sale = get_object_or_404(Sale.objects.select_related('user'), pk=pk)
+    # Sales made before receipt snapshots read their items, products and categories in one more query
+    receipts.prefetch_legacy_items([sale])
     # Render sale detail template with sale data
-    return render(request, 'pos_app/sale_detail.html', {'sale': sale})
+    return render(request, 'pos_app/sale_detail.html', {'sale': sale, 'lines': receipts.receipt_lines(sale)})
 
 # View for displaying sales reports - requires user login
 @login_required
+@replicas.reporting()
 def sales_report(request):
-    # Get all sales ordered by creation date (newest first)
-    sales = Sale.objects.all().order_by('-created_at')
-    # Calculate total sales amount
-    total_sales = sum(sale.total_amount for sale in sales)
-    # Calculate average sale amount
-    average_sale = total_sales / len(sales) if sales else 0
+    # Read the filters submitted from the report form
+    filters = reports.parse_report_filters(request.GET)
+    # Exports are written by a background job; the job page offers the file when it is ready
+    export_format = request.GET.get('export', '')
+    if export_format in exports.EXPORT_FORMATS:
+        job = jobs.enqueue('export_sales', {'format': export_format, 'filters': reports.filter_params(filters)},
+                           user=request.user, version=_latest_sale_id(), private=True)
+        return redirect('pos_app:job_status', pk=job.pk)
+    # Get one page of filtered sales, newest first, with the cashier joined in (receipts are not listed)
+    page = keyset_paginate(reports.filter_sales(Sale.objects.select_related('user').defer('receipt'), filters),
+                           SALE_ORDERING, request.GET.get('cursor'))
+    # Totals, breakdowns and best sellers come from a background job per set of filters, reused for its ttl.
+    # Once it expires, the last result is shown while a new job recomputes it (stale-while-revalidate).
+    summary_params = {'filters': reports.filter_params(filters)}
+    job = jobs.enqueue('sales_summary', summary_params, user=request.user)
+    done = job if job.status == Job.DONE else jobs.latest_done('sales_summary', summary_params)
+    if done is not None:
+        summary, summary_at = reports.summary_from_json(done.result), done.finished_at
+    else:
+        # Nothing finished for these filters yet (or no job worker is running): read the rollups now
+        summary, summary_at = reports.report_summary(filters), None
+    latest_sale_id = _latest_sale_id()
+    # Revenue, cost and margin come from the columnar analytics store (None without NumPy or before its
+    # first refresh); sales made since its last refresh are appended by a background job, at most one at a time
+    profit = analytics.profit_summary(filters)
+    if analytics.available() and latest_sale_id and (profit is None or (
+            profit['watermark'] < latest_sale_id and _older_than(profit['refreshed_at'], ANALYTICS_REFRESH_INTERVAL))):
+        jobs.enqueue('refresh_analytics', dedupe_key=analytics.JOB_KEY)
     # Render sales report template with data
     return render(request, 'pos_app/sales_report.html', {
-        'sales': sales,
-        'total_sales': total_sales,
-        'average_sale': average_sale
+        'sales': page.items,
+        'page': page,
+        'pager_query': _pager_query(request),
+        'summary': summary,
+        'summary_at': summary_at,
+        'summary_stale': done is not None and done is not job,
+        'profit': profit,
+        'total_sales': summary['total'] if summary else None,
+        'average_sale': summary['average'] if summary else None,
+        'start_date': filters['start_date'].isoformat() if filters['start_date'] else '',
+        'end_date': filters['end_date'].isoformat() if filters['end_date'] else '',
+        'payment_method': filters['payment_method'],
+        'user_filter': filters['user'],
+        'payment_methods': reports.PAYMENT_METHODS,
+        'users': reports.cashier_usernames()
+    })
+
+# View for the reorder report: products at or below their reorder point, from the stored forecasts - requires user login
+@login_required
+@replicas.reporting()
+def reorder_report(request):
+    forecasts = (StockForecast.objects.filter(status__in=[StockForecast.OUT, StockForecast.REORDER])
+                 .select_related('product__category'))
+    page = keyset_paginate(forecasts, REORDER_ORDERING, request.GET.get('cursor'))
+    # Render reorder report template with the forecasts and when they were computed
+    return render(request, 'pos_app/reorder_report.html', {
+        'forecasts': page.items,
+        'page': page,
+        'pager_query': _pager_query(request),
+        'computed_at': StockForecast.objects.order_by().values_list('computed_at', flat=True).first(),
+    })
+
+# Whether a time is unknown or more than seconds ago
+def _older_than(moment, seconds):
+    return moment is None or timezone.now() - moment > timedelta(seconds=seconds)
+
+# Id of the newest sale: a cheap version of the sales data for job results (newest first on the primary key)
+def _latest_sale_id():
+    return Sale.objects.order_by('-pk').values_list('pk', flat=True).first()
+
+# A job the current user may see: their own, or any job for staff (exports of the admin are staff-only)
+def _visible_job(request, **lookup):
+    job = get_object_or_404(Job, **lookup)
+    if job.user_id != request.user.pk and not request.user.is_staff:
+        raise Http404('No such job')
+    return job
+
+# State of a background job as JSON (for polling) or as a page with its progress and result - requires user login
+@login_required
+def job_status(request, pk):
+    job = _visible_job(request, pk=pk)
+    result = job.result if job.status == Job.DONE else None
+    download_url = reverse('pos_app:job_download', args=[job.pk]) if result and 'file' in result else None
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'id': job.pk,
+            'task': job.task,
+            'status': job.status,
+            'progress': job.progress,
+            'message': job.message,
+            'download_url': download_url,
+            'result': None if download_url else result,
+        })
+    return render(request, 'pos_app/job_status.html', {
+        'job': job,
+        'title': job.task.replace('_', ' ').capitalize(),
+        'result': result,
+        'download_url': download_url,
+        'finished': job.status in (Job.DONE, Job.FAILED),
+    })
+
+# Result file of a finished job - requires user login
+@login_required
+def job_download(request, pk):
+    job = _visible_job(request, pk=pk, status=Job.DONE)
+    if not job.result or 'file' not in job.result:
+        raise Http404('This job has no file')
+    try:
+        handle = open(os.path.join(jobs.get_config()['RESULT_DIR'], job.result['file']), 'rb')
+    except FileNotFoundError:
+        raise Http404('The file of this job has been removed')
+    return FileResponse(handle, as_attachment=True, filename=job.result['filename'],
+                        content_type=job.result['content_type'])
+
+# Infinite-scroll feed of products as JSON, one keyset page per request - requires user login
+@login_required
+def product_feed(request):
+    products = Product.objects.select_related('category')
+    category_id = request.GET.get('category', '')
+    if category_id.isdigit():
+        products = products.filter(category_id=int(category_id))
+    page = keyset_paginate(products, PRODUCT_ORDERING, request.GET.get('cursor'))
+    stock.refresh(page.items)
+    return JsonResponse({
+        'results': [
+            {
+                'id': product.pk,
+                'name': product.name,
+                'barcode': product.barcode,
+                'category': product.category.name,
+                'price': str(product.price),
+                'stock_quantity': product.stock_quantity,
+            }
+            for product in page.items
+        ],
+        'next_cursor': page.next_cursor
+    })
+
+# Infinite-scroll feed of sales as JSON, honouring the report filters - requires user login
+@login_required
+@replicas.reporting()
+def sales_feed(request):
+    filters = reports.parse_report_filters(request.GET)
+    sales = reports.filter_sales(Sale.objects.select_related('user'), filters)
+    page = keyset_paginate(sales, SALE_ORDERING, request.GET.get('cursor'))
+    return JsonResponse({
+        'results': [
+            {
+                'id': sale.pk,
+                'user': sale.user.username,
+                'total_amount': str(sale.total_amount),
+                'payment_method': sale.payment_method,
+                'created_at': sale.created_at.isoformat(),
+                'url': reverse('pos_app:sale_detail', args=[sale.pk]),
+            }
+            for sale in page.items
+        ],
+        'next_cursor': page.next_cursor
     })
 
 # View for user registration - accessible to all users